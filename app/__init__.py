@@ -1,17 +1,58 @@
+import importlib
+
+import click
 from flask import Flask, jsonify, make_response
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
-def create_app():
+
+class LazyGroup(click.Group):
+    """CLI group whose module is imported only when one of its commands is used."""
+
+    def __init__(self, name, import_path, **kwargs):
+        super().__init__(name, **kwargs)
+        self.import_path = import_path
+
+    def _group(self):
+        module, attr = self.import_path.split(':')
+        return getattr(importlib.import_module(module), attr)
+
+    def list_commands(self, ctx):
+        return self._group().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._group().get_command(ctx, name)
+
+
+def create_app(config=None):
+    from app.config import Config, engine_options, install_sqlite_pragmas, normalize_database_url
+    from app.serializers import FastJSONProvider
+
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
     
-    # Database Config
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///subscriptions.db'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Database Config (env-driven defaults, then a dict or config object on top)
+    app.config.from_object(Config)
+
+    # Overrides must land before init_app, the engine is bound there
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
 
     db.init_app(app)
 
+    with app.app_context():
+        install_sqlite_pragmas(db.engine, app.config)
+
+    # X-Tenant-ID -> g.tenant_id, before any other request hook reads it
+    from app import tenancy
+    tenancy.init_app(app)
+
     # Register Blueprints
     from app.routes.subscription import bp as sub_bp 
     from app.routes.category import bp as cat_bp 
@@ -23,8 +64,48 @@ def create_app():
     app.register_blueprint(analytics_bp)
     app.register_blueprint(budget_bp)
 
-    with app.app_context():
-        db.create_all()
+    # Per-endpoint histograms at /metrics, opt-in ?profile=1
+    from app import metrics
+    metrics.init_app(app)
+
+    # ETags / response cache for read endpoints
+    from app import http_cache
+    http_cache.init_app(app)
+
+    # Follow-up work off the request path + `flask jobs run`; before any module registers a task
+    from app import jobs
+    jobs.init_app(app)
+    app.cli.add_command(jobs.jobs_cli)
+
+    # Spend aggregate hooks + `flask spend reconcile`
+    from app.spend import spend_cli
+    app.cli.add_command(spend_cli)
+
+    # Renewal schedule hook + `flask renewals roll`
+    from app.renewals import renewals_cli
+    app.cli.add_command(renewals_cli)
+
+    # Memoized exchange rates + `flask fx load`
+    from app import fx
+    fx.init_app(app)
+    app.cli.add_command(fx.fx_cli)
+
+    # Budget threshold events: outbox hook, webhook job, GET /budget/events
+    from app import alerts
+    alerts.init_app(app)
+
+    # Event log / rollup hook + `flask history rebuild`
+    from app.history import history_cli
+    app.cli.add_command(history_cli)
+
+    # Schema: `flask db upgrade`, or on startup when DB_AUTO_UPGRADE is set.
+    # app.migrations is only imported when one of them actually runs.
+    app.cli.add_command(LazyGroup('db', 'app.migrations:db_cli', help='Schema migrations.'))
+
+    if app.config['DB_AUTO_UPGRADE']:
+        from app.migrations import upgrade
+        with app.app_context():
+            upgrade()
 
     # Errors Handlers
     @app.errorhandler(400)
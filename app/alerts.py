@@ -0,0 +1,207 @@
+"""Budget threshold alerts.
+
+Each budget has usage thresholds (percent of its limit, 50/80/100 by default)
+and remembers the highest one spend had reached, alert_level. app.spend marks
+every tenant whose stored spend a transaction moves, and just before that
+transaction commits check_thresholds() compares the new usage with the level:
+a read of the budget row, which the writer already holds locked, and of the
+tenant's few spend_summary rows, never a scan of subscriptions. Each threshold
+passed, up or down, becomes a budget_event row in the same transaction. The
+table is an outbox: an event exists if and only if the spend change committed.
+
+Events leave the outbox two ways. GET /budget/events returns the ones after a
+given id and can hold the request open until one arrives (long poll or
+Server-Sent Events). With BUDGET_WEBHOOK_URL set, a crossing also queues a job
+(app.jobs) that POSTs the tenant's undelivered events in batches and marks
+them delivered; a failed POST is retried with the queue's backoff. Delivery is
+at least once, receivers dedupe by event id.
+"""
+import json
+import threading
+import time
+import urllib.request
+
+from flask import current_app
+from sqlalchemy import event, select
+
+from app import db
+from app.fx import UnknownCurrency, convert_totals
+from app.jobs import enqueue, task, utcnow
+from app.models import Budget, BudgetEvent, SpendSummary, threshold_list
+from app.money import MONTHS
+
+MAX_THRESHOLDS = 10
+MAX_THRESHOLD_PERCENT = 1000
+DELIVER = 'deliver_budget_events'
+# A waiting request also looks for events committed by other processes this often
+FEED_POLL_SECONDS = 1
+
+
+def init_app(app):
+    app.extensions['budget_events'] = EventFeed()
+
+def parse_thresholds(values):
+    """Thresholds from a request (a list of whole percentages) as the stored text. ValueError when malformed."""
+    if not isinstance(values, list) or len(values) > MAX_THRESHOLDS:
+        raise ValueError(f'thresholds must be a list of at most {MAX_THRESHOLDS} percentages')
+    percents = set()
+    for value in values:
+        if (isinstance(value, bool) or not isinstance(value, (int, float))
+                or value != int(value) or not 1 <= value <= MAX_THRESHOLD_PERCENT):
+            raise ValueError(f'thresholds must be whole percentages between 1 and {MAX_THRESHOLD_PERCENT}')
+        percents.add(int(value))
+    return ','.join(str(p) for p in sorted(percents))
+
+def alert_level(thresholds, yearly_spent, limit_minor):
+    """Highest threshold spend has reached, 0 for none. Integers, like the budget check."""
+    limit_year = limit_minor * MONTHS
+    return max((t for t in thresholds if yearly_spent * 100 >= t * limit_year), default=0)
+
+
+# --- Crossing detection ---
+def recheck(session, tenant):
+    """Have the tenant's thresholds checked when the session commits.
+
+    Callers hold the tenant's budget row locked already (spend.lock_budget):
+    spend writers and PUT /budget take it before anything else.
+    """
+    session.info.setdefault('spend_changed', set()).add(tenant)
+
+def evaluate(session, tenant):
+    """Write an event for every threshold the tenant's spend passed since the last check; returns how many."""
+    conn = session.connection()
+    budget = Budget.__table__
+    # A plain read: the row lock recheck()'s caller took keeps concurrent writers' levels in order
+    row = conn.execute(
+        select(budget.c.limit_minor, budget.c.currency, budget.c.thresholds, budget.c.alert_level)
+        .where(budget.c.tenant_id == tenant)
+    ).first()
+    if row is None:
+        return 0
+
+    summary = SpendSummary.__table__
+    totals = dict(conn.execute(
+        select(summary.c.currency, summary.c.yearly_total).where(summary.c.tenant_id == tenant)
+    ).all())
+    try:
+        spent = convert_totals(totals, row.currency)
+    except UnknownCurrency as e:
+        # Never fail the write over an alert; the next change checks again
+        current_app.logger.warning('budget thresholds for %s not checked: %s', tenant, e)
+        return 0
+    thresholds = threshold_list(row.thresholds)
+    level = alert_level(thresholds, spent, row.limit_minor)
+    if level == row.alert_level:
+        return 0
+
+    conn.execute(budget.update().where(budget.c.tenant_id == tenant).values(alert_level=level))
+    low, high = sorted((row.alert_level, level))
+    up = level > row.alert_level
+    # In the order spend passed them
+    crossed = sorted((t for t in thresholds if low < t <= high), reverse=not up)
+    if not crossed:
+        return 0
+    now = utcnow()
+    conn.execute(BudgetEvent.__table__.insert(), [
+        {"tenant_id": tenant, "threshold": t, "direction": 'up' if up else 'down',
+         "yearly_spent": spent, "limit_minor": row.limit_minor, "currency": row.currency, "created_at": now}
+        for t in crossed
+    ])
+    session.info['budget_events'] = True
+    if current_app.config['BUDGET_WEBHOOK_URL']:
+        enqueue(session, DELIVER, tenant=tenant)
+    return len(crossed)
+
+@event.listens_for(db.session, 'before_commit')
+def check_thresholds(session):
+    # A savepoint release is not the end of the transaction
+    if session.in_nested_transaction():
+        return
+    # The commit's own flush may still move spend, so run it first
+    session.flush()
+    for tenant in sorted(session.info.pop('spend_changed', ())):
+        evaluate(session, tenant)
+
+@event.listens_for(db.session, 'after_commit')
+def publish_events(session):
+    if session.info.pop('budget_events', False):
+        current_app.extensions['budget_events'].publish()
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_spend_changes(session):
+    session.info.pop('spend_changed', None)
+    session.info.pop('budget_events', None)
+
+
+# --- Feed ---
+class EventFeed:
+    """Wakes requests waiting in GET /budget/events when this process commits an event."""
+
+    def __init__(self):
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def publish(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, seen, timeout):
+        with self._changed:
+            return self._changed.wait_for(lambda: self.version != seen, timeout)
+
+def events_after(tenant, after, limit=100):
+    return (
+        BudgetEvent.query
+        .filter(BudgetEvent.tenant_id == tenant, BudgetEvent.id > after)
+        .order_by(BudgetEvent.id)
+        .limit(limit)
+        .all()
+    )
+
+def wait_for_events(tenant, after, wait, limit=100):
+    """events_after(), waiting up to `wait` seconds for the first one."""
+    feed = current_app.extensions['budget_events']
+    deadline = time.monotonic() + wait
+    while True:
+        seen = feed.version
+        events = events_after(tenant, after, limit)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return events
+        # Hand the connection back while waiting
+        db.session.rollback()
+        feed.wait(seen, min(remaining, FEED_POLL_SECONDS))
+
+
+# --- Webhook delivery ---
+def post_events(url, tenant, events):
+    body = json.dumps({"tenant": tenant, "events": events}).encode()
+    request = urllib.request.Request(url, data=body, method='POST', headers={'Content-Type': 'application/json'})
+    # 4xx/5xx raise HTTPError, and the job is retried
+    with urllib.request.urlopen(request, timeout=current_app.config['BUDGET_WEBHOOK_TIMEOUT']) as response:
+        if not 200 <= response.status < 300:
+            raise RuntimeError(f'webhook answered {response.status}')
+
+@task(DELIVER)
+def deliver(payloads, tenant):
+    url = current_app.config['BUDGET_WEBHOOK_URL']
+    if not url:
+        return
+    table = BudgetEvent.__table__
+    while True:
+        events = (
+            BudgetEvent.query
+            .filter(BudgetEvent.tenant_id == tenant, BudgetEvent.delivered_at.is_(None))
+            .order_by(BudgetEvent.id)
+            .limit(current_app.config['BUDGET_WEBHOOK_BATCH'])
+            .all()
+        )
+        if not events:
+            return
+        post_events(url, tenant, [e.to_json() for e in events])
+        # Each batch is marked as soon as it is accepted, a retry only sends the rest
+        db.session.execute(
+            table.update().where(table.c.id.in_([e.id for e in events])).values(delivered_at=utcnow())
+        )
+        db.session.commit()
@@ -0,0 +1,254 @@
+import csv
+import io
+import json
+from datetime import date
+
+from sqlalchemy import select
+
+from app import db
+from app.models import Subscription, FrequencyType, StatusType, yearly_minor
+from app.fx import parse_known
+from app.money import default_currency, price_error, to_minor
+from app.renewals import next_charge, parse_anchor
+
+REQUIRED_FIELDS = ('name', 'price', 'frequency', 'category')
+FREQUENCIES = {e.value: e for e in FrequencyType}
+STATUSES = {e.value: e for e in StatusType}
+
+MAX_BULK_ROWS = 100_000
+INSERT_CHUNK = 1000
+LOOKUP_CHUNK = 500
+
+
+class BulkParseError(ValueError):
+    pass
+
+
+# --- Parsing ---
+def parse_rows(body, mimetype):
+    """Turn a JSON array, NDJSON or CSV body into a list of dicts."""
+    text = body.decode('utf-8-sig') if isinstance(body, bytes) else body
+
+    if mimetype == 'text/csv':
+        return list(csv.DictReader(io.StringIO(text)))
+
+    if mimetype == 'application/x-ndjson':
+        rows = []
+        for line_no, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                raise BulkParseError(f'Invalid JSON on line {line_no}')
+        return rows
+
+    try:
+        rows = json.loads(text)
+    except ValueError:
+        raise BulkParseError('Body must be a JSON array')
+    if not isinstance(rows, list):
+        raise BulkParseError('Body must be a JSON array')
+    return rows
+
+
+# --- Validation ---
+def _key(value):
+    # Typed, so True, 1 and 1.0 stay apart; JSON lists and objects can't be dict keys, their text can
+    if isinstance(value, tuple):
+        return tuple(_key(v) for v in value)
+    try:
+        hash(value)
+        return type(value), value
+    except TypeError:
+        return type(value), repr(value)
+
+def _member(members):
+    def parse(value):
+        try:
+            return members[value]
+        except (KeyError, TypeError):
+            raise ValueError(value)
+    return parse
+
+def validate_rows(rows):
+    """Validate the batch a column at a time. Returns (valid, errors).
+
+    Each check runs over every row still standing before the next one, so a
+    row reports the first check it fails. Currency, enum and date columns hold
+    few distinct values, and each is parsed once for the whole batch. valid
+    holds (index, params) where params are ready for INSERT minus
+    category_id; errors holds {"row", "error"} dicts in row order.
+    """
+    errors = []
+    pending = []
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append({"row": i, "error": "Row must be an object"})
+            continue
+        missing = [k for k in REQUIRED_FIELDS if row.get(k) in (None, '')]
+        if missing:
+            errors.append({"row": i, "error": f"Missing required fields: {missing}"})
+            continue
+        pending.append(i)
+
+    def check(value, parse, message):
+        # {row: parse(value(row))} over the rows still standing; rows whose
+        # value raises ValueError are reported and dropped
+        nonlocal pending
+        parsed, seen, failed = {}, {}, set()
+        for i in pending:
+            v = value(i)
+            key = _key(v)
+            if key not in seen:
+                try:
+                    seen[key] = parse(v)
+                except ValueError as e:
+                    seen[key] = e
+            parsed[i] = seen[key]
+            if isinstance(parsed[i], ValueError):
+                failed.add(i)
+                errors.append({"row": i, "error": message(parsed[i], v)})
+        pending = [i for i in pending if i not in failed]
+        return parsed
+
+    default = default_currency()
+    currency = check(lambda i: rows[i].get('currency'), lambda c: parse_known(c, default),
+                     lambda e, c: str(e))
+    price_minor = check(lambda i: (rows[i]['price'], currency[i]), lambda p: to_minor(*p),
+                        lambda e, p: price_error(p[1]))
+    frequency = check(lambda i: rows[i]['frequency'], _member(FREQUENCIES),
+                      lambda e, f: f"Invalid frequency. Allowed: {list(FREQUENCIES)}")
+    status = check(lambda i: rows[i].get('status') or StatusType.ACTIVE.value, _member(STATUSES),
+                   lambda e, s: f"Invalid status. Allowed: {list(STATUSES)}")
+    today = date.today()
+    anchor = check(lambda i: rows[i].get('billing_anchor') or None, lambda a: parse_anchor(a) if a else today,
+                   lambda e, a: "billing_anchor must be an ISO date (YYYY-MM-DD)")
+    # Core inserts skip the renewal hook, so the schedule is set here; it only depends on these two
+    next_charge_at = check(lambda i: (anchor[i], frequency[i]), lambda k: next_charge(*k), None)
+
+    valid = []
+    seen = set()
+    for i in pending:
+        name = str(rows[i]['name'])
+        if name in seen:
+            errors.append({"row": i, "error": f"Duplicate name in batch: {name}"})
+            continue
+        seen.add(name)
+        valid.append((i, {
+            "name": name,
+            "price_minor": price_minor[i],
+            "currency": currency[i],
+            "frequency": frequency[i],
+            "status": status[i],
+            "category": str(rows[i]['category']),
+            "billing_anchor": anchor[i],
+            "next_charge_at": next_charge_at[i],
+        }))
+
+    errors.sort(key=lambda e: e['row'])
+    return valid, errors
+
+def existing_names(names, tenant):
+    found = set()
+    names = list(names)
+    for i in range(0, len(names), LOOKUP_CHUNK):
+        found.update(db.session.scalars(
+            select(Subscription.name)
+            .where(Subscription.tenant_id == tenant)
+            .where(Subscription.name.in_(names[i:i + LOOKUP_CHUNK]))
+        ))
+    return found
+
+def batch_spend(valid):
+    """{currency: (amount, count)} the batch adds to active spend."""
+    rows = [params for _, params in valid if params['status'] == StatusType.ACTIVE]
+    return spend_by_currency(
+        rows, [yearly_minor(p['price_minor'], p['frequency']) for p in rows], [1] * len(rows)
+    )
+
+def spend_by_currency(rows, amounts, counts):
+    """Per-row spend changes summed into {currency: (amount, count)}."""
+    totals = {}
+    for row, amount, count in zip(rows, amounts, counts):
+        currency = row['currency'] if isinstance(row, dict) else row.currency
+        total = totals.get(currency, (0, 0))
+        totals[currency] = (total[0] + amount, total[1] + count)
+    return totals
+
+
+# --- Insert ---
+def insert_rows(params):
+    # executemany in fixed-size chunks, bypassing the ORM unit of work
+    table = Subscription.__table__
+    for i in range(0, len(params), INSERT_CHUNK):
+        db.session.execute(table.insert(), params[i:i + INSERT_CHUNK])
+
+
+# --- Set-based mutations ---
+def _id_chunks(ids):
+    # One pass without an id condition when the scope is filters only
+    if ids is None:
+        yield ()
+        return
+    for i in range(0, len(ids), LOOKUP_CHUNK):
+        yield (Subscription.id.in_(ids[i:i + LOOKUP_CHUNK]),)
+
+def _returned(table):
+    return (table.c.id, table.c.category_id, table.c.price_minor, table.c.currency,
+            table.c.frequency, table.c.status, table.c.billing_anchor)
+
+def update_status(where, ids, status, tenant):
+    """UPDATE ... RETURNING every matching row not already in status.
+
+    Returns (rows with their new values, whether each row was active before).
+    RETURNING only sees new values, so rows leaving Active get their own
+    statement: the old status is what decides the spend effect.
+    """
+    table = Subscription.__table__
+    active = table.c.status == StatusType.ACTIVE
+    if status == StatusType.ACTIVE:
+        groups = [(False, ~active)]
+    else:
+        groups = [(True, active), (False, ~active & (table.c.status != status))]
+
+    rows, was_active = [], []
+    for old_active, condition in groups:
+        for chunk in _id_chunks(ids):
+            changed = db.session.execute(
+                table.update()
+                .where(table.c.tenant_id == tenant, condition, *where, *chunk)
+                .values(status=status)
+                .returning(*_returned(table))
+            ).all()
+            rows += changed
+            was_active += [old_active] * len(changed)
+
+    # The Core UPDATE skips the schedule_next_charge flush hook: recompute the
+    # next charge here, as a status change through PUT does
+    today = date.today()
+    schedule = [
+        {"_id": row.id, "_anchor": row.billing_anchor or today,
+         "_next": next_charge(row.billing_anchor or today, row.frequency, today)}
+        for row in rows
+    ]
+    stmt = (
+        table.update()
+        .where(table.c.tenant_id == tenant, table.c.id == db.bindparam('_id'))
+        .values(billing_anchor=db.bindparam('_anchor'), next_charge_at=db.bindparam('_next'))
+    )
+    for i in range(0, len(schedule), INSERT_CHUNK):
+        db.session.execute(stmt, schedule[i:i + INSERT_CHUNK])
+    return rows, was_active
+
+def delete_rows(where, ids, tenant):
+    """DELETE ... RETURNING every matching row, with the values it had."""
+    table = Subscription.__table__
+    rows = []
+    for chunk in _id_chunks(ids):
+        rows += db.session.execute(
+            table.delete()
+            .where(table.c.tenant_id == tenant, *where, *chunk)
+            .returning(*_returned(table))
+        ).all()
+    return rows
@@ -0,0 +1,121 @@
+import importlib
+from collections import namedtuple
+
+from sqlalchemy import event, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.cache import LRUCache
+from app.models import Category
+from app.tenancy import current_tenant
+
+CachedCategory = namedtuple('CachedCategory', ['id', 'name'])
+
+# (tenant, lowercased name) -> CachedCategory, only ever holds committed categories
+category_cache = LRUCache(maxsize=2048)
+
+# Dialects with INSERT ... ON CONFLICT. Imported on first use: the postgresql
+# package alone takes longer to import than the whole app
+UPSERT_DIALECTS = ('sqlite', 'postgresql')
+
+# Keeps IN (...) lists under SQLite's bound parameter limit
+LOOKUP_CHUNK = 500
+
+
+def upsert_insert(dialect):
+    """The dialect's insert() construct (has on_conflict_do_nothing), or None."""
+    if dialect not in UPSERT_DIALECTS:
+        return None
+    return importlib.import_module(f'sqlalchemy.dialects.{dialect}').insert
+
+def normalize(name):
+    return name.lower()
+
+def _lookup_many(tenant, keys):
+    found = {}
+    keys = list(keys)
+    for i in range(0, len(keys), LOOKUP_CHUNK):
+        rows = db.session.execute(
+            select(Category.id, Category.name, Category.name_lower)
+            .where(Category.tenant_id == tenant)
+            .where(Category.name_lower.in_(keys[i:i + LOOKUP_CHUNK]))
+        )
+        for row in rows:
+            found[row.name_lower] = CachedCategory(row.id, row.name)
+    return found
+
+def _insert_if_missing(values):
+    # values: list of {"tenant_id", "name", "name_lower"} dicts
+    dialect = db.session.get_bind().dialect.name
+    insert = upsert_insert(dialect)
+
+    if insert is not None:
+        # INSERT ... ON CONFLICT DO NOTHING: a concurrent creator wins, we reuse its row
+        db.session.execute(
+            insert(Category.__table__).on_conflict_do_nothing(index_elements=['tenant_id', 'name_lower']),
+            values
+        )
+        return
+
+    for value in values:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(Category.__table__.insert().values(**value))
+        except IntegrityError:
+            pass
+
+def _remember(tenant, key, category):
+    # Only cache once the surrounding transaction has committed
+    db.session.info.setdefault('category_cache_pending', {})[(tenant, key)] = category
+
+def resolve_categories(names, tenant=None):
+    """Map every name to the tenant's CachedCategory, creating missing ones in one batch."""
+    tenant = tenant or current_tenant()
+
+    # 1. First spelling of each case-insensitive name wins
+    wanted = {}
+    for name in names:
+        wanted.setdefault(normalize(name), name)
+
+    # 2. Cache, then one indexed lookup for the rest
+    resolved = {}
+    for key in wanted:
+        cached = category_cache.get((tenant, key))
+        if cached is not None:
+            resolved[key] = cached
+
+    missing = [key for key in wanted if key not in resolved]
+    if missing:
+        resolved.update(_lookup_many(tenant, missing))
+
+    # 3. Create whatever is still missing inside the caller's transaction
+    missing = [key for key in wanted if key not in resolved]
+    if missing:
+        _insert_if_missing([
+            {"tenant_id": tenant, "name": wanted[key].capitalize(), "name_lower": key}
+            for key in missing
+        ])
+        resolved.update(_lookup_many(tenant, missing))
+
+    for key, category in resolved.items():
+        _remember(tenant, key, category)
+    return resolved
+
+def get_or_create_category(category_name):
+    return resolve_categories([category_name])[normalize(category_name)]
+
+
+# --- Session Hooks ---
+@event.listens_for(db.session, 'after_commit')
+def publish_pending(session):
+    for key, category in session.info.pop('category_cache_pending', {}).items():
+        category_cache.put(key, category)
+
+@event.listens_for(db.session, 'after_rollback')
+def drop_pending(session):
+    session.info.pop('category_cache_pending', None)
+
+@event.listens_for(Category.__table__, 'after_drop')
+def clear_on_drop(target, connection, **kw):
+    # Cached ids are meaningless once the table is gone (drop_all in seed/tests)
+    category_cache.clear()
@@ -0,0 +1,110 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def _env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+def normalize_database_url(url):
+    # Heroku-style postgres:// URLs are rejected by SQLAlchemy 1.4+
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = normalize_database_url(
+        os.environ.get('DATABASE_URL', 'sqlite:///subscriptions.db')
+    )
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Run pending migrations inside create_app. Off by default: schema changes are
+    # an explicit step (`flask db upgrade`, app.migrations.upgrade) and workers start faster
+    DB_AUTO_UPGRADE = _env_bool('DB_AUTO_UPGRADE', False)
+
+    # ISO 4217 code for prices and budgets (amounts are stored in its minor unit)
+    CURRENCY = os.environ.get('CURRENCY', 'USD').upper()
+    # Exchange rates: file read by `flask fx load`, and how long a looked-up rate is memoized
+    FX_RATES_FILE = os.environ.get('FX_RATES_FILE')
+    FX_CACHE_TTL = _env_int('FX_CACHE_TTL', 300)
+
+    # Pool (ignored for in-memory SQLite, which uses a single shared connection)
+    DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 5)
+    DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 10)
+    DB_POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', 1800)
+    DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', True)
+
+    # SQLite pragmas applied to every new connection
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+    SQLITE_MMAP_SIZE = _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    SQLITE_CACHE_SIZE = _env_int('SQLITE_CACHE_SIZE', -64000)  # negative = KiB
+
+    # Rendered GET responses, keyed by data version (see app.http_cache)
+    HTTP_CACHE_TTL = _env_int('HTTP_CACHE_TTL', 30)
+    HTTP_CACHE_MAX_ENTRIES = _env_int('HTTP_CACHE_MAX_ENTRIES', 256)
+
+    # Background jobs: worker threads per process (0 runs them inline after the request),
+    # idle poll interval, how long a wake-up waits for more jobs to batch with,
+    # attempts before a job is left failed, and when a claimed job counts as abandoned
+    JOBS_WORKERS = _env_int('JOBS_WORKERS', 2)
+    JOBS_POLL_SECONDS = float(os.environ.get('JOBS_POLL_SECONDS', 1))
+    JOBS_BATCH_SECONDS = float(os.environ.get('JOBS_BATCH_SECONDS', 0.05))
+    JOBS_MAX_ATTEMPTS = _env_int('JOBS_MAX_ATTEMPTS', 5)
+    JOBS_STALE_SECONDS = _env_int('JOBS_STALE_SECONDS', 300)
+
+    # Budget threshold events: POSTed in batches to this URL (unset = feed only, see app.alerts),
+    # and the longest GET /budget/events may hold a request open
+    BUDGET_WEBHOOK_URL = os.environ.get('BUDGET_WEBHOOK_URL') or None
+    BUDGET_WEBHOOK_BATCH = _env_int('BUDGET_WEBHOOK_BATCH', 100)
+    BUDGET_WEBHOOK_TIMEOUT = float(os.environ.get('BUDGET_WEBHOOK_TIMEOUT', 5))
+    BUDGET_EVENTS_MAX_WAIT = _env_int('BUDGET_EVENTS_MAX_WAIT', 60)
+
+    # Allow ?profile=1 / X-Profile: 1 to return a cProfile report instead of the response
+    PROFILING_ENABLED = _env_bool('PROFILING_ENABLED', False)
+
+
+def is_memory_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS built from the DB_* settings."""
+    url = config['SQLALCHEMY_DATABASE_URI']
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    if not is_memory_sqlite(url):
+        options['pool_size'] = config['DB_POOL_SIZE']
+        options['max_overflow'] = config['DB_MAX_OVERFLOW']
+    if make_url(url).get_backend_name() == 'sqlite':
+        # Seconds the driver waits on a locked database before raising
+        options['connect_args'] = {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}
+    return options
+
+def sqlite_pragmas(config):
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",
+    ]
+
+def install_sqlite_pragmas(engine, config):
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
@@ -0,0 +1,160 @@
+"""Exchange rates for showing totals in another currency.
+
+Rates are read from a JSON file into the fx_rate table (`flask fx load`), so
+no request ever needs the network:
+
+    {"base": "EUR", "date": "2026-10-01", "rates": {"USD": "1.0712", "JPY": "161.32"}}
+
+Each rate is units of that currency per one unit of base. Conversions are
+exact Decimal arithmetic on minor units, rounded half away from zero once at
+the end. Totals are summed per currency in SQL and converted afterwards, one
+multiply per currency instead of one per row. The (source, target) factors
+are memoized in process memory for FX_CACHE_TTL seconds; loading a file
+clears them.
+"""
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+import json
+import re
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import case, select
+
+from app import db
+from app.cache import LRUCache
+from app.models import FxRate
+from app.money import default_currency, digits
+
+CODE = re.compile(r'^[A-Z]{3}$')
+ONE = Decimal(1)
+
+
+class UnknownCurrency(ValueError):
+    """No rate is loaded for the currency."""
+
+
+def init_app(app):
+    app.extensions['fx'] = LRUCache(maxsize=256, ttl=app.config['FX_CACHE_TTL'])
+
+def _memo():
+    return current_app.extensions['fx']
+
+def parse_currency(value, default=None):
+    """An ISO 4217 code from a request, uppercased. ValueError when malformed."""
+    if value is None or value == '':
+        return default or default_currency()
+    code = value.strip().upper() if isinstance(value, str) else None
+    if not code or not CODE.match(code):
+        raise ValueError('currency must be a 3-letter ISO 4217 code')
+    return code
+
+
+# --- Rates ---
+def rate(source, target):
+    """Decimal factor from an amount in source to the same amount in target."""
+    if source == target:
+        return ONE
+    memo = _memo()
+    factor = memo.get((source, target))
+    if factor is None:
+        rates = dict(db.session.execute(
+            select(FxRate.currency, FxRate.rate).where(FxRate.currency.in_((source, target)))
+        ).all())
+        for currency in (source, target):
+            if currency not in rates:
+                raise UnknownCurrency(f'No exchange rate loaded for {currency}')
+        factor = Decimal(rates[target]) / Decimal(rates[source])
+        memo.put((source, target), factor)
+    return factor
+
+def check(currency):
+    """Raise UnknownCurrency unless amounts in currency can be converted to the default one."""
+    rate(currency, default_currency())
+
+def parse_known(value, default=None):
+    """parse_currency() for a currency amounts can be stored in: one with a loaded rate."""
+    currency = parse_currency(value, default)
+    check(currency)
+    return currency
+
+def convert(minor, source, target):
+    """Minor units of source as whole minor units of target."""
+    if source == target or not minor:
+        return minor or 0
+    value = (Decimal(minor) * rate(source, target)).scaleb(digits(target) - digits(source))
+    return int(value.to_integral_value(ROUND_HALF_UP))
+
+def convert_totals(totals, target):
+    """Sum {currency: minor units} in target, converting each currency's total once."""
+    return sum(convert(minor, currency, target) for currency, minor in totals.items())
+
+def minor_factor_expr(column, currencies, target):
+    """SQL factor from minor units in `column` to minor units of target, for ordering only."""
+    factors = {
+        currency: float(rate(currency, target).scaleb(digits(target) - digits(currency)))
+        for currency in currencies if currency != target
+    }
+    if not factors:
+        return 1.0
+    return case(factors, value=column, else_=1.0)
+
+
+# --- Loading ---
+def read_file(path):
+    """(base, as_of, {currency: rate text}) from a rates file, the base included at 1."""
+    with open(path) as f:
+        data = json.load(f, parse_float=Decimal)
+    try:
+        base = parse_currency(data['base'])
+        as_of = date.fromisoformat(data['date']) if data.get('date') else None
+        rates = {base: '1'}
+        for code, value in data['rates'].items():
+            value = Decimal(str(value))
+            if not value.is_finite() or value <= 0:
+                raise ValueError(f'rate for {code} must be a positive number')
+            rates[parse_currency(code)] = str(value)
+    except (KeyError, TypeError, AttributeError, InvalidOperation) as e:
+        raise ValueError(f'malformed rates file: {e!r}')
+    return base, as_of, rates
+
+def load_file(path):
+    """Replace the stored rates with the file's, returning how many were loaded."""
+    base, as_of, rates = read_file(path)
+    table = FxRate.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert(), [
+        {"currency": currency, "rate": value, "base": base, "as_of": as_of}
+        for currency, value in sorted(rates.items())
+    ])
+    # The commit also moves every tenant's response cache version, see app.http_cache
+    db.session.commit()
+    _memo().clear()
+    return len(rates)
+
+
+# --- CLI ---
+@click.group('fx')
+def fx_cli():
+    """Exchange rates."""
+
+@fx_cli.command('load')
+@click.argument('path', required=False)
+@with_appcontext
+def load_command(path):
+    """Load rates from PATH (default: FX_RATES_FILE)."""
+    path = path or current_app.config['FX_RATES_FILE']
+    if not path:
+        raise click.UsageError('No rates file given and FX_RATES_FILE is not set.')
+    try:
+        count = load_file(path)
+    except (OSError, ValueError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{count} rates loaded from {path}.")
+
+@fx_cli.command('show')
+@with_appcontext
+def show_command():
+    for row in db.session.scalars(select(FxRate).order_by(FxRate.currency)):
+        click.echo(f"{row.currency}  {row.rate}  (per {row.base}, {row.as_of or 'undated'})")
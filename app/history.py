@@ -0,0 +1,412 @@
+"""Spend history: an append-only event log plus daily and monthly rollups.
+
+Every change to a subscription's price, frequency, status or category
+appends an event carrying its effect on active spend, in yearly minor units
+(exact integers, see app.money). The same flush queues a job (app.jobs) that
+bumps one spend_rollup row per (granularity, period, currency, category). Each row stores that period's
+change and the closing total in the subscription's own currency. Reading a
+history range costs one index seek per category and currency for the opening
+balance, plus the rollup rows in the range. It does not depend on the length
+of the event log. Levels are converted to the requested currency per period,
+one multiply per currency (see app.fx).
+"""
+from datetime import date, datetime, timezone
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, event, func, inspect, select
+
+from app import db
+from app.models import Category, Subscription, SubscriptionEvent, SpendRollup
+from app.fx import convert, convert_totals
+from app.http_cache import ALL_TENANTS, bump, changed
+from app.jobs import enqueue, task
+from app.money import default_currency, monthly_amount
+from app.spend import _committed, _contribution, _new_contribution, _old_contribution
+from app.tenancy import current_tenant
+
+GRANULARITIES = ('day', 'month')
+# Longest range one request may ask for, in periods
+MAX_PERIODS = {'day': 366, 'month': 120}
+LOGGED_FIELDS = ('price_minor', 'currency', 'frequency', 'status', 'category_id')
+# Event values before a change, for moves and deletes
+OLD_VALUES = ('price_minor', 'currency', 'frequency', 'status')
+LOOKUP_CHUNK = 500
+
+
+# --- Periods ---
+def period_start(day, granularity):
+    return day.replace(day=1) if granularity == 'month' else day
+
+def next_period(period, granularity):
+    if granularity == 'day':
+        return date.fromordinal(period.toordinal() + 1)
+    year, month = divmod(period.month, 12)
+    return date(period.year + year, month + 1, 1)
+
+def periods_between(start, end, granularity):
+    period = period_start(start, granularity)
+    while period <= end:
+        yield period
+        period = next_period(period, granularity)
+
+def period_count(start, end, granularity):
+    if granularity == 'day':
+        return (end - start).days + 1
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# --- Writing ---
+def _event(obj, kind, category_id, delta, when, values=None):
+    price_minor, currency, frequency, status = values or (obj.price_minor, obj.currency, obj.frequency, obj.status)
+    return {
+        "tenant_id": obj.tenant_id or current_tenant(),
+        "subscription_id": obj.id,
+        "category_id": category_id,
+        "kind": kind,
+        "occurred_at": when,
+        "price_minor": price_minor,
+        "currency": currency,
+        "frequency": frequency,
+        "status": status,
+        "yearly_delta": delta,
+    }
+
+def _opening_totals(conn, series, period, category_ids):
+    # Latest closing total before period for each category that has one
+    table = SpendRollup.__table__
+    totals = {}
+    for i in range(0, len(category_ids), LOOKUP_CHUNK):
+        latest = (
+            select(table.c.category_id, func.max(table.c.period).label('period'))
+            .where(series & (table.c.period < period) & table.c.category_id.in_(category_ids[i:i + LOOKUP_CHUNK]))
+            .group_by(table.c.category_id)
+            .subquery()
+        )
+        totals.update(conn.execute(
+            select(table.c.category_id, table.c.yearly_closing)
+            .join(latest, (table.c.category_id == latest.c.category_id) & (table.c.period == latest.c.period))
+            .where(series)
+        ).all())
+    return totals
+
+def _bump_rollups(conn, buckets):
+    """Add {(tenant, granularity, period, currency, category_id): [delta, events]} to spend_rollup.
+
+    Existing rows are bumped with one executemany UPDATE; new ones start from
+    the previous period's closing total and go in with one executemany INSERT.
+    Closing totals of later periods move too, so jobs folded out of order
+    (a retry, a slow worker) end up with the same rollups.
+    """
+    table = SpendRollup.__table__
+    periods = {}
+    for (tenant, granularity, period, currency, category_id), value in buckets.items():
+        periods.setdefault((tenant, granularity, period, currency), {})[category_id] = value
+
+    updates, inserts = [], []
+    for (tenant, granularity, period, currency), values in periods.items():
+        series = (
+            (table.c.tenant_id == tenant) & (table.c.granularity == granularity) & (table.c.currency == currency)
+        )
+        category_ids = list(values)
+        existing = set()
+        for i in range(0, len(category_ids), LOOKUP_CHUNK):
+            existing.update(conn.execute(
+                select(table.c.category_id)
+                .where(series & (table.c.period == period))
+                .where(table.c.category_id.in_(category_ids[i:i + LOOKUP_CHUNK]))
+            ).scalars())
+        missing = [c for c in category_ids if c not in existing]
+        opening = _opening_totals(conn, series, period, missing) if missing else {}
+
+        for category_id, (delta, events) in values.items():
+            key = {
+                "b_tenant": tenant, "b_granularity": granularity, "b_period": period,
+                "b_currency": currency, "b_category": category_id
+            }
+            if category_id in existing:
+                updates.append(dict(key, b_delta=delta, b_events=events))
+            else:
+                # First event in this period: carry the previous period's closing total
+                inserts.append({
+                    "tenant_id": tenant, "granularity": granularity, "period": period,
+                    "currency": currency, "category_id": category_id,
+                    "yearly_change": delta, "yearly_closing": opening.get(category_id, 0) + delta, "events": events
+                })
+
+    if updates:
+        conn.execute(
+            table.update()
+            .where(table.c.tenant_id == bindparam('b_tenant'))
+            .where(table.c.granularity == bindparam('b_granularity'))
+            .where(table.c.currency == bindparam('b_currency'))
+            .where(table.c.category_id == bindparam('b_category'))
+            .where(table.c.period == bindparam('b_period'))
+            .values(
+                yearly_change=table.c.yearly_change + bindparam('b_delta'),
+                yearly_closing=table.c.yearly_closing + bindparam('b_delta'),
+                events=table.c.events + bindparam('b_events')
+            ),
+            updates
+        )
+    if inserts:
+        conn.execute(table.insert(), inserts)
+
+    later = [{k: v for k, v in row.items() if k != 'b_events'} for row in updates] + [
+        {"b_tenant": r["tenant_id"], "b_granularity": r["granularity"], "b_period": r["period"],
+         "b_currency": r["currency"], "b_category": r["category_id"], "b_delta": r["yearly_change"]}
+        for r in inserts
+    ]
+    if later:
+        # Normally the newest period: an index seek that matches nothing
+        conn.execute(
+            table.update()
+            .where(table.c.tenant_id == bindparam('b_tenant'))
+            .where(table.c.granularity == bindparam('b_granularity'))
+            .where(table.c.currency == bindparam('b_currency'))
+            .where(table.c.category_id == bindparam('b_category'))
+            .where(table.c.period > bindparam('b_period'))
+            .values(yearly_closing=table.c.yearly_closing + bindparam('b_delta')),
+            later
+        )
+
+def record_events(session, events):
+    """Append events and queue folding them into the day and month rollups."""
+    if not events:
+        return
+    session.connection().execute(SubscriptionEvent.__table__.insert(), events)
+
+    # tenant -> [[granularity, period, currency, category_id, delta, events]]
+    buckets = {}
+    for e in events:
+        day = e['occurred_at'].date()
+        for granularity in GRANULARITIES:
+            key = (e['tenant_id'], granularity, period_start(day, granularity).isoformat(), e['currency'], e['category_id'])
+            bucket = buckets.setdefault(key, [0, 0])
+            bucket[0] += e['yearly_delta']
+            bucket[1] += 1
+    tenants = {}
+    for (tenant, *key), value in buckets.items():
+        tenants.setdefault(tenant, []).append(key + value)
+    for tenant, rows in tenants.items():
+        enqueue(session, 'fold_rollups', {"buckets": rows}, tenant)
+
+@task('fold_rollups')
+def fold_rollups(payloads, tenant):
+    # Every queued flush for the tenant merged into one set of buckets
+    buckets = {}
+    for payload in payloads:
+        for granularity, period, currency, category_id, delta, events in payload['buckets']:
+            bucket = buckets.setdefault((tenant, granularity, date.fromisoformat(period), currency, category_id), [0, 0])
+            bucket[0] += delta
+            bucket[1] += events
+    _bump_rollups(db.session.connection(), buckets)
+    # Core writes on the connection: /analytics/history must not serve the pre-fold totals
+    changed(db.session, tenant)
+
+def log_inserted(session, tenant, names):
+    """Events for rows written with Core inserts (bulk import), found again by name."""
+    when = utcnow()
+    table = Subscription.__table__
+    names = list(names)
+    events = []
+    for i in range(0, len(names), LOOKUP_CHUNK):
+        rows = session.execute(
+            select(table.c.id, table.c.category_id, table.c.price_minor, table.c.currency,
+                   table.c.frequency, table.c.status)
+            .where(table.c.tenant_id == tenant)
+            .where(table.c.name.in_(names[i:i + LOOKUP_CHUNK]))
+        )
+        for id, category_id, price_minor, currency, frequency, status in rows:
+            events.append({
+                "tenant_id": tenant, "subscription_id": id, "category_id": category_id,
+                "kind": "created", "occurred_at": when,
+                "price_minor": price_minor, "currency": currency, "frequency": frequency, "status": status,
+                "yearly_delta": _contribution(price_minor, frequency, status)[0],
+            })
+    record_events(session, events)
+
+def log_rows(session, tenant, kind, rows, deltas):
+    """Events for rows changed by a set-based UPDATE/DELETE ... RETURNING."""
+    when = utcnow()
+    record_events(session, [
+        {
+            "tenant_id": tenant, "subscription_id": row.id, "category_id": row.category_id,
+            "kind": kind, "occurred_at": when,
+            "price_minor": row.price_minor, "currency": row.currency,
+            "frequency": row.frequency, "status": row.status,
+            "yearly_delta": delta,
+        }
+        for row, delta in zip(rows, deltas)
+    ])
+
+
+
+# --- Session Hook ---
+@event.listens_for(db.session, 'after_flush')
+def log_changes(session, flush_context):
+    # Ids are assigned by now, but new/dirty/deleted and attribute history are still pre-flush
+    when = utcnow()
+    events = []
+
+    for obj in session.new:
+        if isinstance(obj, Subscription):
+            events.append(_event(obj, 'created', obj.category_id, _new_contribution(obj)[0], when))
+
+    for obj in session.dirty:
+        if not isinstance(obj, Subscription):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[f].history.has_changes() for f in LOGGED_FIELDS):
+            continue
+        old_amount = _old_contribution(state)[0]
+        new_amount = _new_contribution(obj)[0]
+        old_category = _committed(state, 'category_id')
+        if old_category == obj.category_id and _committed(state, 'currency') == obj.currency:
+            events.append(_event(obj, 'updated', obj.category_id, new_amount - old_amount, when))
+        else:
+            # One event per category and currency keeps every event inside a single rollup bucket
+            old_values = tuple(_committed(state, f) for f in OLD_VALUES)
+            events.append(_event(obj, 'moved_out', old_category, -old_amount, when, old_values))
+            events.append(_event(obj, 'moved_in', obj.category_id, new_amount, when))
+
+    for obj in session.deleted:
+        if isinstance(obj, Subscription):
+            state = inspect(obj)
+            old_values = tuple(_committed(state, f) for f in OLD_VALUES)
+            events.append(_event(
+                obj, 'deleted', _committed(state, 'category_id'), -_old_contribution(state)[0], when, old_values
+            ))
+
+    record_events(session, events)
+
+
+# --- Reading ---
+def _rollup_currencies(bucket):
+    # DISTINCT as repeated index seeks on (tenant_id, granularity, currency, ...), one per currency
+    table = SpendRollup.__table__
+    currencies = []
+    while True:
+        stmt = select(func.min(table.c.currency)).where(bucket)
+        if currencies:
+            stmt = stmt.where(table.c.currency > currencies[-1])
+        currency = db.session.scalar(stmt)
+        if currency is None:
+            return currencies
+        currencies.append(currency)
+
+def spend_history(start, end, granularity='day', category_breakdown=False, tenant=None, currency=None):
+    """Active monthly spend at the close of every period from start to end.
+
+    Levels are summed as yearly minor units per currency and only converted
+    and turned into monthly amounts for the response.
+    """
+    tenant = tenant or current_tenant()
+    target = currency or default_currency()
+    table = SpendRollup.__table__
+    first = period_start(start, granularity)
+    bucket = (table.c.tenant_id == tenant) & (table.c.granularity == granularity)
+
+    # 1. Opening balance: the latest closing total before the range, one seek per category and currency
+    names = dict(db.session.execute(select(Category.id, Category.name).where(Category.tenant_id == tenant)).all())
+    levels = {}
+    for source in _rollup_currencies(bucket):
+        opening = (
+            select(table.c.yearly_closing)
+            .where(bucket & (table.c.currency == source) & (table.c.category_id == Category.id))
+            .where(table.c.period < first)
+            .order_by(table.c.period.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        for id, total in db.session.execute(select(Category.id, opening).where(Category.tenant_id == tenant)):
+            if total:
+                levels[(id, source)] = total
+
+    # 2. Rollup rows inside the range, walked once alongside the periods
+    rows = db.session.execute(
+        select(table.c.period, table.c.category_id, table.c.currency,
+               table.c.yearly_change, table.c.yearly_closing, table.c.events)
+        .where(bucket & (table.c.period >= first) & (table.c.period <= end))
+        .order_by(table.c.period)
+    ).all()
+
+    points, i = [], 0
+    for period in periods_between(start, end, granularity):
+        changes, events = {}, 0
+        while i < len(rows) and rows[i].period == period:
+            row = rows[i]
+            levels[(row.category_id, row.currency)] = row.yearly_closing
+            changes[row.currency] = changes.get(row.currency, 0) + row.yearly_change
+            events += row.events
+            i += 1
+        totals = {}
+        for (_, source), total in levels.items():
+            totals[source] = totals.get(source, 0) + total
+        point = {
+            "period": period.isoformat(),
+            "monthly_total": monthly_amount(convert_totals(totals, target), target),
+            "change": monthly_amount(convert_totals(changes, target), target),
+            "events": events,
+        }
+        if category_breakdown:
+            by_category = {}
+            for (id, source), total in levels.items():
+                by_category[id] = by_category.get(id, 0) + convert(total, source, target)
+            point["by_category"] = {
+                names.get(id, str(id)): monthly_amount(total, target) for id, total in by_category.items() if total
+            }
+        points.append(point)
+    return points
+
+def rebuild_rollups(conn, tenant=None):
+    """Recompute spend_rollup from the event log."""
+    table = SpendRollup.__table__
+    events = SubscriptionEvent.__table__
+    delete, query = table.delete(), select(
+        events.c.tenant_id, events.c.occurred_at, events.c.currency, events.c.category_id, events.c.yearly_delta
+    ).order_by(events.c.id)
+    if tenant:
+        delete = delete.where(table.c.tenant_id == tenant)
+        query = query.where(events.c.tenant_id == tenant)
+    conn.execute(delete)
+
+    buckets = {}
+    for row_tenant, occurred_at, currency, category_id, delta in conn.execute(query):
+        for granularity in GRANULARITIES:
+            key = (row_tenant, granularity, currency, category_id, period_start(occurred_at.date(), granularity))
+            bucket = buckets.setdefault(key, [0, 0])
+            bucket[0] += delta
+            bucket[1] += 1
+
+    rows, closing = [], {}
+    for (row_tenant, granularity, currency, category_id, period), (change, count) in sorted(buckets.items()):
+        series = (row_tenant, granularity, currency, category_id)
+        closing[series] = closing.get(series, 0) + change
+        rows.append({
+            "tenant_id": row_tenant, "granularity": granularity, "currency": currency, "category_id": category_id,
+            "period": period, "yearly_change": change, "yearly_closing": closing[series], "events": count
+        })
+    if rows:
+        conn.execute(table.insert(), rows)
+    return len(rows)
+
+
+# --- CLI ---
+@click.group('history')
+def history_cli():
+    """Spend history maintenance."""
+
+@history_cli.command('rebuild')
+@click.option('--tenant', default=None, help='Only rebuild this tenant (default: all).')
+@with_appcontext
+def rebuild_command(tenant):
+    """Recompute the day/month rollups from the event log."""
+    with db.engine.begin() as conn:
+        count = rebuild_rollups(conn, tenant)
+        # No session here, so no commit hook: move the cached /analytics/history versions by hand
+        bump(conn, {tenant or ALL_TENANTS})
+    click.echo(f"{count} rollup rows written.")
@@ -0,0 +1,182 @@
+from functools import wraps
+import uuid
+
+from flask import Response, current_app, make_response, request
+from sqlalchemy import event, inspect, select
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+
+from app import db
+from app.cache import LRUCache
+from app.categories import upsert_insert
+from app.tenancy import current_tenant
+
+# Tables no cached view reads: writes to them leave the version alone
+UNVERSIONED = {'job', 'budget_event'}
+# Changes to a table without tenant_id (fx_rate) reach every tenant's responses
+ALL_TENANTS = None
+
+
+class TenantVersion(db.Model):
+    """A tenant's data version, moved inside every transaction that writes its data.
+
+    Shared by every process on the database (workers, CLI commands), so a
+    write anywhere invalidates that tenant's ETags and cached responses
+    everywhere, and only that tenant's. The token is drawn when the row is
+    created: a recreated database never matches tags handed out for the old one.
+    A tenant without a row has never written; its responses are not cached.
+    """
+    __tablename__ = 'tenant_version'
+    tenant_id = db.Column(db.String(64), primary_key=True)
+    token = db.Column(db.String(16), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def new_token():
+    return uuid.uuid4().hex[:8]
+
+
+class ResponseCache:
+    """TTL/size-bounded cache of rendered responses, keyed by data version."""
+
+    def __init__(self, max_entries=256, ttl=30):
+        self.entries = LRUCache(maxsize=max_entries, ttl=ttl)
+
+    def etag(self, token, version, tenant, mimetype):
+        # The representation is part of the tag: JSON and NDJSON of one URL differ
+        return f"{token}-{tenant}-{version}-{mimetype}"
+
+
+def init_app(app):
+    app.extensions['http_cache'] = ResponseCache(
+        max_entries=app.config['HTTP_CACHE_MAX_ENTRIES'],
+        ttl=app.config['HTTP_CACHE_TTL']
+    )
+
+def get_cache():
+    return current_app.extensions['http_cache']
+
+def current_version(tenant):
+    """(token, version) of the tenant's data version: one primary-key read, None without the row."""
+    table = TenantVersion.__table__
+    return db.session.execute(
+        select(table.c.token, table.c.version).where(table.c.tenant_id == tenant)
+    ).first()
+
+
+def cached(view):
+    """ETag + If-None-Match handling and response caching for a GET view."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = get_cache()
+        tenant = current_tenant()
+        # Read in the same transaction as the view's own queries, so the body matches the version
+        row = current_version(tenant)
+        if row is None:
+            return view(*args, **kwargs)
+        token, version = row
+        mimetype = request.accept_mimetypes.best or '*/*'
+        etag = cache.etag(token, version, tenant, mimetype)
+
+        # 1. Client already has this version
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.vary.add('Accept')
+            return response
+
+        # 2. Rendered earlier at this version
+        key = (token, version, tenant, request.full_path, mimetype)
+        hit = cache.entries.get(key)
+        if hit is not None:
+            body, status, headers = hit
+            response = Response(body, status=status, headers=headers)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.entries.put(key, (response.get_data(), 200, list(response.headers)))
+
+        if response.status_code == 200:
+            response.set_etag(etag)
+            response.vary.add('Accept')
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    return wrapper
+
+
+# --- Session Hooks: a committed write moves the version of each tenant it touched ---
+def changed(session, tenant):
+    """Move the tenant's version when the session commits (ALL_TENANTS: every tenant's)."""
+    session.info.setdefault('changed_tenants', set()).add(tenant)
+
+def _statement_tenant(statement, parameters):
+    """The one tenant an INSERT/UPDATE/DELETE writes, ALL_TENANTS when it can't tell."""
+    column = statement.table.c.get('tenant_id')
+    if column is None:
+        return ALL_TENANTS
+    if statement.is_insert:
+        if not parameters:
+            return ALL_TENANTS
+        # A row without tenant_id gets the column default, current_tenant()
+        rows = parameters if isinstance(parameters, list) else [parameters]
+        tenants = {row.get('tenant_id') or current_tenant() for row in rows}
+        return tenants.pop() if len(tenants) == 1 else ALL_TENANTS
+    # WHERE tenant_id = :value among the top-level AND terms
+    where = statement.whereclause
+    terms = where.clauses if isinstance(where, BooleanClauseList) and where.operator is operators.and_ else [where]
+    for term in terms:
+        if (isinstance(term, BinaryExpression) and term.left is column and term.operator is operators.eq
+                and isinstance(term.right, BindParameter)):
+            return term.right.value
+    return ALL_TENANTS
+
+@event.listens_for(db.session, 'after_flush')
+def mark_flush(session, flush_context):
+    # new/dirty/deleted still hold what this flush wrote
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = inspect(obj).mapper.local_table
+        if table.name in UNVERSIONED:
+            continue
+        if 'tenant_id' not in table.c:
+            changed(session, ALL_TENANTS)
+        else:
+            changed(session, obj.tenant_id or current_tenant())
+
+@event.listens_for(db.session, 'do_orm_execute')
+def mark_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        statement = orm_execute_state.statement
+        if statement.table.name not in UNVERSIONED:
+            changed(orm_execute_state.session, _statement_tenant(statement, orm_execute_state.parameters))
+
+def bump(conn, tenants):
+    table = TenantVersion.__table__
+    if ALL_TENANTS in tenants:
+        conn.execute(table.update().values(version=table.c.version + 1))
+    insert = upsert_insert(conn.dialect.name)
+    for tenant in sorted(tenants - {ALL_TENANTS}):
+        if insert is not None:
+            conn.execute(
+                insert(table).values(tenant_id=tenant, token=new_token(), version=1)
+                .on_conflict_do_update(index_elements=['tenant_id'], set_={'version': table.c.version + 1})
+            )
+        elif conn.execute(
+            table.update().where(table.c.tenant_id == tenant).values(version=table.c.version + 1)
+        ).rowcount == 0:
+            conn.execute(table.insert().values(tenant_id=tenant, token=new_token(), version=1))
+
+@event.listens_for(db.session, 'before_commit')
+def bump_in_transaction(session):
+    # A savepoint release is not the end of the transaction
+    if session.in_nested_transaction():
+        return
+    # The commit's own flush may still change data, so run it first
+    session.flush()
+    tenants = session.info.pop('changed_tenants', None)
+    if tenants:
+        # On the connection: an ORM execute would mark the session changed again
+        bump(session.connection(), tenants)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_changes(session):
+    session.info.pop('changed_tenants', None)
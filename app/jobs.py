@@ -0,0 +1,349 @@
+"""In-process job queue for follow-up work that should not hold up a write.
+
+Writes call enqueue() inside their own transaction, so a job row exists if and
+only if the write committed; the job table stands in for a broker. A
+dispatcher thread claims due jobs with one conditional UPDATE, groups them
+by (kind, tenant) and hands each group to a thread pool of JOBS_WORKERS
+threads. A group runs as one handler call in its own app context and
+transaction, so a burst of writes costs one follow-up transaction, not one
+per write. A finished job is deleted. A failing one is retried with
+exponential backoff and left as 'failed' after JOBS_MAX_ATTEMPTS. Jobs claimed by a process that died are picked up again
+after JOBS_STALE_SECONDS.
+
+With JOBS_WORKERS = 0, or an in-memory SQLite database (which a worker
+thread could not see), jobs run inline when the app context that committed
+them ends.
+
+Queue depth and lag are exported at /metrics.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import json
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, or_, select
+
+from app import db
+from app.cache import LRUCache
+from app.config import is_memory_sqlite
+from app.models import Job
+
+PENDING, RUNNING, FAILED = 'pending', 'running', 'failed'
+MAX_BACKOFF_SECONDS = 300
+CLAIM_BATCH = 500
+
+# kind -> handler(payloads, tenant), called with every claimed payload of that kind for the tenant
+TASKS = {}
+
+
+def task(kind):
+    """Register a handler for jobs of this kind."""
+    def register(handler):
+        TASKS[kind] = handler
+        return handler
+    return register
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# --- Enqueue ---
+def enqueue(session, kind, payload=None, tenant=None, delay=0):
+    """Add a job in the session's transaction; it runs once that transaction commits."""
+    now = utcnow()
+    session.connection().execute(Job.__table__.insert().values(
+        tenant_id=tenant,
+        kind=kind,
+        payload=json.dumps(payload) if payload is not None else None,
+        status=PENDING,
+        attempts=0,
+        created_at=now,
+        run_after=now + timedelta(seconds=delay),
+    ))
+    session.info['jobs_enqueued'] = True
+
+def enqueue_once(session, kind, tenant, seconds):
+    """enqueue() unless this process queued the same kind for the tenant in the last `seconds`.
+
+    For idempotent maintenance: a duplicate from another process, or a slot
+    taken by a transaction that then rolled back, only shifts the next run.
+    """
+    recent = get_queue().recent
+    now = time.monotonic()
+    if recent.get((kind, tenant), 0) > now:
+        return
+    recent.put((kind, tenant), now + seconds)
+    enqueue(session, kind, tenant=tenant)
+
+@event.listens_for(db.session, 'after_commit')
+def wake_on_commit(session):
+    if session.info.pop('jobs_enqueued', False):
+        session.info['jobs_committed'] = True
+        get_queue().notify()
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_enqueued(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+# --- Running ---
+def _claimable(table, now, stale):
+    due = (table.c.status == PENDING) & (table.c.run_after <= now)
+    # Claimed by a worker that never finished (crash, restart)
+    abandoned = (table.c.status == RUNNING) & (table.c.started_at < now - timedelta(seconds=stale))
+    return or_(due, abandoned)
+
+def claim(limit):
+    """Mark up to `limit` due jobs running and return them, oldest first."""
+    table = Job.__table__
+    now = utcnow()
+    claimable = _claimable(table, now, current_app.config['JOBS_STALE_SECONDS'])
+    ids = select(table.c.id).where(claimable).order_by(table.c.id).limit(limit).scalar_subquery()
+    # The condition is checked again per row, so two claimers never get the same job
+    rows = db.session.execute(
+        table.update()
+        .where(table.c.id.in_(ids))
+        .where(claimable)
+        .values(status=RUNNING, started_at=now, attempts=table.c.attempts + 1)
+        .returning(table.c.id, table.c.tenant_id, table.c.kind, table.c.payload, table.c.attempts)
+    ).all()
+    db.session.commit()
+    return sorted(rows, key=lambda row: row.id)
+
+def batches(jobs):
+    """Claimed jobs grouped by (kind, tenant), oldest group first."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job.kind, job.tenant_id), []).append(job)
+    return list(groups.values())
+
+def run_batch(jobs):
+    """Run claimed jobs of one kind and tenant as one handler call and one transaction.
+
+    Returns 'done', 'retry' or 'failed'; the whole batch shares the outcome.
+    """
+    table = Job.__table__
+    kind, tenant = jobs[0].kind, jobs[0].tenant_id
+    ids = [job.id for job in jobs]
+    try:
+        handler = TASKS.get(kind)
+        if handler is None:
+            raise LookupError(f'No handler for job kind {kind!r}')
+        handler([json.loads(job.payload) if job.payload else None for job in jobs], tenant)
+        db.session.execute(table.delete().where(table.c.id.in_(ids)))
+        db.session.commit()
+        return 'done'
+    except Exception as e:
+        db.session.rollback()
+        attempts = max(job.attempts for job in jobs)
+        current_app.logger.warning('%s job(s) %s for %s, attempt %s failed: %r', len(ids), kind, tenant, attempts, e)
+        retry = attempts < current_app.config['JOBS_MAX_ATTEMPTS']
+        db.session.execute(table.update().where(table.c.id.in_(ids)).values(
+            status=PENDING if retry else FAILED,
+            run_after=utcnow() + timedelta(seconds=min(2 ** attempts, MAX_BACKOFF_SECONDS)),
+            error=repr(e)[:1000],
+        ))
+        db.session.commit()
+        return 'retry' if retry else 'failed'
+
+def drain(limit=CLAIM_BATCH):
+    """Run every due job in this thread until none is left; returns how many ran."""
+    queue = get_queue()
+    count = 0
+    while True:
+        jobs = claim(limit)
+        if not jobs:
+            return count
+        for batch in batches(jobs):
+            queue.record(batch[0].kind, run_batch(batch), len(batch))
+        count += len(jobs)
+
+
+class JobQueue:
+    """Dispatcher thread plus worker pool, started on the first commit that queues a job.
+
+    Each (kind, tenant) has at most one batch running at a time: jobs claimed
+    for a busy key wait in its lane and go to the same worker next, merged
+    into one batch, so handlers never race each other for the same tenant.
+    """
+
+    def __init__(self, app, workers, poll_seconds, batch_seconds=0):
+        self.app = app
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.batch_seconds = batch_seconds
+        self.inline = workers == 0
+        self.processed = {}   # (kind, result) -> count
+        self.recent = LRUCache(maxsize=4096)  # (kind, tenant) -> when enqueue_once may queue it again
+        self._lanes = {}      # (kind, tenant) being run -> jobs claimed for it meanwhile
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+
+    def record(self, kind, result, count=1):
+        with self._lock:
+            self.processed[(kind, result)] = self.processed.get((kind, result), 0) + count
+
+    def notify(self):
+        if self.inline:
+            return
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or self._stop.is_set():
+                return
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='jobs')
+            self._thread = threading.Thread(target=self._dispatch, name='jobs-dispatcher', daemon=True)
+            self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._pool.shutdown(wait=wait)
+
+    def _dispatch(self):
+        while not self._stop.is_set():
+            with self._lock:
+                free = self.workers - len(self._lanes)
+            jobs = []
+            if free > 0:
+                try:
+                    with self.app.app_context():
+                        jobs = claim(CLAIM_BATCH)
+                except Exception:
+                    self.app.logger.exception('claiming jobs failed')
+            for batch in batches(jobs):
+                self._submit(batch)
+            if not jobs:
+                # A commit that queues a job wakes us early, the timeout catches delayed retries
+                woken = self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                if woken and self.batch_seconds:
+                    # Let the rest of a burst of writes queue up, so it costs one claim and one batch
+                    self._stop.wait(self.batch_seconds)
+
+    def _submit(self, batch):
+        key = (batch[0].kind, batch[0].tenant_id)
+        with self._lock:
+            if key in self._lanes:
+                self._lanes[key].extend(batch)
+                return
+            self._lanes[key] = []
+        try:
+            self._pool.submit(self._run, key, batch)
+        except RuntimeError:
+            # Interpreter shutting down; the claim goes stale and is picked up after a restart
+            with self._lock:
+                self._lanes.pop(key, None)
+
+    def _run(self, key, batch):
+        while batch:
+            try:
+                with self.app.app_context():
+                    self.record(key[0], run_batch(batch), len(batch))
+            except Exception:
+                self.app.logger.exception('%s job(s) %s for %s crashed', len(batch), *key)
+            with self._lock:
+                batch = self._lanes[key]
+                if batch:
+                    self._lanes[key] = []
+                else:
+                    del self._lanes[key]
+        self._wake.set()
+
+
+def get_queue():
+    return current_app.extensions['jobs']
+
+def _run_inline(exc):
+    # Inline mode: jobs committed in this app context run as it ends
+    if exc is not None or not db.session.info.pop('jobs_committed', False):
+        return
+    # Whatever the context left uncommitted would be rolled back by the session teardown anyway
+    db.session.rollback()
+    # One drain at a time per process, like the worker lanes: concurrent folds for a tenant would collide
+    with get_queue()._drain_lock:
+        drain()
+
+
+# --- Monitoring ---
+def queue_stats():
+    """{(kind, status): (jobs, oldest run_after)} for everything still in the table."""
+    table = Job.__table__
+    rows = db.session.execute(
+        select(table.c.kind, table.c.status, func.count(), func.min(table.c.run_after))
+        .group_by(table.c.kind, table.c.status)
+    )
+    return {(kind, status): (count, oldest) for kind, status, count, oldest in rows}
+
+def render_metrics():
+    stats = queue_stats()
+    now = utcnow()
+    lines = ['# HELP jobs_queued Jobs in the queue by kind and status',
+             '# TYPE jobs_queued gauge']
+    for (kind, status), (count, _) in sorted(stats.items()):
+        lines.append(f'jobs_queued{{kind="{kind}",status="{status}"}} {count}')
+    lines += ['# HELP jobs_lag_seconds How long the oldest due pending job has been waiting',
+              '# TYPE jobs_lag_seconds gauge']
+    for (kind, status), (_, oldest) in sorted(stats.items()):
+        if status == PENDING:
+            lines.append(f'jobs_lag_seconds{{kind="{kind}"}} {max((now - oldest).total_seconds(), 0)}')
+    lines += ['# HELP jobs_processed_total Jobs run by this process by kind and result',
+              '# TYPE jobs_processed_total counter']
+    queue = get_queue()
+    with queue._lock:
+        processed = sorted(queue.processed.items())
+    for (kind, result), count in processed:
+        lines.append(f'jobs_processed_total{{kind="{kind}",result="{result}"}} {count}')
+    return lines
+
+
+def init_app(app):
+    workers = app.config['JOBS_WORKERS']
+    if is_memory_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+        workers = 0
+    app.extensions['jobs'] = JobQueue(
+        app, workers, app.config['JOBS_POLL_SECONDS'], app.config['JOBS_BATCH_SECONDS']
+    )
+    if workers == 0:
+        app.teardown_appcontext(_run_inline)
+    app.extensions['metrics'].collectors.append(render_metrics)
+
+
+# --- CLI ---
+@click.group('jobs')
+def jobs_cli():
+    """Background job queue."""
+
+@jobs_cli.command('run')
+@click.option('--forever', is_flag=True, help='Keep polling instead of stopping once the queue is empty.')
+@with_appcontext
+def run_command(forever):
+    """Run due jobs in this process."""
+    while True:
+        count = drain()
+        if count:
+            click.echo(f"{count} job(s) run.")
+        if not forever:
+            return
+        time.sleep(current_app.config['JOBS_POLL_SECONDS'])
+
+@jobs_cli.command('status')
+@with_appcontext
+def status_command():
+    stats = queue_stats()
+    if not stats:
+        click.echo("Queue is empty.")
+    for (kind, status), (count, oldest) in sorted(stats.items()):
+        click.echo(f"{kind:<16} {status:<8} {count:>8}  oldest due {oldest}")
@@ -0,0 +1,193 @@
+"""Per-endpoint request metrics and opt-in single-request profiling.
+
+For every request we record wall time, SQL statement count and time (from
+cursor events), serialization time and rows returned into in-memory
+histograms, exposed at GET /metrics in Prometheus text format.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from app import db
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# metric name -> (help text, buckets)
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Wall time per request', SECONDS_BUCKETS),
+    'http_request_sql_statements': ('SQL statements per request', COUNT_BUCKETS),
+    'http_request_sql_duration_seconds': ('Time spent in SQL per request', SECONDS_BUCKETS),
+    'http_request_serialization_seconds': ('Time spent serializing per request', SECONDS_BUCKETS),
+    'http_request_rows_returned': ('Rows serialized per request', ROWS_BUCKETS),
+}
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class RequestStats:
+    __slots__ = ('endpoint', 'started', 'sql_count', 'sql_time', 'serialize_time', 'rows')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.rows = 0
+
+
+class Registry:
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms = {}  # (metric, endpoint, method) -> Histogram
+        self._requests = {}    # (endpoint, method, status) -> count
+        # Callables returning extra exposition lines, e.g. the job queue's gauges
+        self.collectors = []
+
+    def record(self, stats, method, status):
+        values = {
+            'http_request_duration_seconds': time.perf_counter() - stats.started,
+            'http_request_sql_statements': stats.sql_count,
+            'http_request_sql_duration_seconds': stats.sql_time,
+            'http_request_serialization_seconds': stats.serialize_time,
+            'http_request_rows_returned': stats.rows,
+        }
+        with self._lock:
+            for metric, value in values.items():
+                key = (metric, stats.endpoint, method)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(HISTOGRAMS[metric][1])
+                self._histograms[key].observe(value)
+            key = (stats.endpoint, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def render(self):
+        lines = ['# HELP http_requests_total Requests by endpoint, method and status',
+                 '# TYPE http_requests_total counter']
+        with self._lock:
+            for (endpoint, method, status), n in sorted(self._requests.items()):
+                lines.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {n}')
+
+            for metric, (help_text, _) in HISTOGRAMS.items():
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+                for (name, endpoint, method), h in sorted(self._histograms.items()):
+                    if name != metric:
+                        continue
+                    labels = f'endpoint="{endpoint}",method="{method}"'
+                    cumulative = 0
+                    for bound, n in zip(h.buckets + ('+Inf',), h.counts):
+                        cumulative += n
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{{labels}}} {h.total}')
+                    lines.append(f'{metric}_count{{{labels}}} {h.count}')
+        for collect in self.collectors:
+            lines += collect()
+        return '\n'.join(lines) + '\n'
+
+
+# --- Recording helpers (safe to call outside a request) ---
+def current_stats():
+    if has_request_context():
+        return g.get('request_stats')
+    return None
+
+def record_serialization(elapsed, rows=0):
+    stats = current_stats()
+    if stats is not None:
+        stats.serialize_time += elapsed
+        stats.rows += rows
+
+@contextmanager
+def serialization_timer(rows=0):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_serialization(time.perf_counter() - start, rows)
+
+
+# --- SQL events ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_time += elapsed
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    starts = exception_context.connection.info.get('query_start') if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+# --- Request hooks ---
+def _profiling_requested():
+    if not current_app.config['PROFILING_ENABLED']:
+        return False
+    return request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'
+
+def _start_request():
+    g.request_stats = RequestStats(request.endpoint or 'unmatched')
+    if _profiling_requested():
+        import cProfile  # only ever needed for opt-in profiling
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _finish_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        import io, pstats
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+        response = Response(out.getvalue(), mimetype='text/plain')
+
+    stats = g.get('request_stats')
+    if stats is not None:
+        registry = current_app.extensions['metrics']
+        method, status = request.method, response.status_code
+        if response.is_streamed:
+            # The body is still being produced, record once the server closes it
+            response.call_on_close(lambda: registry.record(stats, method, status))
+        else:
+            registry.record(stats, method, status)
+    return response
+
+def metrics_view():
+    body = current_app.extensions['metrics'].render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.extensions['metrics'] = Registry()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(db.engine, 'handle_error', _handle_error)
@@ -0,0 +1,400 @@
+"""Versioned schema migrations.
+
+db.create_all() only creates missing tables, it never adds columns or indexes
+to tables that already exist. Each migration below is a numbered step that
+brings an older database forward; the applied version is stored in the
+schema_version table. Steps check the live schema first, so running them on a
+database that create_all() just built is a no-op apart from the version stamp.
+"""
+import uuid
+from datetime import date
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import AddConstraint, CreateColumn, UniqueConstraint
+
+from app import db
+from app.models import Budget, BudgetEvent, Category, Job, SpendRollup, SpendSummary, StatusType, Subscription, SubscriptionEvent
+from app.models import YEARLY_MINOR_SQL
+from app.money import MONTHS, default_currency, digits
+
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+
+# --- Helpers ---
+def _columns(conn, table):
+    return {c['name'] for c in inspect(conn).get_columns(table)}
+
+def _unique_sets(conn, table):
+    inspector = inspect(conn)
+    unique_sets = [c['column_names'] for c in inspector.get_unique_constraints(table)]
+    unique_sets += [i['column_names'] for i in inspector.get_indexes(table) if i['unique']]
+    return unique_sets
+
+def _is_unique(conn, table, column):
+    return [column] in _unique_sets(conn, table)
+
+def _create_indexes(conn, table):
+    # Indexes over columns that a later step adds are left to that step
+    existing = _columns(conn, table.name)
+    for index in table.indexes:
+        if all(c.name in existing for c in index.columns):
+            index.create(conn, checkfirst=True)
+
+# Float money columns replaced by integer minor units in step 8:
+# table -> {new column: (old column, factor)}; monthly amounts become yearly ones
+LEGACY_MONEY = {
+    'subscription': {'price_minor': ('price', 1)},
+    'budget': {'limit_minor': ('monthly_limit', 1)},
+    'spend_summary': {'yearly_total': ('monthly_total', MONTHS)},
+    'subscription_event': {'price_minor': ('price', 1), 'yearly_delta': ('monthly_delta', MONTHS)},
+    'spend_rollup': {'yearly_change': ('change', MONTHS), 'yearly_closing': ('closing_total', MONTHS)},
+}
+
+def _legacy_money(conn, table):
+    """{new column: SQL over the old ones} for float money columns the live table still has."""
+    columns = _columns(conn, table.name)
+    currency = default_currency()
+    scale = 10 ** digits(currency)
+    conversions = {
+        new: f'CAST(ROUND("{old}" * {factor * scale}) AS INTEGER)'
+        for new, (old, factor) in LEGACY_MONEY.get(table.name, {}).items()
+        if old in columns and new not in columns
+    }
+    if conversions and 'currency' in table.c and 'currency' not in columns:
+        # Float amounts were all in the one configured currency
+        conversions['currency'] = "'" + currency.replace("'", "''") + "'"
+    return conversions
+
+def _rebuild_sqlite_table(conn, table):
+    # SQLite cannot add constraints or drop a column-level UNIQUE in place:
+    # rename, create the model's table, copy the shared columns, drop the old one.
+    # Float money columns are converted on the way (see LEGACY_MONEY)
+    old = f"{table.name}__old"
+    for index in inspect(conn).get_indexes(table.name):
+        conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+    conversions = _legacy_money(conn, table)
+    shared = [
+        c for c in _columns(conn, table.name)
+        if c in table.c and table.c[c].computed is None and c not in conversions
+    ]
+    targets = ', '.join(f'"{c}"' for c in shared + list(conversions))
+    values = ', '.join([f'"{c}"' for c in shared] + list(conversions.values()))
+
+    # Keeps other tables' foreign keys pointing at the new table, not the renamed one
+    conn.execute(text("PRAGMA legacy_alter_table=ON"))
+    conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{old}"'))
+    table.create(conn)
+    conn.execute(text(f'INSERT INTO "{table.name}" ({targets}) SELECT {values} FROM "{old}"'))
+    conn.execute(text(f'DROP TABLE "{old}"'))
+    conn.execute(text("PRAGMA legacy_alter_table=OFF"))
+
+def _convert_money(conn, table):
+    conversions = _legacy_money(conn, table)
+    if not conversions:
+        return
+    if conn.dialect.name == 'sqlite':
+        _rebuild_sqlite_table(conn, table)
+        return
+    for name in conversions:
+        column_type = table.c[name].type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+    conn.execute(text(
+        f"UPDATE {table.name} SET " + ', '.join(f"{name} = {sql}" for name, sql in conversions.items())
+    ))
+    for name in conversions:
+        conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {name} SET NOT NULL"))
+    live = [c['name'] for c in inspect(conn).get_columns(table.name)]
+    # Newest first, so a generated column goes before the column it reads
+    for name in reversed(live):
+        if name not in table.c:
+            conn.execute(text(f"ALTER TABLE {table.name} DROP COLUMN {name}"))
+    for column in table.c:
+        if column.computed is not None and column.name not in live:
+            conn.execute(text(
+                f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}"
+            ))
+    _create_indexes(conn, table)
+
+def _alter_table_for_tenants(conn, table, old_unique):
+    inspector = inspect(conn)
+    conn.execute(text(
+        f"ALTER TABLE {table.name} ADD COLUMN tenant_id VARCHAR(64) NOT NULL DEFAULT 'default'"
+    ))
+    for constraint in inspector.get_unique_constraints(table.name):
+        if constraint['column_names'] in old_unique:
+            conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT "{constraint["name"]}"'))
+    for index in inspector.get_indexes(table.name):
+        if index['unique'] and index['column_names'] in old_unique:
+            conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint):
+            conn.execute(AddConstraint(constraint))
+    _create_indexes(conn, table)
+
+
+# --- Migrations ---
+def add_category_name_lower(conn):
+    if 'name_lower' not in _columns(conn, 'category'):
+        conn.execute(text("ALTER TABLE category ADD COLUMN name_lower VARCHAR(50)"))
+    conn.execute(text("UPDATE category SET name_lower = lower(name) WHERE name_lower IS NULL"))
+    if not _is_unique(conn, 'category', 'name_lower'):
+        conn.execute(text("CREATE UNIQUE INDEX ix_category_name_lower ON category (name_lower)"))
+
+def add_subscription_indexes(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_subscription_status_frequency_price "
+        "ON subscription (status, frequency, price)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_subscription_category_id_status "
+        "ON subscription (category_id, status)"
+    ))
+
+def add_tenant_id(conn):
+    # table -> single-column UNIQUEs that become per-tenant
+    tables = [
+        (Category.__table__, [['name'], ['name_lower']]),
+        (Subscription.__table__, [['name']]),
+        (Budget.__table__, []),
+        (SpendSummary.__table__, []),
+    ]
+    for table, old_unique in tables:
+        if 'tenant_id' in _columns(conn, table.name):
+            continue
+        if conn.dialect.name == 'sqlite':
+            _rebuild_sqlite_table(conn, table)
+            continue
+        if table is Subscription.__table__:
+            # Superseded by the tenant-leading indexes on the model
+            conn.execute(text("DROP INDEX IF EXISTS ix_subscription_status_frequency_price"))
+            conn.execute(text("DROP INDEX IF EXISTS ix_subscription_category_id_status"))
+        _alter_table_for_tenants(conn, table, old_unique)
+
+def add_renewal_schedule(conn):
+    columns = _columns(conn, 'subscription')
+    if 'billing_anchor' not in columns:
+        conn.execute(text("ALTER TABLE subscription ADD COLUMN billing_anchor DATE"))
+    if 'next_charge_at' not in columns:
+        conn.execute(text("ALTER TABLE subscription ADD COLUMN next_charge_at DATE"))
+    # The real start date was never stored: existing rows start their cycle today
+    conn.execute(
+        text("UPDATE subscription SET billing_anchor = :today, next_charge_at = :today "
+             "WHERE next_charge_at IS NULL"),
+        {"today": date.today()}
+    )
+    _create_indexes(conn, Subscription.__table__)
+
+def backfill_spend_history(conn):
+    # History starts at the upgrade: one 'created' event per existing subscription
+    from app.history import rebuild_rollups, utcnow
+    events = SubscriptionEvent.__table__
+    if conn.execute(db.select(db.func.count()).select_from(events)).scalar():
+        return
+    # Prices may still be floats here, step 8 converts the table itself
+    source = _legacy_money(conn, Subscription.__table__)
+    price = source.get('price_minor', 'price_minor')
+    currency = source.get('currency', 'currency')
+    yearly = YEARLY_MINOR_SQL.replace('price_minor', f'({price})')
+    conn.execute(text(
+        "INSERT INTO subscription_event (tenant_id, subscription_id, category_id, kind, occurred_at, "
+        "price_minor, currency, frequency, status, yearly_delta) "
+        f"SELECT tenant_id, id, category_id, 'created', :now, {price}, {currency}, frequency, status, "
+        f"CASE WHEN status = '{StatusType.ACTIVE.name}' THEN {yearly} ELSE 0 END FROM subscription"
+    ), {"now": utcnow()})
+    rebuild_rollups(conn)
+
+def add_search_index(conn):
+    from app import search
+    search.install(conn)
+    search.reindex(conn)
+
+# Step 7's float column, frozen here: the model replaced it with yearly_minor
+LEGACY_MONTHLY_PRICE_SQL = (
+    "CASE frequency WHEN 'WEEKLY' THEN price * 4 WHEN 'MONTHLY' THEN price * 1 "
+    "WHEN 'YEARLY' THEN price * 0.08333333333333333 ELSE 0.0 END"
+)
+
+def add_monthly_price(conn):
+    columns = _columns(conn, 'subscription')
+    # A table an earlier step rebuilt from the model already has minor units, and no float price
+    if 'price' not in columns:
+        return
+    if 'monthly_price' not in columns:
+        # SQLite can only ADD a VIRTUAL generated column, other databases store it
+        storage = 'VIRTUAL' if conn.dialect.name == 'sqlite' else 'STORED'
+        conn.execute(text(
+            f"ALTER TABLE subscription ADD COLUMN monthly_price FLOAT "
+            f"GENERATED ALWAYS AS ({LEGACY_MONTHLY_PRICE_SQL}) {storage}"
+        ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_subscription_tenant_monthly_price "
+        "ON subscription (tenant_id, monthly_price, id)"
+    ))
+
+def money_in_minor_units(conn):
+    from app import search
+    from app.history import rebuild_rollups
+    for model in (Subscription, Budget, SpendSummary, SubscriptionEvent, SpendRollup):
+        # ADD COLUMN cannot add a STORED generated column on SQLite, so it rebuilds
+        _convert_money(conn, model.__table__)
+    # Aggregates are recomputed from integers rather than carried over from floats:
+    # spend summaries on first use, rollups from the converted event log
+    conn.execute(SpendSummary.__table__.delete())
+    rebuild_rollups(conn)
+    # A rebuilt subscription table lost its search triggers
+    search.install(conn)
+
+def per_currency_aggregates(conn):
+    from app.history import rebuild_rollups
+    # 1. Spend summaries and rollups are kept per currency. Both are derived data:
+    # emptied here, summaries refill on first use and rollups from the event log
+    for table in (SpendSummary.__table__, SpendRollup.__table__):
+        conn.execute(table.delete())
+        wanted = [[c.name for c in u.columns] for u in table.constraints if isinstance(u, UniqueConstraint)]
+        if 'currency' in _columns(conn, table.name) and sorted(_unique_sets(conn, table.name)) == sorted(wanted):
+            continue
+        if conn.dialect.name == 'sqlite':
+            _rebuild_sqlite_table(conn, table)
+            continue
+        if 'currency' not in _columns(conn, table.name):
+            conn.execute(text(
+                f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(table.c.currency).compile(dialect=conn.dialect)}"
+            ))
+        inspector = inspect(conn)
+        for constraint in inspector.get_unique_constraints(table.name):
+            conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT "{constraint["name"]}"'))
+        for index in inspector.get_indexes(table.name):
+            if index['unique']:
+                conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                conn.execute(AddConstraint(constraint))
+        _create_indexes(conn, table)
+
+    # 2. The active-spend index gains currency, for the per-currency SUM
+    live = {i['name']: i['column_names'] for i in inspect(conn).get_indexes('subscription')}
+    for index in Subscription.__table__.indexes:
+        if index.name in live and live[index.name] != [c.name for c in index.columns]:
+            conn.execute(text(f'DROP INDEX "{index.name}"'))
+            index.create(conn)
+
+    rebuild_rollups(conn)
+
+def add_job_queue(conn):
+    Job.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, Job.__table__)
+
+def add_budget_alerts(conn):
+    # Existing budgets start below every threshold: the first spend change reports those already passed
+    columns = _columns(conn, 'budget')
+    for name in ('thresholds', 'alert_level'):
+        if name not in columns:
+            column = CreateColumn(Budget.__table__.c[name]).compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE budget ADD COLUMN {column}"))
+    BudgetEvent.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, BudgetEvent.__table__)
+
+def drop_monthly_price(conn):
+    # Undoes step 7 wherever step 8 has not already rebuilt the table without it
+    conn.execute(text("DROP INDEX IF EXISTS ix_subscription_tenant_monthly_price"))
+    if 'monthly_price' in _columns(conn, 'subscription'):
+        conn.execute(text("ALTER TABLE subscription DROP COLUMN monthly_price"))
+
+def add_data_version(conn):
+    # Step 12's single shared row, as it shipped; step 14 replaces it with a row per tenant
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS data_version "
+        "(id INTEGER NOT NULL PRIMARY KEY, token VARCHAR(16) NOT NULL, version INTEGER NOT NULL)"
+    ))
+    if conn.execute(text("SELECT count(*) FROM data_version")).scalar() == 0:
+        conn.execute(text("INSERT INTO data_version (id, token, version) VALUES (1, :token, 0)"),
+                     {"token": uuid.uuid4().hex[:8]})
+
+def per_tenant_data_version(conn):
+    # Every tenant with data gets a row, so its responses stay cacheable before its next write
+    from app.http_cache import TenantVersion, new_token
+    table = TenantVersion.__table__
+    table.create(conn, checkfirst=True)
+    have = set(conn.execute(db.select(table.c.tenant_id)).scalars())
+    tenants = db.union(*(db.select(model.tenant_id) for model in (Subscription, Category, Budget)))
+    rows = [{"tenant_id": t, "token": new_token(), "version": 0}
+            for t in conn.execute(tenants).scalars() if t not in have]
+    if rows:
+        conn.execute(table.insert(), rows)
+    conn.execute(text("DROP TABLE IF EXISTS data_version"))
+
+# (version, description, step) -- append only, never renumber
+MIGRATIONS = [
+    (1, 'category.name_lower for case-insensitive lookups', add_category_name_lower),
+    (2, 'subscription (status, frequency, price) and (category_id, status) indexes', add_subscription_indexes),
+    (3, 'tenant_id on every table, uniques and indexes scoped per tenant', add_tenant_id),
+    (4, 'subscription billing_anchor and indexed next_charge_at', add_renewal_schedule),
+    (5, 'subscription_event log and spend_rollup, seeded from current rows', backfill_spend_history),
+    (6, 'FTS5 search indexes over subscription and category names', add_search_index),
+    (7, 'subscription.monthly_price generated column and its index', add_monthly_price),
+    (8, 'money as integer minor units plus a currency code', money_in_minor_units),
+    (9, 'spend summaries and rollups per currency, fx_rate table', per_currency_aggregates),
+    (10, 'job table for the background queue', add_job_queue),
+    (11, 'budget thresholds and the budget_event outbox', add_budget_alerts),
+    (12, 'data_version row shared by every process for ETags', add_data_version),
+    (13, 'drop the float subscription.monthly_price column from step 7', drop_monthly_price),
+    (14, 'data version per tenant, replacing the shared data_version row', per_tenant_data_version),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return 0
+    version = conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).scalar()
+    return version or 0
+
+def upgrade(engine=None):
+    """Create missing tables, then apply pending migrations in one transaction."""
+    engine = engine or db.engine
+    applied = []
+    with engine.begin() as conn:
+        version = current_version(conn)
+        if version == LATEST:
+            # Up to date: one reflection query and one SELECT, no create_all pass over every table
+            return applied
+        # A brand new database gets the current schema from create_all and is only stamped
+        fresh = not inspect(conn).has_table(Subscription.__tablename__)
+        db.metadata.create_all(conn)
+
+        for number, description, step in MIGRATIONS:
+            if number > version and not fresh:
+                step(conn)
+                applied.append((number, description))
+
+        table = SchemaVersion.__table__
+        if conn.execute(table.update().where(table.c.id == 1).values(version=LATEST)).rowcount == 0:
+            conn.execute(table.insert().values(id=1, version=LATEST))
+    return applied
+
+
+# --- CLI ---
+@click.group('db')
+def db_cli():
+    """Schema migrations."""
+
+@db_cli.command('upgrade')
+@with_appcontext
+def upgrade_command():
+    applied = upgrade()
+    for number, description in applied:
+        click.echo(f"applied {number}: {description}")
+    click.echo(f"Schema at version {LATEST}.")
+
+@db_cli.command('current')
+@with_appcontext
+def current_command():
+    with db.engine.connect() as conn:
+        click.echo(f"Schema at version {current_version(conn)} (latest {LATEST}).")
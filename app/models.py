@@ -1,4 +1,8 @@
 from . import db
+from .money import DEFAULT_CURRENCY, MONTHS, amount_expr, default_currency, monthly_amount, monthly_amount_expr, from_minor, percent
+from .tenancy import DEFAULT_TENANT, current_tenant
+from sqlalchemy.orm import validates
+from datetime import date
 import enum
 
 # --- 1. Define Enums ---
@@ -12,23 +16,94 @@ class StatusType(enum.Enum):
     PAUSED = "Paused"
     CANCELLED = "Cancelled"
 
+# Charges per year at a given frequency (4 weeks a month). Spend is summed as
+# yearly minor units so yearly plans never need a /12 (see app.money)
+YEARLY_MULTIPLIER = {
+    FrequencyType.WEEKLY: 48,
+    FrequencyType.MONTHLY: 12,
+    FrequencyType.YEARLY: 1,
+}
+
+def yearly_minor(price_minor, frequency):
+    return price_minor * YEARLY_MULTIPLIER.get(frequency, 0)
+
+# Same as yearly_minor, as SQL over the stored enum names, for the generated column
+YEARLY_MINOR_SQL = "price_minor * CASE frequency {} ELSE 0 END".format(' '.join(
+    f"WHEN '{freq.name}' THEN {factor}" for freq, factor in YEARLY_MULTIPLIER.items()
+))
+
+def currency_column():
+    return db.Column(
+        db.String(3), nullable=False, default=default_currency, server_default=DEFAULT_CURRENCY
+    )
+
+def tenant_column(**kwargs):
+    # Every tenant-owned table leads its indexes with this column
+    return db.Column(
+        db.String(64), nullable=False, default=current_tenant, server_default=DEFAULT_TENANT, **kwargs
+    )
+
 # --- 2. Data Models ---
 class Category(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('tenant_id', 'name', name='uq_category_tenant_name'),
+        db.UniqueConstraint('tenant_id', 'name_lower', name='uq_category_tenant_name_lower'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), unique=True, nullable=False)
+    tenant_id = tenant_column()
+    name = db.Column(db.String(50), nullable=False)
+    # Lowercased copy of name so case-insensitive lookups hit a unique index
+    name_lower = db.Column(db.String(50), nullable=False)
     
     # Relationship: One Category has many Subscriptions
-    subscriptions = db.relationship('Subscription', backref='category_obj', lazy=True)
+    # category_obj is joined-loaded so to_json never issues a SELECT per subscription
+    subscriptions = db.relationship(
+        'Subscription', backref=db.backref('category_obj', lazy='joined'), lazy=True
+    )
+
+    @validates('name')
+    def _sync_name_lower(self, key, value):
+        self.name_lower = value.lower() if value is not None else None
+        return value
 
     def to_json(self):
         return {"id": self.id, "name": self.name}
 
 class Subscription(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('tenant_id', 'name', name='uq_subscription_tenant_name'),
+        # Keyset pagination within a tenant
+        db.Index('ix_subscription_tenant_id_id', 'tenant_id', 'id'),
+        # Covers the per-currency active-spend SUM and the analytics CASE aggregate without touching the table
+        db.Index(
+            'ix_subscription_tenant_status_frequency_price',
+            'tenant_id', 'status', 'currency', 'frequency', 'price_minor'
+        ),
+        # Category filter, already in id order for keyset pagination
+        db.Index('ix_subscription_tenant_category_id', 'tenant_id', 'category_id', 'id'),
+        # Upcoming charges, cash-flow projection and the overdue scan in app.renewals
+        db.Index('ix_subscription_tenant_status_next_charge', 'tenant_id', 'status', 'next_charge_at'),
+        # Monthly price range filters and sort, in keyset order
+        db.Index('ix_subscription_tenant_yearly_minor', 'tenant_id', 'yearly_minor', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80), unique=True, nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    tenant_id = tenant_column()
+    name = db.Column(db.String(80), nullable=False)
+    # Price per billing period in the currency's minor unit (cents)
+    price_minor = db.Column(db.Integer, nullable=False)
+    currency = currency_column()
     frequency = db.Column(db.Enum(FrequencyType), nullable=False)
+    # Cost per year whatever the frequency, in minor units, computed by the database
+    yearly_minor = db.Column(db.Integer, db.Computed(YEARLY_MINOR_SQL, persisted=True))
     status = db.Column(db.Enum(StatusType), nullable=False, default=StatusType.ACTIVE)
+    # First billing date; later charges fall on the same weekday / day of month
+    billing_anchor = db.Column(
+        db.Date, nullable=False, default=date.today, server_default=db.text('CURRENT_DATE')
+    )
+    # Kept current by app.renewals
+    next_charge_at = db.Column(db.Date)
 
     # FK : Links to the Category Table
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
@@ -37,17 +112,199 @@ class Subscription(db.Model):
         return {
             "id": self.id,
             "name": self.name,
-            "price": self.price,
+            "price": from_minor(self.price_minor, self.currency),
+            "monthly_price": monthly_amount(yearly_minor(self.price_minor, self.frequency), self.currency),
+            "currency": self.currency,
             'frequency': self.frequency.value, 
             'category': self.category_obj.name if self.category_obj else None,
-            'status': self.status.value
+            'status': self.status.value,
+            'billing_anchor': self.billing_anchor.isoformat() if self.billing_anchor else None,
+            'next_charge_at': self.next_charge_at.isoformat() if self.next_charge_at else None
         }
         
+DEFAULT_THRESHOLDS = '50,80,100'
+
+def threshold_list(thresholds):
+    return [int(t) for t in thresholds.split(',') if t]
+
 class Budget(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    monthly_limit = db.Column(db.Float, nullable=False)
+    tenant_id = tenant_column(unique=True)
+    limit_minor = db.Column(db.Integer, nullable=False)
+    currency = currency_column()
+    # Usage percentages that raise a budget event when crossed, ascending and comma separated
+    thresholds = db.Column(db.String(64), nullable=False, default=DEFAULT_THRESHOLDS, server_default=DEFAULT_THRESHOLDS)
+    # Highest threshold spend had reached when it last changed, 0 for none (see app.alerts)
+    alert_level = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @classmethod
+    def for_tenant(cls, tenant=None):
+        return cls.query.filter_by(tenant_id=tenant or current_tenant()).first()
+
+    def to_json(self):
+        return {
+            "monthly_limit": from_minor(self.limit_minor, self.currency),
+            "currency": self.currency,
+            "thresholds": threshold_list(self.thresholds or '')
+        }
+
+class SpendSummary(db.Model):
+    # Running aggregate of active spend per tenant and currency, kept in sync by app.spend
+    __tablename__ = 'spend_summary'
+    __table_args__ = (
+        db.UniqueConstraint('tenant_id', 'currency', name='uq_spend_summary_tenant_currency'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = tenant_column()
+    currency = currency_column()
+    # Sum of yearly_minor over active subscriptions in this currency
+    yearly_total = db.Column(db.Integer, nullable=False, default=0)
+    active_count = db.Column(db.Integer, nullable=False, default=0)
 
     def to_json(self):
         return {
-            "monthly_limit": self.monthly_limit
+            "currency": self.currency,
+            "monthly_total": monthly_amount(self.yearly_total, self.currency),
+            "active_count": self.active_count
         }
+
+class FxRate(db.Model):
+    # Exchange rates loaded from a file by app.fx, shared by every tenant
+    __tablename__ = 'fx_rate'
+
+    id = db.Column(db.Integer, primary_key=True)
+    currency = db.Column(db.String(3), nullable=False, unique=True)
+    # Units of currency per one unit of base, as decimal text so conversions stay exact
+    rate = db.Column(db.String(40), nullable=False)
+    base = db.Column(db.String(3), nullable=False)
+    as_of = db.Column(db.Date)
+
+class SubscriptionEvent(db.Model):
+    # Append-only log of spend-relevant changes, written by app.history
+    __tablename__ = 'subscription_event'
+    __table_args__ = (
+        db.Index('ix_subscription_event_tenant_subscription', 'tenant_id', 'subscription_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = tenant_column()
+    # Plain integers: events outlive deleted subscriptions
+    subscription_id = db.Column(db.Integer, nullable=False)
+    category_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # created / updated / deleted
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    # Values after the change (before it, for deletes)
+    price_minor = db.Column(db.Integer, nullable=False)
+    currency = currency_column()
+    frequency = db.Column(db.Enum(FrequencyType), nullable=False)
+    status = db.Column(db.Enum(StatusType), nullable=False)
+    # Change in active yearly spend caused by this event, in minor units
+    yearly_delta = db.Column(db.Integer, nullable=False, default=0)
+
+class SpendRollup(db.Model):
+    # Active spend per category and currency per day/month, maintained as events
+    # arrive. Yearly minor units, like SpendSummary.yearly_total
+    __tablename__ = 'spend_rollup'
+    __table_args__ = (
+        # Currency before category: a tenant's currencies are found with one seek each
+        db.UniqueConstraint(
+            'tenant_id', 'granularity', 'currency', 'category_id', 'period', name='uq_spend_rollup_bucket'
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = tenant_column()
+    granularity = db.Column(db.String(5), nullable=False)  # day / month
+    period = db.Column(db.Date, nullable=False)             # the day, or the 1st of the month
+    category_id = db.Column(db.Integer, nullable=False)
+    currency = currency_column()
+    yearly_change = db.Column(db.Integer, nullable=False, default=0)
+    yearly_closing = db.Column(db.Integer, nullable=False, default=0)
+    events = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    # Follow-up work queued by writes and run off the request path by app.jobs
+    __tablename__ = 'job'
+    __table_args__ = (
+        # Claiming: the oldest due pending jobs
+        db.Index('ix_job_status_run_after', 'status', 'run_after', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.String(64))
+    kind = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.Text)                                    # JSON
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending / running / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False)
+    run_after = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+
+class BudgetEvent(db.Model):
+    # Outbox of budget threshold crossings, written by app.alerts in the transaction
+    # that moved spend; read by GET /budget/events and delivered to the webhook
+    __tablename__ = 'budget_event'
+    __table_args__ = (
+        db.Index('ix_budget_event_tenant_id', 'tenant_id', 'id'),
+        # Webhook delivery: a tenant's undelivered events, oldest first
+        db.Index('ix_budget_event_tenant_delivered', 'tenant_id', 'delivered_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = tenant_column()
+    threshold = db.Column(db.Integer, nullable=False)       # percent of the limit
+    direction = db.Column(db.String(4), nullable=False)     # up / down
+    # Spend and limit at the crossing, in the budget's currency
+    yearly_spent = db.Column(db.Integer, nullable=False)
+    limit_minor = db.Column(db.Integer, nullable=False)
+    currency = currency_column()
+    created_at = db.Column(db.DateTime, nullable=False)
+    delivered_at = db.Column(db.DateTime)
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "type": "budget.threshold",
+            "threshold": self.threshold,
+            "direction": self.direction,
+            "usage_percent": percent(self.yearly_spent, self.limit_minor * MONTHS),
+            "current_spending": monthly_amount(self.yearly_spent, self.currency),
+            "monthly_budget": from_minor(self.limit_minor, self.currency),
+            "currency": self.currency,
+            "created_at": self.created_at.isoformat()
+        }
+
+# --- 3. Column Helpers ---
+# Public fields of a subscription, in the order to_json emits them
+SUBSCRIPTION_FIELDS = (
+    'id', 'name', 'price', 'monthly_price', 'currency', 'frequency', 'category', 'status',
+    'billing_anchor', 'next_charge_at'
+)
+
+_COLUMNS = {
+    'id': Subscription.id,
+    'name': Subscription.name,
+    # Exact decimals from the integer columns, computed in the SELECT
+    'price': amount_expr(Subscription.price_minor, Subscription.currency),
+    'monthly_price': monthly_amount_expr(Subscription.yearly_minor, Subscription.currency),
+    'currency': Subscription.currency,
+    'frequency': Subscription.frequency,
+    'category': Category.name,
+    'status': Subscription.status,
+    'billing_anchor': Subscription.billing_anchor,
+    'next_charge_at': Subscription.next_charge_at,
+}
+
+def subscription_columns(fields=SUBSCRIPTION_FIELDS):
+    return [_COLUMNS[f].label(f) for f in fields]
+
+def yearly_minor_expr():
+    # SQL CASE version of yearly_minor over (frequency, price_minor), so SUMs can
+    # be answered from ix_subscription_tenant_status_frequency_price alone
+    return db.case(
+        *[(Subscription.frequency == freq, Subscription.price_minor * factor)
+          for freq, factor in YEARLY_MULTIPLIER.items()],
+        else_=0
+    )
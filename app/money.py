@@ -0,0 +1,102 @@
+"""Money as integer minor units plus an ISO 4217 currency code.
+
+Prices are stored in the currency's minor unit (cents for USD, yen for JPY),
+so totals are exact integer SUMs. A monthly figure would need a division by 12
+for yearly plans, so spend totals are kept as yearly amounts instead: a weekly
+price counts 48 times (4 a month), a monthly one 12 times, a yearly one once.
+They are divided by 12 only when shown, rounding halves away from zero like
+SQL ROUND() so list rows and totals agree.
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from flask import current_app, has_app_context
+from sqlalchemy import func, literal_column
+
+DEFAULT_CURRENCY = 'USD'
+MONTHS = 12
+# Largest amount accepted, in minor units. The columns are signed 64-bit integers; this
+# leaves room for yearly amounts (x48) summed over many subscriptions to still fit
+MAX_MINOR = 10 ** 15
+# Currencies whose minor unit is not 1/100
+MINOR_DIGITS = {
+    'BHD': 3, 'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'IQD': 3, 'ISK': 0, 'JOD': 3, 'JPY': 0,
+    'KMF': 0, 'KRW': 0, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'PYG': 0, 'RWF': 0, 'TND': 3, 'UGX': 0,
+    'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+}
+
+
+def default_currency():
+    if has_app_context():
+        return current_app.config.get('CURRENCY', DEFAULT_CURRENCY)
+    return DEFAULT_CURRENCY
+
+def digits(currency):
+    return MINOR_DIGITS.get(currency, 2)
+
+def to_minor(value, currency=None):
+    """A non-negative amount from a request (number or string) in minor units.
+
+    ValueError when it is not a number, negative, above MAX_MINOR, or more
+    precise than the currency's minor unit: 9.999 USD is refused, never
+    rounded.
+    """
+    if isinstance(value, bool):
+        raise ValueError('amount must be a number')
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError('amount must be a number')
+    if not amount.is_finite() or amount < 0:
+        raise ValueError('amount must be a positive number')
+    minor = amount.scaleb(digits(currency or default_currency()))
+    if minor > MAX_MINOR:
+        raise ValueError(f'amount must be at most {MAX_MINOR} in minor units')
+    if minor != minor.to_integral_value():
+        raise ValueError('amount has more decimals than the currency')
+    return int(minor)
+
+def price_error(currency=None):
+    places = digits(currency or default_currency())
+    return f'Price must be a positive number with at most {places} decimals'
+
+def from_minor(minor, currency=None):
+    """Minor units as a JSON number (exact: 999 -> 9.99)."""
+    # int / int is correctly rounded: the nearest float to the exact decimal
+    return int(minor or 0) / 10 ** digits(currency or default_currency())
+
+def monthly(yearly_minor):
+    """A yearly amount per month, in whole minor units."""
+    months, rest = divmod(abs(int(yearly_minor or 0)), MONTHS)
+    months += 2 * rest >= MONTHS
+    return months if (yearly_minor or 0) >= 0 else -months
+
+def monthly_amount(yearly_minor, currency=None):
+    return from_minor(monthly(yearly_minor), currency)
+
+def percent(part, whole):
+    return float((Decimal(part) * 100 / Decimal(whole)).quantize(Decimal('0.01'), ROUND_HALF_UP))
+
+
+# --- SQL ---
+# digits -> currencies, for the non-default minor units
+_BY_DIGITS = {}
+for _code, _n in sorted(MINOR_DIGITS.items()):
+    _BY_DIGITS.setdefault(_n, []).append(_code)
+
+def _scale(currency):
+    # 10 ** digits as a REAL, so integer minor units never hit integer division.
+    # One literal fragment: per-WHEN parameters cost more to bind and cache-key than the query
+    column = f"{currency.table.name}.{currency.name}"
+    cases = ' '.join(
+        f"WHEN {column} IN ({', '.join(repr(code) for code in codes)}) THEN {10.0 ** n!r}"
+        for n, codes in sorted(_BY_DIGITS.items())
+    )
+    return literal_column(f"(CASE {cases} ELSE 100.0 END)")
+
+def amount_expr(minor, currency):
+    """SQL twin of from_minor(), for rows that go straight to JSON."""
+    return minor / _scale(currency)
+
+def monthly_amount_expr(yearly_minor, currency):
+    """SQL twin of monthly_amount()."""
+    return func.round(yearly_minor / float(MONTHS)) / _scale(currency)
@@ -0,0 +1,225 @@
+"""Renewal schedule: billing anchors, stored next-charge dates and projections.
+
+Each subscription keeps the date it was first billed (billing_anchor) and the
+date of its next charge (next_charge_at, indexed). The session hook sets
+next_charge_at whenever the anchor, frequency or status changes. roll_forward()
+moves dates that have passed to the following charge, and it only visits
+those overdue rows. It runs as a background job (app.jobs) queued by a
+tenant's writes, at most once an hour per tenant and process, and daily from
+`flask renewals roll`. Upcoming charges and cash-flow projections read an
+index range on next_charge_at instead of working out renewals for every row,
+skipping charge dates a roll has not caught up with yet, so reads never write.
+"""
+import calendar
+from datetime import date, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, inspect, select
+
+from app import db
+from app.models import Subscription, FrequencyType, StatusType
+from app.fx import convert, convert_totals
+from app.jobs import enqueue_once, task
+from app.money import default_currency, from_minor
+from app.tenancy import current_tenant
+
+MAX_HORIZON_DAYS = 366
+ROLL_BATCH = 1000
+# Writes queue a roll for their tenant at most this often per process
+ROLL_EVERY_SECONDS = 3600
+
+
+# --- Date arithmetic ---
+def add_months(day, months, anchor_day):
+    # Anchored on the 31st: Jan 31 -> Feb 28 -> Mar 31, never drifting to the 28th
+    year, month = divmod(day.month - 1 + months, 12)
+    year += day.year
+    return date(year, month + 1, min(anchor_day, calendar.monthrange(year, month + 1)[1]))
+
+def shift(charge_date, frequency, periods, anchor_day):
+    """The charge `periods` billing periods after charge_date."""
+    if frequency == FrequencyType.WEEKLY:
+        return charge_date + timedelta(weeks=periods)
+    if frequency == FrequencyType.MONTHLY:
+        return add_months(charge_date, periods, anchor_day)
+    return add_months(charge_date, 12 * periods, anchor_day)
+
+def next_charge(anchor, frequency, today=None):
+    """First charge on or after today for a subscription billed from anchor."""
+    today = today or date.today()
+    if anchor >= today:
+        return anchor
+    if frequency == FrequencyType.WEEKLY:
+        weeks = -(-(today - anchor).days // 7)
+        return anchor + timedelta(weeks=weeks)
+
+    step = 1 if frequency == FrequencyType.MONTHLY else 12
+    months = (today.year - anchor.year) * 12 + today.month - anchor.month
+    periods = max(months // step, 0)
+    charge = add_months(anchor, periods * step, anchor.day)
+    while charge < today:
+        periods += 1
+        charge = add_months(anchor, periods * step, anchor.day)
+    return charge
+
+def parse_anchor(value):
+    """ISO date string from a request body; ValueError when malformed."""
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+def charges_between(first, frequency, anchor_day, end):
+    """Every charge date from first up to and including end."""
+    periods = 0
+    charge = first
+    while charge <= end:
+        yield charge
+        periods += 1
+        charge = shift(first, frequency, periods, anchor_day)
+
+
+# --- Engine ---
+def roll_forward(tenant=None, today=None):
+    """Move passed next_charge_at dates of active subscriptions to their next charge."""
+    tenant = tenant or current_tenant()
+    today = today or date.today()
+    table = Subscription.__table__
+
+    # (tenant_id, status, next_charge_at) index: only overdue rows are read
+    overdue = db.session.execute(
+        select(table.c.id, table.c.billing_anchor, table.c.frequency)
+        .where(table.c.tenant_id == tenant)
+        .where(table.c.status == StatusType.ACTIVE)
+        .where(table.c.next_charge_at < today)
+    ).all()
+
+    updates = [
+        {"_id": id, "next_charge_at": next_charge(anchor, frequency, today)}
+        for id, anchor, frequency in overdue
+    ]
+    stmt = (
+        table.update()
+        .where(table.c.tenant_id == tenant, table.c.id == db.bindparam('_id'))
+        .values(next_charge_at=db.bindparam('next_charge_at'))
+    )
+    for i in range(0, len(updates), ROLL_BATCH):
+        db.session.execute(stmt, updates[i:i + ROLL_BATCH])
+    if updates:
+        db.session.commit()
+    return len(updates)
+
+def _due_query(tenant, end, *columns):
+    return (
+        select(*columns)
+        .where(Subscription.tenant_id == tenant)
+        .where(Subscription.status == StatusType.ACTIVE)
+        .where(Subscription.next_charge_at <= end)
+    )
+
+def upcoming_charges(days, tenant=None, today=None, currency=None):
+    """(every charge in the next `days` days oldest first, their total in currency)."""
+    tenant = tenant or current_tenant()
+    today = today or date.today()
+    end = today + timedelta(days=days)
+    rows = db.session.execute(_due_query(
+        tenant, end,
+        Subscription.id, Subscription.name, Subscription.price_minor, Subscription.currency,
+        Subscription.frequency, Subscription.billing_anchor, Subscription.next_charge_at
+    ))
+
+    charges = []
+    totals = {}
+    for id, name, price_minor, source, frequency, anchor, first in rows:
+        price = from_minor(price_minor, source)
+        # Only rows inside the window are expanded, e.g. a weekly plan charging 4 times
+        for charge_date in charges_between(first, frequency, anchor.day, end):
+            if charge_date < today:
+                continue  # not rolled forward yet
+            charges.append({
+                "id": id, "name": name, "price": price, "currency": source,
+                "frequency": frequency.value, "charge_date": charge_date.isoformat()
+            })
+            totals[source] = totals.get(source, 0) + price_minor
+    charges.sort(key=lambda c: (c['charge_date'], c['id']))
+    currency = currency or default_currency()
+    return charges, from_minor(convert_totals(totals, currency), currency)
+
+def cashflow(days, bucket='day', tenant=None, today=None, currency=None):
+    """(projected charges per day or week for the next `days` days, their total in currency)."""
+    tenant = tenant or current_tenant()
+    today = today or date.today()
+    end = today + timedelta(days=days)
+    currency = currency or default_currency()
+
+    # 1. One aggregate: rows sharing a schedule and currency collapse into a single group
+    anchor_day = func.extract('day', Subscription.billing_anchor)
+    groups = db.session.execute(
+        _due_query(
+            tenant, end,
+            Subscription.frequency, Subscription.next_charge_at, anchor_day, Subscription.currency,
+            func.sum(Subscription.price_minor), func.count()
+        ).group_by(Subscription.frequency, Subscription.next_charge_at, anchor_day, Subscription.currency)
+    )
+
+    # 2. Convert each group's sum once, then spread it over the day slots
+    amounts = [0] * (days + 1)
+    counts = [0] * (days + 1)
+    for frequency, first, day, source, total, count in groups:
+        total = convert(total, source, currency)
+        for charge_date in charges_between(first, frequency, int(day), end):
+            offset = (charge_date - today).days
+            if offset < 0:
+                continue  # not rolled forward yet
+            amounts[offset] += total
+            counts[offset] += count
+
+    # 3. Fold into buckets
+    width = 7 if bucket == 'week' else 1
+    points = []
+    for start in range(0, days + 1, width):
+        points.append({
+            "date": (today + timedelta(days=start)).isoformat(),
+            "amount": from_minor(sum(amounts[start:start + width]), currency),
+            "charges": sum(counts[start:start + width]),
+        })
+    return points, from_minor(sum(amounts), currency)
+
+
+# --- Session Hook ---
+SCHEDULE_FIELDS = ('billing_anchor', 'frequency', 'status')
+
+@event.listens_for(db.session, 'before_flush')
+def schedule_next_charge(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Subscription):
+            continue
+        state = inspect(obj)
+        if obj in session.new or any(state.attrs[f].history.has_changes() for f in SCHEDULE_FIELDS):
+            if obj.billing_anchor is None:
+                obj.billing_anchor = date.today()
+            obj.next_charge_at = next_charge(obj.billing_anchor, obj.frequency)
+
+    # Other rows' dates may have passed since the last roll: queue one for each tenant written to
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Subscription):
+            enqueue_once(session, 'roll_renewals', obj.tenant_id or current_tenant(), ROLL_EVERY_SECONDS)
+
+@task('roll_renewals')
+def roll_renewals(payloads, tenant):
+    roll_forward(tenant)
+
+
+# --- CLI ---
+@click.group('renewals')
+def renewals_cli():
+    """Renewal schedule maintenance."""
+
+@renewals_cli.command('roll')
+@with_appcontext
+def roll_command():
+    """Advance passed charge dates for every tenant (run daily)."""
+    from app.spend import all_tenants
+    for tenant in all_tenants():
+        moved = roll_forward(tenant)
+        click.echo(f"[{tenant}] {moved} subscription(s) rolled forward")
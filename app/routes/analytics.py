@@ -1,41 +1,178 @@
-from flask import Blueprint, jsonify
+from datetime import date, timedelta
+
+from flask import Blueprint, jsonify, request, abort
+from sqlalchemy import func
 from app import db
-from app.models import Subscription, FrequencyType, StatusType
+from app.models import Subscription, Category, StatusType, yearly_minor_expr
+from app.money import from_minor, monthly_amount
+from app.fx import convert, minor_factor_expr, parse_known
+from app.spend import get_spend, spend_in
+from app.http_cache import cached
+from app.tenancy import current_tenant
+from app.renewals import MAX_HORIZON_DAYS, cashflow
+from app.history import GRANULARITIES, MAX_PERIODS, period_count, spend_history
 
 bp = Blueprint('analytics', __name__, url_prefix='/analytics')
 
+# group_by value -> column to group on
+GROUP_COLUMNS = {
+    'category': Category.name,
+    'frequency': Subscription.frequency,
+    'status': Subscription.status,
+}
+
+MAX_TOP = 1000
+
+
+def parse_target():
+    # ?currency=EUR, the configured currency by default
+    try:
+        return parse_known(request.args.get('currency'))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+def grouped_breakdown(group_by, currency):
+    column = GROUP_COLUMNS[group_by]
+    # Integer SUM of yearly minor units per group and currency, each sum converted once
+    yearly = func.sum(yearly_minor_expr())
+
+    stmt = (
+        db.select(column.label('key'), Subscription.currency, yearly.label('yearly_total'), func.count().label('count'))
+        .select_from(Subscription)
+        .where(Subscription.tenant_id == current_tenant())
+        .group_by(column, Subscription.currency)
+    )
+    if group_by == 'category':
+        stmt = stmt.join(Category, Subscription.category_id == Category.id)
+    # Grouping by status shows what paused/cancelled rows would cost, the others only count active
+    if group_by != 'status':
+        stmt = stmt.where(Subscription.status == StatusType.ACTIVE)
+
+    groups = {}
+    for key, source, total, count in db.session.execute(stmt):
+        group = groups.setdefault(key, [0, 0])
+        group[0] += convert(total, source, currency)
+        group[1] += count
+
+    ranked = sorted(groups.items(), key=lambda item: item[1][0], reverse=True)
+    return [
+        {
+            group_by: getattr(key, 'value', key),
+            "monthly_total": monthly_amount(total, currency),
+            "count": count
+        }
+        for key, (total, count) in ranked
+    ]
+
+def subscription_breakdown(currency, currencies, top=None):
+    yearly = yearly_minor_expr().label('yearly_minor')
+    stmt = (
+        db.select(Subscription.name, Subscription.currency, yearly)
+        .where(Subscription.tenant_id == current_tenant())
+        .where(Subscription.status == StatusType.ACTIVE)
+    )
+    if top is not None:
+        # Ranked by the converted amount; a float factor per currency is enough to order by
+        ranking = yearly_minor_expr() * minor_factor_expr(Subscription.currency, currencies, currency)
+        stmt = stmt.order_by(ranking.desc(), Subscription.id).limit(top)
+
+    return [
+        {"name": name, "monthly_equivalent": monthly_amount(convert(value, source, currency), currency)}
+        for name, source, value in db.session.execute(stmt)
+    ]
+
 
 @bp.route('', methods=['GET'])
+@cached
 def monthly_total():
+    group_by = request.args.get('group_by')
+    if group_by is not None and group_by not in GROUP_COLUMNS:
+        abort(400, description=f'Invalid group_by. Allowed: {list(GROUP_COLUMNS)}')
+
+    top = request.args.get('top')
+    if top is not None:
+        try:
+            top = int(top)
+            if not 0 < top <= MAX_TOP: raise ValueError
+        except ValueError:
+            abort(400, description=f'top must be an integer between 1 and {MAX_TOP}')
+
+    currency = parse_target()
 
-    subs = Subscription.query.filter_by(status=StatusType.ACTIVE).all()
+    # Totals come from the stored per-currency aggregate instead of a full scan,
+    # converted with one multiply per currency
+    total_year, active_count = spend_in(currency)
 
-    total_month = 0
-    breakdown = []
+    response = {
+        "currency": currency,
+        "total_price_per_month": monthly_amount(total_year, currency),
+        "total_price_per_year": from_minor(total_year, currency),
+        "active_subscriptions": active_count,
+    }
 
-    for s in subs:
-        if s.frequency == FrequencyType.MONTHLY:
-            monthly_price = s.price
-        elif s.frequency == FrequencyType.YEARLY:
-            monthly_price = s.price / 12
-        elif s.frequency == FrequencyType.WEEKLY:
-            monthly_price = s.price * 4
-        else:
-            monthly_price = 0
+    # Normalization runs as a SQL CASE; no ORM objects are built on any path
+    if group_by:
+        response["group_by"] = group_by
+        response["breakdown"] = grouped_breakdown(group_by, currency)
+    else:
+        response["breakdown"] = subscription_breakdown(currency, list(get_spend()), top)
 
-        total_month += monthly_price
+    return jsonify(response), 200
 
-        breakdown.append({
-            "name": s.name,
-            "monthly_equivalent": round(monthly_price, 2)
-        })
 
-    total_year = total_month * 12
+# Projected charges per day/week (?days=90&bucket=week)
+@bp.route('/cashflow', methods=['GET'])
+def cashflow_projection():
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in ('day', 'week'):
+        abort(400, description='bucket must be day or week')
 
+    days = request.args.get('days', '30')
+    try:
+        days = int(days)
+        if not 0 < days <= MAX_HORIZON_DAYS: raise ValueError
+    except ValueError:
+        abort(400, description=f'days must be an integer between 1 and {MAX_HORIZON_DAYS}')
+
+    currency = parse_target()
+    points, total = cashflow(days, bucket, currency=currency)
     return jsonify({
-        "total_price_per_month": round(total_month, 2),
-        "total_price_per_year": round(total_year, 2),
-        "active_subscriptions": len(subs),
-        "breakdown": breakdown
+        "currency": currency,
+        "days": days,
+        "bucket": bucket,
+        "total": total,
+        "points": points
     }), 200
 
+
+# Spend over time from the rollups (?from=2025-01-01&to=2025-06-30&granularity=month)
+@bp.route('/history', methods=['GET'])
+@cached
+def spend_over_time():
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        abort(400, description=f'Invalid granularity. Allowed: {list(GRANULARITIES)}')
+
+    try:
+        end = date.fromisoformat(request.args['to']) if 'to' in request.args else date.today()
+        start = date.fromisoformat(request.args['from']) if 'from' in request.args else None
+    except ValueError:
+        abort(400, description='from and to must be ISO dates (YYYY-MM-DD)')
+
+    limit = MAX_PERIODS[granularity]
+    if start is None:
+        start = end - timedelta(days=29) if granularity == 'day' else date(end.year - 1, end.month, 1)
+    if start > end:
+        abort(400, description='from must not be after to')
+    if period_count(start, end, granularity) > limit:
+        abort(400, description=f'At most {limit} {granularity} periods per request')
+
+    breakdown = request.args.get('by_category', '').lower() in ('1', 'true')
+    currency = parse_target()
+    return jsonify({
+        "currency": currency,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "granularity": granularity,
+        "points": spend_history(start, end, granularity, breakdown, currency=currency)
+    }), 200
@@ -1,9 +1,22 @@
-from flask import Blueprint, jsonify, request
+import math
+import time
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from app import db
-from app.models import Budget, Subscription, FrequencyType, StatusType
+from app.models import Budget, threshold_list
+from app.money import MONTHS, from_minor, monthly_amount, percent, to_minor
+from app.fx import convert, parse_known
+from app.spend import lock_budget, spend_in
+from app.alerts import parse_thresholds, recheck, wait_for_events
+from app.http_cache import cached
+from app.tenancy import current_tenant
 
 bp = Blueprint('budget', __name__, url_prefix='/budget')
 
+# GET /budget/events: default wait, and the SSE keep-alive interval
+EVENTS_WAIT_SECONDS = 25
+HEARTBEAT_SECONDS = 15
+
 @bp.route('', methods=['PUT'])
 def set_budget():
 
@@ -12,30 +25,57 @@ def set_budget():
     if not data or 'limit' not in data:
         return jsonify({"error": "Missing field: limit"}), 400
 
-    limit = data['limit']
+    # Locked before it is read, like every spend writer: the threshold check at commit relies on it
+    lock_budget(db.session, current_tenant())
+    budget = Budget.for_tenant()
+
+    # Optional; an existing budget keeps its currency unless one is given
+    try:
+        currency = parse_known(data.get('currency'), budget.currency if budget else None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        limit_minor = to_minor(data['limit'], currency)
+    except ValueError:
+        limit_minor = 0
 
-    if limit <= 0:
+    if limit_minor <= 0:
         return jsonify({"error": "Budget must be positive"}), 400
 
-    budget = Budget.query.first()
+    # Optional; an existing budget keeps its thresholds unless new ones are given
+    thresholds = None
+    if 'thresholds' in data:
+        try:
+            thresholds = parse_thresholds(data['thresholds'])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
     if not budget:
-        budget = Budget(monthly_limit=limit)
+        budget = Budget(limit_minor=limit_minor, currency=currency, tenant_id=current_tenant())
         db.session.add(budget)
     else:
-        budget.monthly_limit = limit
+        budget.limit_minor = limit_minor
+        budget.currency = currency
+    if thresholds is not None:
+        budget.thresholds = thresholds
 
+    # A new limit moves usage as much as new spend does
+    recheck(db.session, budget.tenant_id)
     db.session.commit()
 
     return jsonify({
         "message": "Budget updated",
-        "monthly_limit": budget.monthly_limit
+        "monthly_limit": from_minor(budget.limit_minor, budget.currency),
+        "currency": budget.currency,
+        "thresholds": threshold_list(budget.thresholds)
     }), 200
 
 @bp.route('', methods=['GET'])
+@cached
 def get_budget():
 
-    budget = Budget.query.first()
+    budget = Budget.for_tenant()
 
     if not budget:
         return jsonify({"message": "No budget set"}), 404
@@ -44,33 +84,73 @@ def get_budget():
 
 
 @bp.route('/status', methods=['GET'])
+@cached
 def budget_status():
 
-    subs = Subscription.query.filter_by(
-        status=StatusType.ACTIVE
-    ).all()
-
-    budget = Budget.query.first()
+    budget = Budget.for_tenant()
 
     if not budget:
         return jsonify({"error": "No budget set"}), 404
 
-    total_month = 0
+    # ?currency=EUR shows the figures converted, usage is always measured in the budget's currency
+    try:
+        currency = parse_known(request.args.get('currency'), budget.currency)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    for s in subs:
-        if s.frequency == FrequencyType.MONTHLY:
-            total_month += s.price
-        elif s.frequency == FrequencyType.YEARLY:
-            total_month += s.price / 12
-        elif s.frequency == FrequencyType.WEEKLY:
-            total_month += s.price * 4
+    # Integer yearly minor units on both sides, the same comparison reserve() makes
+    total_year, _ = spend_in(budget.currency)
+    limit_year = budget.limit_minor * MONTHS
 
-    used_percent = (total_month / budget.monthly_limit) * 100
-    remaining = budget.monthly_limit - total_month
+    def shown(yearly):
+        return monthly_amount(convert(yearly, budget.currency, currency), currency)
 
     return jsonify({
-        "monthly_budget": budget.monthly_limit,
-        "current_spending": round(total_month, 2),
-        "remaining_budget": round(remaining, 2),
-        "usage_percent": round(used_percent, 2)
+        "currency": currency,
+        "monthly_budget": shown(limit_year),
+        "current_spending": shown(total_year),
+        "remaining_budget": shown(limit_year - total_year),
+        "usage_percent": percent(total_year, limit_year)
     }), 200
+
+
+@bp.route('/events', methods=['GET'])
+def budget_events():
+    # ?after=<id> (or SSE's Last-Event-ID) for newer events only, ?wait=<seconds> to hold
+    # the request until one arrives instead of polling /budget/status
+    try:
+        after = int(request.args.get('after') or request.headers.get('Last-Event-ID') or 0)
+        wait = float(request.args.get('wait', EVENTS_WAIT_SECONDS))
+        # nan and inf parse, but a deadline can't be computed from them
+        if not math.isfinite(wait):
+            raise ValueError(wait)
+    except ValueError:
+        return jsonify({"error": "after must be an event id and wait a number of seconds"}), 400
+    wait = min(max(wait, 0), current_app.config['BUDGET_EVENTS_MAX_WAIT'])
+    tenant = current_tenant()
+
+    if request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) != 'text/event-stream':
+        events = wait_for_events(tenant, after, wait)
+        return jsonify({
+            "events": [e.to_json() for e in events],
+            "last_id": events[-1].id if events else after
+        }), 200
+
+    def stream():
+        # Server-Sent Events for `wait` seconds, then the client reconnects with Last-Event-ID
+        last = after
+        deadline = time.monotonic() + wait
+        yield 'retry: 1000\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            events = wait_for_events(tenant, last, max(min(remaining, HEARTBEAT_SECONDS), 0))
+            for e in events:
+                last = e.id
+                yield f"id: {e.id}\nevent: budget.threshold\ndata: {current_app.json.dumps(e.to_json())}\n\n"
+            if deadline - time.monotonic() <= 0:
+                return
+            if not events:
+                yield ': keep-alive\n\n'
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -1,12 +1,16 @@
 from flask import Blueprint, request, jsonify, abort
 from app import db
 from app.models import Category
+from app.categories import category_cache, normalize
+from app.http_cache import cached
+from app.tenancy import current_tenant
 
 bp = Blueprint('categories', __name__, url_prefix='/categories')
 
 @bp.route('', methods=['GET'])
+@cached
 def get_categories():
-    cats = Category.query.all()
+    cats = Category.query.filter_by(tenant_id=current_tenant()).all()
     return jsonify([c.to_json() for c in cats]), 200
 
 @bp.route('', methods=['POST'])
@@ -15,11 +19,14 @@ def create_category():
     if not data or 'name' not in data:
         abort(400, description='Missing required field: name')
     
-    # Check if unique
-    if Category.query.filter_by(name=data['name']).first():
+    # Check if unique (case-insensitive, same rule as get_or_create_category)
+    key = normalize(data['name'])
+    tenant = current_tenant()
+    if Category.query.filter_by(tenant_id=tenant, name_lower=key).first():
          abort(400, description=f"Category '{data['name']}' already exists")
 
     new_cat = Category(name=data['name'])
     db.session.add(new_cat)
     db.session.commit()
+    category_cache.invalidate((tenant, key))
     return jsonify({'message': 'Category created', 'category': new_cat.to_json()}), 201
\ No newline at end of file
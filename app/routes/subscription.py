@@ -1,55 +1,297 @@
-from flask import Blueprint, request, jsonify, abort
+from flask import Blueprint, Response, current_app, request, jsonify, abort, stream_with_context
+from sqlalchemy.exc import IntegrityError
 from app import db
-from app.models import Subscription, Category, FrequencyType, StatusType
-from sqlalchemy import func
-from app.models import Budget
+from app.models import Subscription, Category, FrequencyType, StatusType, yearly_minor
+from app.models import SUBSCRIPTION_FIELDS, subscription_columns
+from app.money import MONTHS, from_minor, price_error, to_minor
+from app.fx import parse_currency, parse_known
+from app.serializers import subscription_serializer
+from app.spend import admit, admit_change, apply_delta, reserve
+from app.categories import get_or_create_category, normalize, resolve_categories
+from app import bulk
+from app.history import log_inserted, log_rows
+from app.http_cache import cached
+from app.tenancy import current_tenant
+from app.renewals import MAX_HORIZON_DAYS, parse_anchor, upcoming_charges
+from app import search
 
 # Define Blueprint
 bp = Blueprint('subscriptions', __name__, url_prefix='/subscriptions')
 
-# --- Helper Function ---
-def get_or_create_category(category_name):
-    # 1. Try to find the category
-    category = Category.query.filter(func.lower(Category.name) == category_name.lower()).first()
-    
-    # 2. If it doesn't exist, create it!
-    if not category:
-        category = Category(name=category_name.capitalize())
-        db.session.add(category)
-        db.session.commit() 
-        
-    return category
+# --- Listing Helpers ---
+MAX_PAGE_SIZE = 1000
+MAX_SEARCH_PAGE = 100
+# ?sort= field -> column the list is ordered by; id breaks ties
+SORTS = {
+    'id': Subscription.id,
+    'name': Subscription.name,
+    'price': Subscription.price_minor,
+    'monthly_price': Subscription.yearly_minor,
+}
+STREAM_BATCH_SIZE = 500
+
+def parse_fields(raw):
+    if not raw:
+        return SUBSCRIPTION_FIELDS
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in SUBSCRIPTION_FIELDS]
+    if unknown or not fields:
+        abort(400, description=f'Invalid fields: {unknown}. Allowed: {list(SUBSCRIPTION_FIELDS)}')
+    # The cursor needs the id, keep it first so clients can page
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return tuple(dict.fromkeys(fields))
+
+def parse_positive_int(name, maximum=None):
+    raw = request.args.get(name)
+    if raw is None:
+        return None
+    try:
+        value = int(raw)
+        if value < 0 or (maximum is not None and not 0 < value <= maximum): raise ValueError
+    except ValueError:
+        limit = f' between 1 and {maximum}' if maximum else ''
+        abort(400, description=f'{name} must be a positive integer{limit}')
+    return value
+
+def parse_choices(name, enum):
+    # ?status=Active&status=Paused or ?status=Active,Paused
+    values = [v.strip() for raw in request.args.getlist(name) for v in raw.split(',') if v.strip()]
+    try:
+        return [enum(v) for v in values]
+    except ValueError:
+        abort(400, description=f'Invalid {name}. Allowed: {[e.value for e in enum]}')
+
+def parse_price(name, currency=None):
+    # In minor units, compared exactly against the integer columns
+    raw = request.args.get(name)
+    if raw is None:
+        return None
+    try:
+        return to_minor(raw, currency)
+    except ValueError:
+        abort(400, description=f'{name} must be a positive number')
+
+def category_filter(names):
+    # Category ids come from the (tenant_id, name_lower) unique index, no join needed
+    ids = db.select(Category.id).where(Category.tenant_id == current_tenant())
+    if len(names) == 1:
+        # Equality keeps (tenant_id, category_id, id) usable in id order
+        return Subscription.category_id == ids.where(Category.name_lower == names[0].lower()).scalar_subquery()
+    return Subscription.category_id.in_(ids.where(Category.name_lower.in_([n.lower() for n in names])))
+
+def parse_filters():
+    """SQL conditions for the ?status, frequency, category, currency and price range filters."""
+    where = []
+    statuses = parse_choices('status', StatusType)
+    if statuses:
+        where.append(Subscription.status.in_(statuses))
+    frequencies = parse_choices('frequency', FrequencyType)
+    if frequencies:
+        where.append(Subscription.frequency.in_(frequencies))
+    categories = request.args.getlist('category')
+    if categories:
+        where.append(category_filter(categories))
+    try:
+        currencies = [parse_currency(v) for raw in request.args.getlist('currency') for v in raw.split(',') if v.strip()]
+    except ValueError as e:
+        abort(400, description=str(e))
+    if currencies:
+        where.append(Subscription.currency.in_(currencies))
+    # Price bounds are read in the filtered currency's minor unit
+    currency = currencies[0] if len(set(currencies)) == 1 else None
+    # field -> (column, factor from the price in the query string to the column's unit)
+    ranges = {'price': (Subscription.price_minor, 1), 'monthly_price': (Subscription.yearly_minor, MONTHS)}
+    for field, (column, factor) in ranges.items():
+        low, high = parse_price(f'min_{field}', currency), parse_price(f'max_{field}', currency)
+        if low is not None:
+            where.append(column >= low * factor)
+        if high is not None:
+            where.append(column <= high * factor)
+    return where
+
+def parse_sort():
+    raw = request.args.get('sort', 'id')
+    field = raw[1:] if raw.startswith('-') else raw
+    if field not in SORTS:
+        abort(400, description=f'Invalid sort. Allowed: {list(SORTS)}, prefix with - for descending')
+    return field, raw.startswith('-')
+
+def list_query(fields, where=(), after=None, limit=None, sort=('id', False)):
+    # Keyset pagination on (sort key, id): each page is an index range scan, no OFFSET
+    field, descending = sort
+    key = SORTS[field]
+    stmt = (
+        db.select(*subscription_columns(fields))
+        .select_from(Subscription)
+        .where(Subscription.tenant_id == current_tenant(), *where)
+    )
+    if 'category' in fields:
+        stmt = stmt.join(Category, Subscription.category_id == Category.id)
+    if after is not None:
+        if field == 'id':
+            position, cursor = Subscription.id, after
+        else:
+            # The cursor stays a plain id, its sort value is looked up in the same query
+            anchor = db.select(key).where(Subscription.id == after, Subscription.tenant_id == current_tenant())
+            position = db.tuple_(key, Subscription.id)
+            cursor = db.tuple_(anchor.scalar_subquery(), after)
+        stmt = stmt.where(position < cursor if descending else position > cursor)
+    order = [key] if field == 'id' else [key, Subscription.id]
+    stmt = stmt.order_by(*[c.desc() for c in order] if descending else order)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+def count_query(where=()):
+    return (
+        db.select(db.func.count())
+        .select_from(Subscription)
+        .where(Subscription.tenant_id == current_tenant(), *where)
+    )
+
+def wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def stream_ndjson(stmt, serializer):
+    # Rows come off a server-side cursor in batches and are written one line each
+    def generate():
+        result = db.session.execute(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+        for row in result:
+            yield serializer.dumps_line(row)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def mutation_body():
+    # The body is optional for bulk PATCH/DELETE, but must be an object when given
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        abort(400, description='Body must be a JSON object')
+    return data
+
+def mutation_scope(data):
+    """(where, ids) for a bulk PATCH/DELETE; refuses an empty scope."""
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(type(i) is int for i in ids):
+            abort(400, description='ids must be a list of integers')
+        if len(ids) > bulk.MAX_BULK_ROWS:
+            abort(400, description=f'Too many ids. Max: {bulk.MAX_BULK_ROWS}')
+        ids = sorted(set(ids))
+    where = parse_filters()
+    if ids is None and not where:
+        abort(400, description='Give ids or at least one filter, an empty scope would touch every subscription')
+    return where, ids
+
+def tenant_subscription(id):
+    # Another tenant's id looks exactly like a missing one
+    return Subscription.query.filter_by(id=id, tenant_id=current_tenant()).first()
 
 # --- Routes ---
 
-# GET ALL (with optional ?category= filter)
+# GET ALL (?status=&frequency=&category=&min_/max_price=&min_/max_monthly_price= filters,
+# ?sort=, ?count=true, ?fields=, ?limit=/&after= paging, ?format=ndjson)
 @bp.route('', methods=['GET'])
+@cached
 def get_subscriptions():
-    category_name = request.args.get('category')
-    
-    if category_name:
-        subs = Subscription.query.join(Category).filter(
-            func.lower(Category.name) == category_name.lower()
-        ).all()
-        # Optional: return empty list if not found, consistent with your previous logic
-        if not subs:
-             return jsonify({
-                'message': f'No subscriptions found in category: {category_name}', 
-                'subscriptions': []
-            }), 200
-    else:
-        subs = Subscription.query.all()
-        
-    return jsonify([sub.to_json() for sub in subs]), 200
+    categories = request.args.getlist('category')
+    where = parse_filters()
+    sort = parse_sort()
+    fields = parse_fields(request.args.get('fields'))
+    after = parse_positive_int('after')
+    limit = parse_positive_int('limit', maximum=MAX_PAGE_SIZE)
+
+    if request.args.get('count', '').lower() in ('1', 'true'):
+        return jsonify({'count': db.session.execute(count_query(where)).scalar()}), 200
+
+    serializer = subscription_serializer(fields)
+
+    if wants_ndjson():
+        return stream_ndjson(list_query(fields, where, after, limit, sort), serializer)
+
+    # Fetch one extra row to know whether another page exists
+    fetch = limit + 1 if limit is not None else None
+    rows = db.session.execute(list_query(fields, where, after, fetch, sort)).all()
+
+    next_after = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1].id
+
+    # Optional: return empty list if not found, consistent with your previous logic
+    if categories and not rows and after is None:
+        return jsonify({
+            'message': f'No subscriptions found in category: {", ".join(categories)}', 
+            'subscriptions': []
+        }), 200
+
+    # Rows go straight to JSON bytes, no intermediate ORM objects or jsonify pass
+    response = current_app.response_class(serializer.dumps_many(rows), mimetype='application/json')
+    if next_after is not None:
+        response.headers['X-Next-After'] = str(next_after)
+    return response, 200
+
+# UPCOMING CHARGES (?days=N, default 30)
+@bp.route('/upcoming', methods=['GET'])
+def get_upcoming():
+    days = parse_positive_int('days', maximum=MAX_HORIZON_DAYS)
+    days = 30 if days is None else days
+    try:
+        currency = parse_known(request.args.get('currency'))
+    except ValueError as e:
+        abort(400, description=str(e))
+    charges, total = upcoming_charges(days, currency=currency)
+    return jsonify({
+        'days': days,
+        'currency': currency,
+        'total': total,
+        'charges': charges
+    }), 200
+
+# SEARCH (?q=, prefix with fuzzy fallback, ranked, &limit=&offset= paging)
+@bp.route('/search', methods=['GET'])
+@cached
+def search_subscriptions():
+    q = request.args.get('q', '')
+    if not search.tokenize(q):
+        abort(400, description='q must contain at least one letter or digit')
+    mode = request.args.get('mode', 'auto')
+    if mode not in search.MODES:
+        abort(400, description=f'Invalid mode. Allowed: {list(search.MODES)}')
+    limit = parse_positive_int('limit', maximum=MAX_SEARCH_PAGE) or 20
+    offset = parse_positive_int('offset') or 0
+
+    # 1. Ranked ids from the index, one extra to know whether another page exists
+    used, ids = search.search_ids(q, limit + 1, offset, mode)
+    next_offset = offset + limit if len(ids) > limit else None
+    ids = ids[:limit]
+
+    # 2. One joined SELECT for the page, back in rank order
+    rows = db.session.execute(list_query(SUBSCRIPTION_FIELDS).where(Subscription.id.in_(ids))).all()
+    position = {id: i for i, id in enumerate(ids)}
+    rows.sort(key=lambda row: position[row.id])
+
+    serializer = subscription_serializer()
+    return jsonify({
+        'query': q,
+        'mode': used,
+        'results': [serializer.to_dict(row) for row in rows],
+        'next_offset': next_offset
+    }), 200
 
 # GET ONE
 @bp.route('/<int:id>', methods=['GET'])
+@cached
 def get_subscription(id):
-    # Use db.session.get to avoid Legacy warning
-    sub = db.session.get(Subscription, id)
-    if not sub:
+    # Single joined SELECT for the row and its category name, no ORM instance
+    row = db.session.execute(
+        list_query(SUBSCRIPTION_FIELDS).where(Subscription.id == id)
+    ).first()
+    if not row:
         abort(404, description=f"Subscription with ID {id} not found")
-    return jsonify(sub.to_json()), 200
+    return jsonify(subscription_serializer().to_dict(row)), 200
 
 # CREATE
 @bp.route('', methods=['POST'])
@@ -62,12 +304,15 @@ def create_subscription():
         if not data or not all(k in data for k in required):
             abort(400, description=f'Missing required fields. Needs: {required}')
         
-        # 2. Validate Price
+        # 2. Validate Currency (optional, needs a loaded rate) and Price (kept as integer minor units)
+        try:
+            currency = parse_known(data.get('currency'))
+        except ValueError as e:
+            abort(400, description=str(e))
         try:
-            price = float(data['price'])
-            if price < 0: raise ValueError
+            price_minor = to_minor(data['price'], currency)
         except ValueError:
-            abort(400, description='Price must be a positive number')
+            abort(400, description=price_error(currency))
 
         # 3. Validate Frequency Enum
         try:
@@ -85,47 +330,31 @@ def create_subscription():
                 allowed = [e.value for e in StatusType]
                 abort(400, description=f'Invalid status. Allowed: {allowed}')
 
-         # 5. Budget limit 
-
-        budget = Budget.query.first()
-
-        if budget and status_enum == StatusType.ACTIVE:
-
-            active_subs = Subscription.query.filter_by(
-                status=StatusType.ACTIVE
-            ).all()
-
-            total_month = 0
-
-            for s in active_subs:
-                if s.frequency == FrequencyType.MONTHLY:
-                    total_month += s.price
-                elif s.frequency == FrequencyType.YEARLY:
-                    total_month += s.price / 12
-                elif s.frequency == FrequencyType.WEEKLY:
-                    total_month += s.price * 4
-
-            # add new subscription estimate
-            if freq_enum == FrequencyType.MONTHLY:
-                total_month += price
-            elif freq_enum == FrequencyType.YEARLY:
-                total_month += price / 12
-            elif freq_enum == FrequencyType.WEEKLY:
-                total_month += price * 4
-
-            if total_month > budget.monthly_limit:
-                abort(400, description="Budget limit exceeded!")
-
-        # 6. Handle Category
-        cat_obj = get_or_create_category(data['category'])
+        # 5. Billing anchor (Optional, defaults to today)
+        anchor = None
+        if data.get('billing_anchor'):
+            try:
+                anchor = parse_anchor(data['billing_anchor'])
+            except ValueError:
+                abort(400, description='billing_anchor must be an ISO date (YYYY-MM-DD)')
 
         new_sub = Subscription(
             name=data['name'],
-            price=price,
+            price_minor=price_minor,
+            currency=currency,
             frequency=freq_enum,
-            category_id=cat_obj.id,
-            status=status_enum
+            status=status_enum,
+            billing_anchor=anchor
         )
+
+        # 6. Budget limit: check-and-add is one conditional UPDATE on the spend counter,
+        # so concurrent creates cannot both take the last of the headroom
+        if not admit(db.session, new_sub):
+            abort(400, description="Budget limit exceeded!")
+
+        # 7. Handle Category
+        cat_obj = get_or_create_category(data['category'])
+        new_sub.category_id = cat_obj.id
         db.session.add(new_sub)
         db.session.commit()
         
@@ -140,25 +369,163 @@ def create_subscription():
         if hasattr(e, 'code'): raise e 
         abort(500, description=str(e))
 
+# BULK CREATE (JSON array, NDJSON or CSV body)
+@bp.route('/bulk', methods=['POST'])
+def bulk_create_subscriptions():
+    atomic = request.args.get('atomic', '').lower() in ('1', 'true')
+
+    # 1. Parse the whole body
+    try:
+        rows = bulk.parse_rows(request.get_data(), request.mimetype)
+    except bulk.BulkParseError as e:
+        abort(400, description=str(e))
+
+    if not rows:
+        abort(400, description='No rows to import')
+    if len(rows) > bulk.MAX_BULK_ROWS:
+        abort(400, description=f'Too many rows. Max: {bulk.MAX_BULK_ROWS}')
+
+    # 2. Validate every row, then drop names that already exist (one IN query per chunk)
+    valid, errors = bulk.validate_rows(rows)
+
+    taken = bulk.existing_names((params['name'] for _, params in valid), current_tenant())
+    if taken:
+        errors += [
+            {"row": i, "error": f"Subscription '{params['name']}' already exists"}
+            for i, params in valid if params['name'] in taken
+        ]
+        valid = [(i, params) for i, params in valid if params['name'] not in taken]
+    errors.sort(key=lambda e: e['row'])
+
+    if not valid or (atomic and errors):
+        return jsonify({'message': 'Nothing imported', 'created': 0,
+                        'failed': len(errors), 'errors': errors}), 400
+
+    # 3. One budget admission for the whole batch (also moves the aggregate,
+    # Core inserts skip the flush hook)
+    for currency, (amount, count) in bulk.batch_spend(valid).items():
+        if count and not reserve(db.session, amount, count, currency=currency):
+            abort(400, description="Budget limit exceeded!")
+
+    # 4. Resolve all categories at once, then insert in chunks in one transaction
+    categories = resolve_categories(params['category'] for _, params in valid)
+
+    params = []
+    for _, row in valid:
+        category = categories[normalize(row.pop('category'))]
+        params.append(dict(row, category_id=category.id, tenant_id=current_tenant()))
+
+    try:
+        bulk.insert_rows(params)
+        # Core inserts skip the flush hooks, so log the events by hand
+        log_inserted(db.session, current_tenant(), (p['name'] for p in params))
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent create took a name after the check in step 2: the whole batch,
+        # budget reservation included, is rolled back and the clashing rows reported
+        db.session.rollback()
+        taken = bulk.existing_names((p['name'] for p in params), current_tenant())
+        errors += [
+            {"row": i, "error": f"Subscription '{row['name']}' already exists"}
+            for i, row in valid if row['name'] in taken
+        ]
+        errors.sort(key=lambda e: e['row'])
+        return jsonify({'message': 'Nothing imported', 'created': 0,
+                        'failed': len(errors), 'errors': errors}), 409
+
+    return jsonify({
+        'message': 'Imported',
+        'created': len(params),
+        'failed': len(errors),
+        'errors': errors
+    }), 201
+
+# BULK STATUS CHANGE (body {"status", "ids"?} and/or the list filters in the query string)
+@bp.route('', methods=['PATCH'])
+def bulk_update_status():
+    data = mutation_body()
+    try:
+        status = StatusType(data.get('status'))
+    except ValueError:
+        abort(400, description=f'Invalid status. Allowed: {[e.value for e in StatusType]}')
+    where, ids = mutation_scope(data)
+    tenant = current_tenant()
+
+    # 1. One UPDATE ... RETURNING per old-status group (per id chunk)
+    rows, was_active = bulk.update_status(where, ids, status, tenant)
+
+    # 2. Spend: rows becoming Active are admitted against the budget, one
+    # reservation per currency, rows leaving Active give their share back
+    amounts = [yearly_minor(row.price_minor, row.frequency) for row in rows]
+    if status == StatusType.ACTIVE:
+        deltas = amounts
+        for currency, (amount, count) in bulk.spend_by_currency(rows, deltas, [1] * len(rows)).items():
+            if not reserve(db.session, amount, count, tenant, currency):
+                db.session.rollback()
+                abort(400, description="Budget limit exceeded!")
+    else:
+        deltas = [-amount if active else 0 for amount, active in zip(amounts, was_active)]
+        for currency, (amount, count) in bulk.spend_by_currency(rows, deltas, [-a for a in was_active]).items():
+            apply_delta(db.session, amount, count, tenant, currency)
+
+    # 3. Core statements skip the flush hooks, so log the events by hand
+    log_rows(db.session, tenant, 'updated', rows, deltas)
+    db.session.commit()
+
+    ids = sorted(row.id for row in rows)
+    return jsonify({'message': 'Updated', 'status': status.value, 'updated': len(ids), 'ids': ids}), 200
+
+# BULK DELETE (body {"ids"?} and/or the list filters in the query string)
+@bp.route('', methods=['DELETE'])
+def bulk_delete():
+    where, ids = mutation_scope(mutation_body())
+    tenant = current_tenant()
+
+    # 1. DELETE ... RETURNING hands back the values the rows had
+    rows = bulk.delete_rows(where, ids, tenant)
+
+    # 2. Spend and history, as the flush hooks would have done per row
+    was_active = [row.status == StatusType.ACTIVE for row in rows]
+    deltas = [-yearly_minor(row.price_minor, row.frequency) if active else 0 for row, active in zip(rows, was_active)]
+    for currency, (amount, count) in bulk.spend_by_currency(rows, deltas, [-a for a in was_active]).items():
+        apply_delta(db.session, amount, count, tenant, currency)
+    log_rows(db.session, tenant, 'deleted', rows, deltas)
+    db.session.commit()
+
+    ids = sorted(row.id for row in rows)
+    return jsonify({'message': 'Deleted', 'deleted': len(ids), 'ids': ids}), 200
+
 # UPDATE
 @bp.route('/<int:id>', methods=['PUT'])
 def update_subscription(id):
     try:
-        sub = db.session.get(Subscription, id)
+        sub = tenant_subscription(id)
         if not sub:
              abort(404, description=f"Subscription with ID {id} not found")
 
         data = request.get_json()
 
+        # Resolved first: creating a category can flush, and a flushed price change
+        # would reach the spend total without the budget check below
+        category = get_or_create_category(data['category']) if 'category' in data else None
+
         if 'name' in data: sub.name = data['name']
         
-        if 'price' in data:
+        currency = sub.currency
+        if 'currency' in data:
             try:
-                val = float(data['price'])
-                if val < 0: raise ValueError
-                sub.price = val
+                currency = parse_known(data['currency'])
+            except ValueError as e:
+                abort(400, description=str(e))
+
+        if 'price' in data or currency != sub.currency:
+            # A new currency alone keeps the amount: 12.50 USD becomes 12.50 EUR
+            price = data['price'] if 'price' in data else from_minor(sub.price_minor, sub.currency)
+            try:
+                sub.price_minor = to_minor(price, currency)
             except ValueError:
-                abort(400, description='Invalid price')
+                abort(400, description='Invalid price' if 'price' in data else price_error(currency))
+            sub.currency = currency
 
         if 'frequency' in data:
             try:
@@ -172,9 +539,19 @@ def update_subscription(id):
             except ValueError:
                 abort(400, description=f'Invalid status. Allowed: {[e.value for e in StatusType]}')
 
-        if 'category' in data: 
-            cat_obj = get_or_create_category(data['category'])
-            sub.category_id = cat_obj.id
+        if 'billing_anchor' in data:
+            try:
+                sub.billing_anchor = parse_anchor(data['billing_anchor'])
+            except ValueError:
+                abort(400, description='billing_anchor must be an ISO date (YYYY-MM-DD)')
+
+        if category:
+            sub.category_id = category.id
+
+        # Reactivating or raising the price is admitted like a create
+        if not admit_change(db.session, sub):
+            db.session.rollback()
+            abort(400, description="Budget limit exceeded!")
 
         db.session.commit()
         return jsonify({'message': 'Updated', 'subscription': sub.to_json()}), 200
@@ -185,7 +562,7 @@ def update_subscription(id):
 # DELETE
 @bp.route('/<int:id>', methods=['DELETE'])
 def delete_subscription(id):
-    sub = db.session.get(Subscription, id)
+    sub = tenant_subscription(id)
     if not sub:
         abort(404, description=f"Cannot delete: Subscription {id} does not exist")
         
@@ -0,0 +1,206 @@
+"""Subscription search backed by SQLite FTS5.
+
+Three full-text indexes, keyed by subscription id:
+
+  subscription_search_name     unicode61 words of the name, for name matches ranked first
+  subscription_search          the same over name and category name, for the rest
+  subscription_search_trigram  trigrams of both, for fuzzy matches when no word matches
+
+Both word indexes keep prefix indexes up to MAX_PREFIX characters.
+
+SQL triggers on subscription and category keep them in sync. They also
+catch Core inserts such as the bulk import. Other databases fall back to an
+unindexed LIKE.
+"""
+import re
+
+from sqlalchemy import event, text
+
+from app import db
+from app.models import Category, Subscription
+from app.tenancy import current_tenant
+
+SEARCH_TABLE = 'subscription_search'
+NAME_TABLE = 'subscription_search_name'
+FUZZY_TABLE = 'subscription_search_trigram'
+MODES = ('auto', 'prefix', 'fuzzy')
+
+# Prefix indexes for 1..8 characters: "net"* is a single doclist read, not a merge
+MAX_PREFIX = 8
+# Fuzzy matches are ranked in Python, over at most this many candidates
+FUZZY_CANDIDATES = 1000
+
+WORDS = (
+    "tokenize='unicode61 remove_diacritics 2', "
+    f"prefix='{' '.join(str(n) for n in range(1, MAX_PREFIX + 1))}'"
+)
+# table -> (indexed columns, tokenizer options)
+TABLES = {
+    SEARCH_TABLE: (('name', 'category'), WORDS),
+    NAME_TABLE: (('name',), WORDS),
+    FUZZY_TABLE: (('name', 'category'), "tokenize='trigram'"),
+}
+
+_CATEGORY_NAME = "(SELECT name FROM category WHERE id = {category_id})"
+
+
+def _index_row(columns, id, tenant, name, category_id):
+    values = [id, tenant, name]
+    if 'category' in columns:
+        values.append(_CATEGORY_NAME.format(category_id=category_id))
+    return f"SELECT {', '.join(values)}"
+
+DDL = []
+for _table, (_columns, _options) in TABLES.items():
+    _fields = ', '.join(('rowid', 'tenant_id') + _columns)
+    _row = _index_row(_columns, 'new.id', 'new.tenant_id', 'new.name', 'new.category_id')
+    DDL += [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {_table} USING fts5("
+        f"tenant_id, {', '.join(_columns)}, {_options})",
+        f"CREATE TRIGGER IF NOT EXISTS {_table}_ai AFTER INSERT ON subscription BEGIN "
+        f"INSERT INTO {_table} ({_fields}) {_row}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {_table}_au AFTER UPDATE OF name, category_id, tenant_id ON subscription BEGIN "
+        f"DELETE FROM {_table} WHERE rowid = old.id; "
+        f"INSERT INTO {_table} ({_fields}) {_row}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {_table}_ad AFTER DELETE ON subscription BEGIN "
+        f"DELETE FROM {_table} WHERE rowid = old.id; END",
+    ]
+    if 'category' in _columns:
+        DDL.append(
+            f"CREATE TRIGGER IF NOT EXISTS {_table}_cu AFTER UPDATE OF name ON category BEGIN "
+            f"UPDATE {_table} SET category = new.name WHERE rowid IN "
+            f"(SELECT id FROM subscription WHERE tenant_id = new.tenant_id AND category_id = new.id); END"
+        )
+
+
+# --- Schema ---
+def available(conn):
+    return conn.dialect.name == 'sqlite'
+
+def install(conn):
+    """Create the FTS tables and triggers (idempotent)."""
+    if not available(conn):
+        return
+    for statement in DDL:
+        conn.execute(text(statement))
+
+def reindex(conn):
+    """Refill both indexes from the subscription table."""
+    if not available(conn):
+        return
+    for table, (columns, _) in TABLES.items():
+        fields = ', '.join(('rowid', 'tenant_id') + columns)
+        row = _index_row(columns, 'id', 'tenant_id', 'name', 'subscription.category_id')
+        conn.execute(text(f"DELETE FROM {table}"))
+        conn.execute(text(f"INSERT INTO {table} ({fields}) {row} FROM subscription"))
+
+@event.listens_for(Subscription.__table__, 'after_create')
+def _install_on_create(target, connection, **kw):
+    install(connection)
+
+@event.listens_for(Subscription.__table__, 'before_drop')
+def _drop_on_drop(target, connection, **kw):
+    if available(connection):
+        for table in TABLES:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+
+# --- Queries ---
+def tokenize(q):
+    return re.findall(r'\w+', q.lower())
+
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+def prefix_query(tokens):
+    # Every word must match as a prefix: "net prem" -> "net"* "prem"*.
+    # Longer words are cut to the longest prefix index, a scan-free lookup.
+    return ' '.join(_phrase(t[:MAX_PREFIX]) + '*' for t in tokens)
+
+def tenant_filter(tenant, table=SEARCH_TABLE):
+    # Indexed column, so FTS intersects doclists instead of filtering every hit.
+    # It may over-match ("a-b" vs "a.b"); the SQL tenant_id check stays exact.
+    if table == FUZZY_TABLE:
+        # Trigrams match substrings, and nothing shorter than three characters
+        return f'tenant_id : {_phrase(tenant)} AND ' if len(tenant) >= 3 else ''
+    words = tokenize(tenant)
+    return f'tenant_id : {_phrase(" ".join(words))} AND ' if words else ''
+
+def trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def similarity(grams, text):
+    other = trigrams(text or '')
+    return len(grams & other) / len(grams | other) if grams and other else 0.0
+
+def _match_ids(table, match, tenant, limit, offset=0):
+    return db.session.execute(
+        text(f"SELECT rowid FROM {table} WHERE {table} MATCH :match AND tenant_id = :tenant "
+             "ORDER BY rank, rowid LIMIT :limit OFFSET :offset"),
+        {"match": match, "tenant": tenant, "limit": limit, "offset": offset}
+    ).scalars().all()
+
+def _prefix_ids(tokens, tenant, limit, offset):
+    # Tier 1: every word in the name. Tier 2: the rest (category involved).
+    # Each tier is ordered by FTS5's bm25 rank, then id, so pages are stable.
+    # Tier 1 has its own name-only index: a column filter would still walk a
+    # word's whole doclist when it only ever appears in category names.
+    words = prefix_query(tokens)
+    scope = tenant_filter(tenant)
+    names = _match_ids(NAME_TABLE, f'{scope}({words})', tenant, offset + limit)
+    ids = names[offset:]
+    if len(names) < offset + limit:
+        skip = max(offset - len(names), 0)
+        ids += _match_ids(
+            SEARCH_TABLE, f'{scope}({words}) NOT name : ({words})', tenant, limit - len(ids), skip
+        )
+    return ids
+
+def _fuzzy_ids(q, tokens, tenant, limit, offset):
+    # Candidates share a 4-character run with the query (one typo in a word
+    # still leaves some intact), then are ranked by trigram similarity, a
+    # category match counting half as much as a name match. The candidates are
+    # the best bm25 matches, so every page ranks the same set.
+    grams = dict.fromkeys(t[i:i + 4] for t in tokens for i in range(max(len(t) - 3, 1)) if len(t) >= 3)
+    if not grams:
+        return []
+    match = f'{tenant_filter(tenant, FUZZY_TABLE)}({" OR ".join(_phrase(g) for g in grams)})'
+    rows = db.session.execute(
+        text(f"SELECT rowid, name, category FROM {FUZZY_TABLE} "
+             f"WHERE {FUZZY_TABLE} MATCH :match AND tenant_id = :tenant ORDER BY rank, rowid LIMIT :limit"),
+        {"match": match, "tenant": tenant, "limit": FUZZY_CANDIDATES}
+    ).all()
+    query = trigrams(q)
+    ranked = sorted(rows, key=lambda r: (-max(similarity(query, r.name), similarity(query, r.category) / 2), r.rowid))
+    return [r.rowid for r in ranked[offset:offset + limit]]
+
+def like_pattern(q):
+    # The query is matched literally: its own % and _ are not wildcards
+    return '%' + re.sub(r'([\\%_])', r'\\\1', q) + '%'
+
+def _like_ids(q, tenant, limit, offset):
+    pattern = like_pattern(q)
+    return db.session.scalars(
+        db.select(Subscription.id)
+        .join(Category, Subscription.category_id == Category.id)
+        .where(Subscription.tenant_id == tenant)
+        .where(Subscription.name.ilike(pattern, escape='\\') | Category.name.ilike(pattern, escape='\\'))
+        .order_by(Subscription.name, Subscription.id)
+        .limit(limit).offset(offset)
+    ).all()
+
+def search_ids(q, limit, offset=0, mode='auto', tenant=None):
+    """Return (mode used, ranked subscription ids) for one page of results."""
+    tenant = tenant or current_tenant()
+    if not available(db.session.connection()):
+        return 'like', _like_ids(q, tenant, limit, offset)
+
+    tokens = tokenize(q)
+    if mode in ('auto', 'prefix'):
+        ids = _prefix_ids(tokens, tenant, limit, offset)
+        # auto only falls back when no word matches at all, so later pages stay in one mode
+        if ids or mode == 'prefix' or (offset and _prefix_ids(tokens, tenant, 1, 0)):
+            return 'prefix', ids
+
+    return 'fuzzy', _fuzzy_ids(q, tokens, tenant, limit, offset)
@@ -0,0 +1,110 @@
+import enum
+import json
+import time
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional speed-up, stdlib json is the fallback
+    orjson = None
+
+from app.metrics import record_serialization, serialization_timer
+from app.models import SUBSCRIPTION_FIELDS
+
+
+def _default(obj):
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# --- Encoders ---
+if orjson is not None:
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps_bytes(obj):
+        return _encoder.encode(obj).encode('utf-8')
+
+    loads = json.loads
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson when it is installed."""
+
+    @staticmethod
+    def default(o):
+        # ISO dates like orjson, not Flask's default HTTP date format
+        if isinstance(o, (enum.Enum, Decimal, date)):
+            return _default(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        with serialization_timer(len(obj) if isinstance(obj, list) else 0):
+            body = dumps_bytes(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+# --- Row Serializers ---
+class RowSerializer:
+    """Turns column tuples into JSON bytes for one fixed set of fields."""
+
+    __slots__ = ('fields', 'enum_positions')
+
+    def __init__(self, fields, enum_fields=()):
+        self.fields = tuple(fields)
+        # orjson writes Enum.value natively, stdlib needs it swapped in
+        self.enum_positions = () if orjson is not None else tuple(
+            i for i, f in enumerate(self.fields) if f in enum_fields
+        )
+
+    def to_dict(self, row):
+        data = dict(zip(self.fields, row))
+        for i in self.enum_positions:
+            key = self.fields[i]
+            if data[key] is not None:
+                data[key] = data[key].value
+        return data
+
+    def dumps_many(self, rows):
+        start = time.perf_counter()
+        data = [self.to_dict(row) for row in rows]
+        body = dumps_bytes(data)
+        record_serialization(time.perf_counter() - start, len(data))
+        return body
+
+    def dumps_line(self, row):
+        start = time.perf_counter()
+        line = dumps_bytes(self.to_dict(row)) + b'\n'
+        record_serialization(time.perf_counter() - start, 1)
+        return line
+
+
+@lru_cache(maxsize=64)
+def subscription_serializer(fields=SUBSCRIPTION_FIELDS):
+    return RowSerializer(fields, enum_fields=('frequency', 'status'))
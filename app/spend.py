@@ -0,0 +1,334 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Budget, Subscription, SpendSummary, StatusType, yearly_minor, yearly_minor_expr
+from app.money import MONTHS, default_currency
+from app.fx import convert, convert_totals
+from app.categories import upsert_insert
+from app.alerts import recheck
+from app.tenancy import current_tenant
+
+
+# --- Helpers ---
+def _contribution(price_minor, frequency, status):
+    # (yearly minor units, active count) a subscription adds to its tenant's spend
+    if status != StatusType.ACTIVE or price_minor is None or frequency is None:
+        return 0, 0
+    return yearly_minor(price_minor, frequency), 1
+
+def _committed(state, key):
+    # Value of an attribute as it currently sits in the database
+    hist = state.attrs[key].history
+    if hist.deleted:
+        return hist.deleted[0]
+    if hist.unchanged:
+        return hist.unchanged[0]
+    return hist.added[0] if hist.added else None
+
+def _old_contribution(state):
+    return _contribution(
+        _committed(state, 'price_minor'),
+        _committed(state, 'frequency'),
+        _committed(state, 'status')
+    )
+
+def _new_contribution(obj):
+    # Pending rows get the column default at INSERT time
+    status = obj.status if obj.status is not None else StatusType.ACTIVE
+    return _contribution(obj.price_minor, obj.frequency, status)
+
+
+def compute_spend(session=None, tenant=None, currency=None):
+    """Recompute a tenant's active {currency: (yearly_minor total, count)} from the subscription table."""
+    session = session or db.session
+    stmt = (
+        select(Subscription.currency, func.sum(yearly_minor_expr()), func.count())
+        .where(Subscription.tenant_id == (tenant or current_tenant()))
+        .where(Subscription.status == StatusType.ACTIVE)
+        .group_by(Subscription.currency)
+    )
+    if currency is not None:
+        stmt = stmt.where(Subscription.currency == currency)
+    return {row_currency: (total, count) for row_currency, total, count in session.execute(stmt)}
+
+def _ensure_summaries(session, tenant, currency):
+    """Create the tenant's summary rows from a scan the first time one is needed.
+
+    A tenant has either no rows yet or one for every currency it has active
+    spend in, so a missing row for one currency scans only that currency.
+    """
+    table = SpendSummary.__table__
+    conn = session.connection()
+    existing = set(conn.execute(select(table.c.currency).where(table.c.tenant_id == tenant)).scalars())
+    if currency in existing:
+        return
+
+    spend = compute_spend(session, tenant, currency if existing else None)
+    spend.setdefault(currency, (0, 0))
+    rows = [
+        {"tenant_id": tenant, "currency": c, "yearly_total": total, "active_count": count}
+        for c, (total, count) in spend.items() if c not in existing
+    ]
+    insert = upsert_insert(conn.dialect.name)
+    if insert is not None:
+        # A concurrent first request may create them too, either row is correct
+        conn.execute(insert(table).on_conflict_do_nothing(index_elements=['tenant_id', 'currency']), rows)
+        return
+    for row in rows:
+        try:
+            with session.begin_nested():
+                conn.execute(table.insert().values(**row))
+        except IntegrityError:
+            pass
+
+def _shift(conn, tenant, currency, amount, count):
+    table = SpendSummary.__table__
+    return conn.execute(
+        table.update()
+        .where(table.c.tenant_id == tenant)
+        .where(table.c.currency == currency)
+        .values(
+            yearly_total=table.c.yearly_total + amount,
+            active_count=table.c.active_count + count
+        )
+    ).rowcount
+
+def lock_budget(session, tenant):
+    """Lock the tenant's budget row until the transaction ends; False when it has none.
+
+    A no-op UPDATE, so parallel writers queue behind it. Every spend writer
+    takes it before touching spend_summary: with one lock order, a create
+    and an update of the same tenant can't deadlock each other.
+    """
+    budget = Budget.__table__
+    return session.connection().execute(
+        budget.update().where(budget.c.tenant_id == tenant).values(limit_minor=budget.c.limit_minor)
+    ).rowcount > 0
+
+def apply_delta(session, amount, count, tenant=None, currency=None):
+    """Shift a tenant's stored aggregate, creating it from a full scan on first use."""
+    if not amount and not count:
+        return
+
+    tenant = tenant or current_tenant()
+    currency = currency or default_currency()
+    lock_budget(session, tenant)
+    if _shift(session.connection(), tenant, currency, amount, count) == 0:
+        _ensure_summaries(session, tenant, currency)
+        _shift(session.connection(), tenant, currency, amount, count)
+    recheck(session, tenant)
+
+def reserve(session, amount, count, tenant=None, currency=None):
+    """Add to the tenant's aggregate only if its spend stays within the budget.
+
+    The budget row is locked first (lock_budget), so parallel writers cannot
+    both pass on the same headroom. Each currency's yearly total is
+    converted into the budget's currency once and the sum compared as
+    integers, so the boundary case is exact.
+    """
+    tenant = tenant or current_tenant()
+    currency = currency or default_currency()
+    has_budget = lock_budget(session, tenant)
+    _ensure_summaries(session, tenant, currency)
+
+    conn = session.connection()
+    budget = Budget.__table__
+    if has_budget:
+        limit, budget_currency = conn.execute(
+            select(budget.c.limit_minor, budget.c.currency).where(budget.c.tenant_id == tenant)
+        ).one()
+        totals = _stored_totals(conn, tenant)
+        totals[currency] = totals.get(currency, 0) + amount
+        if convert_totals(totals, budget_currency) > limit * MONTHS:
+            return False
+
+    _shift(conn, tenant, currency, amount, count)
+    recheck(session, tenant)
+    return True
+
+def admit(session, obj):
+    """Reserve a new subscription's spend; False means the budget would be exceeded."""
+    amount, count = _new_contribution(obj)
+    if not count:
+        return True
+    if not reserve(session, amount, count, obj.tenant_id or current_tenant(), obj.currency):
+        return False
+    # Already counted, the flush hook must not add it again
+    session.info.setdefault('spend_admitted', set()).add(obj)
+    return True
+
+def admit_change(session, obj):
+    """Re-admit a changed subscription whose spend grows; False means the budget would be exceeded.
+
+    Its old share comes off first, so only the increase is held against the
+    headroom, as for a create. A change that lowers spend always passes,
+    even over budget, and is left to the flush hook.
+    """
+    state = inspect(obj)
+    old_amount, old_count = _old_contribution(state)
+    new_amount, new_count = _new_contribution(obj)
+    old_currency, currency = _committed(state, 'currency'), obj.currency
+    if new_amount <= convert(old_amount, old_currency, currency):
+        return True
+    tenant = obj.tenant_id or current_tenant()
+    # No autoflush: the hook must not count the change before it is admitted
+    with session.no_autoflush:
+        apply_delta(session, -old_amount, -old_count, tenant, old_currency)
+        if not reserve(session, new_amount, new_count, tenant, currency):
+            return False
+    session.info.setdefault('spend_admitted', set()).add(obj)
+    return True
+
+def _stored_totals(conn, tenant):
+    table = SpendSummary.__table__
+    return dict(conn.execute(
+        select(table.c.currency, table.c.yearly_total).where(table.c.tenant_id == tenant)
+    ).all())
+
+def _summaries(tenant):
+    return {
+        row.currency: (row.yearly_total, row.active_count)
+        for row in SpendSummary.query.filter_by(tenant_id=tenant)
+    }
+
+def get_spend(tenant=None):
+    """Return {currency: (yearly_total in minor units, active_count)} from the tenant's stored aggregate.
+
+    A tenant without one yet is scanned, not materialised: reads never write.
+    The first spend change creates the rows (_ensure_summaries), or `spend reconcile`.
+    """
+    tenant = tenant or current_tenant()
+    return _summaries(tenant) or compute_spend(tenant=tenant) or {default_currency(): (0, 0)}
+
+def spend_in(currency=None, tenant=None):
+    """(yearly total in minor units of currency, active_count) across every currency the tenant pays in."""
+    spend = get_spend(tenant)
+    totals = {c: total for c, (total, _) in spend.items()}
+    return convert_totals(totals, currency or default_currency()), sum(n for _, n in spend.values())
+
+def rebuild(tenant=None):
+    tenant = tenant or current_tenant()
+    spend = compute_spend(tenant=tenant) or {default_currency(): (0, 0)}
+    table = SpendSummary.__table__
+    db.session.execute(table.delete().where(table.c.tenant_id == tenant))
+    db.session.execute(table.insert(), [
+        {"tenant_id": tenant, "currency": c, "yearly_total": total, "active_count": count}
+        for c, (total, count) in spend.items()
+    ])
+    db.session.commit()
+    return spend
+
+def reconcile(fix=True, tenant=None):
+    """Compare a tenant's stored aggregate against a full recompute, per currency."""
+    tenant = tenant or current_tenant()
+    stored = _summaries(tenant)
+    actual = compute_spend(tenant=tenant)
+
+    # A currency nobody pays in any more may keep an empty row
+    def nonzero(spend):
+        return {c: value for c, value in spend.items() if value != (0, 0)}
+
+    drift = None
+    if stored:
+        drift = {
+            c: stored.get(c, (0, 0))[0] - actual.get(c, (0, 0))[0]
+            for c in sorted(set(stored) | set(actual))
+        }
+        drift = {c: d for c, d in drift.items() if d}
+    in_sync = bool(stored) and nonzero(stored) == nonzero(actual)
+
+    if fix and not in_sync:
+        rebuild(tenant)
+
+    return {
+        "tenant": tenant,
+        "stored": stored or None,
+        "actual": actual,
+        "drift": drift,
+        "in_sync": in_sync,
+        "fixed": fix and not in_sync
+    }
+
+def all_tenants():
+    subs = select(Subscription.tenant_id).distinct()
+    summaries = select(SpendSummary.tenant_id)
+    return sorted(db.session.scalars(subs.union(summaries)))
+
+
+# --- Session Hook ---
+@event.listens_for(db.session, 'before_flush')
+def track_spend(session, flush_context, instances):
+    # (tenant, currency) -> [amount, count]
+    deltas = {}
+    default = None
+
+    def add(obj, currency, amount, count):
+        nonlocal default
+        if not amount and not count:
+            return
+        # Pending rows get current_tenant() and the configured currency as column defaults at INSERT time
+        if currency is None:
+            default = default or default_currency()
+            currency = default
+        delta = deltas.setdefault((obj.tenant_id or current_tenant(), currency), [0, 0])
+        delta[0] += amount
+        delta[1] += count
+
+    admitted = session.info.get('spend_admitted', set())
+
+    with session.no_autoflush:
+        for obj in session.new:
+            if obj in admitted:
+                admitted.discard(obj)
+            elif isinstance(obj, Subscription):
+                add(obj, obj.currency, *_new_contribution(obj))
+
+        for obj in session.dirty:
+            if obj in admitted:
+                admitted.discard(obj)
+            elif isinstance(obj, Subscription) and session.is_modified(obj):
+                state = inspect(obj)
+                old_a, old_c = _old_contribution(state)
+                new_a, new_c = _new_contribution(obj)
+                # A currency change moves the spend between two of the tenant's rows
+                add(obj, _committed(state, 'currency'), -old_a, -old_c)
+                add(obj, obj.currency, new_a, new_c)
+
+        for obj in session.deleted:
+            if isinstance(obj, Subscription):
+                state = inspect(obj)
+                a, c = _old_contribution(state)
+                add(obj, _committed(state, 'currency'), -a, -c)
+
+        for (tenant, currency), (amount, count) in deltas.items():
+            apply_delta(session, amount, count, tenant, currency)
+
+@event.listens_for(db.session, 'after_commit')
+@event.listens_for(db.session, 'after_rollback')
+def forget_admitted(session):
+    session.info.pop('spend_admitted', None)
+
+
+# --- CLI ---
+@click.group('spend')
+def spend_cli():
+    """Maintain the stored spend aggregate."""
+
+@spend_cli.command('reconcile')
+@click.option('--dry-run', is_flag=True, help='Only report drift, do not rewrite the aggregate.')
+@click.option('--tenant', default=None, help='Only check this tenant (default: all).')
+@with_appcontext
+def reconcile_command(dry_run, tenant):
+    drifted = False
+    for t in ([tenant] if tenant else all_tenants()):
+        report = reconcile(fix=not dry_run, tenant=t)
+        click.echo(f"[{t}] stored: {report['stored']}  actual: {report['actual']}")
+        if report['in_sync']:
+            continue
+        click.echo(f"[{t}] drift: {report['drift']}" + ("  -> rebuilt" if report['fixed'] else ""))
+        drifted = drifted or not report['fixed']
+    if drifted:
+        raise SystemExit(1)
@@ -0,0 +1,25 @@
+import re
+
+from flask import abort, g, has_request_context, request
+
+# Requests without the header (and CLI/seed code) act on this tenant
+DEFAULT_TENANT = 'default'
+TENANT_HEADER = 'X-Tenant-ID'
+
+_VALID_TENANT = re.compile(r'^[A-Za-z0-9_.:-]{1,64}$')
+
+
+def current_tenant():
+    if has_request_context():
+        return g.get('tenant_id', DEFAULT_TENANT)
+    return DEFAULT_TENANT
+
+def load_tenant():
+    tenant = request.headers.get(TENANT_HEADER, DEFAULT_TENANT)
+    if not _VALID_TENANT.match(tenant):
+        abort(400, description=f'Invalid {TENANT_HEADER}: use 1-64 letters, digits or _.:-')
+    g.tenant_id = tenant
+
+
+def init_app(app):
+    app.before_request(load_tenant)
@@ -0,0 +1,50 @@
+"""ASGI entry point: the same Flask app and blueprints behind an ASGI server.
+
+    pip install asgiref uvicorn
+    uvicorn asgi:app --workers 4
+
+This is a thread-pool fallback, not an async database stack: views stay
+synchronous (they share the Flask-SQLAlchemy session) and run through
+asgiref's stock WsgiToAsgi adapter, each request on a worker thread of its
+own, at most ASGI_THREADS at once. The server's event loop holds idle and
+slow connections, so open connections are no longer capped by the number of
+threads; requests past the limit wait on the loop, not in the kernel backlog.
+"""
+import asyncio
+import os
+
+try:
+    from asgiref.sync import ThreadSensitiveContext
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError as e:  # optional dependency, only needed for ASGI mode
+    raise ImportError("ASGI mode needs asgiref: pip install asgiref uvicorn") from e
+
+from app import create_app
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 64))
+
+
+class FlaskASGI(WsgiToAsgi):
+    def __init__(self, flask_app, threads=ASGI_THREADS):
+        super().__init__(flask_app)
+        self.slots = asyncio.Semaphore(threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        # WsgiToAsgi runs the app "thread sensitive": one request at a time on a
+        # single shared thread, unless each request has a context of its own
+        async with self.slots, ThreadSensitiveContext():
+            await super().__call__(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = FlaskASGI(create_app())
@@ -0,0 +1,85 @@
+"""Budget admission under parallel writers: overshoot check plus throughput.
+
+    python -m benchmarks.budget_stress --threads 1 4 16 --creates 200 --limit 1000
+
+Every thread creates subscriptions against one tenant whose budget allows only
+part of them. The run fails (exit 1) if the stored spend or the real sum of
+active subscriptions ends up above the limit, or if they disagree.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from app import db
+from app.money import DEFAULT_CURRENCY, monthly_amount
+from app.spend import compute_spend, get_spend
+from benchmarks.generate import fresh_app
+
+
+def run(path, threads, creates, limit, price):
+    app = fresh_app(f'sqlite:///{path}')
+    app.test_client().put('/budget', json={"limit": limit})
+    results = {201: 0, 400: 0, 'other': 0}
+    lock = threading.Lock()
+
+    def worker(n):
+        client = app.test_client()
+        local = {201: 0, 400: 0, 'other': 0}
+        for i in range(creates):
+            res = client.post('/subscriptions', json={
+                "name": f"t{n}-{i}", "price": price, "frequency": "Monthly", "category": "Stress"
+            })
+            local[res.status_code if res.status_code in local else 'other'] += 1
+        with lock:
+            for key, value in local.items():
+                results[key] += value
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        # Yearly minor units, exact integers
+        stored, _ = get_spend().get(DEFAULT_CURRENCY, (0, 0))
+        actual, _ = compute_spend().get(DEFAULT_CURRENCY, (0, 0))
+    # Background jobs must finish before the temporary database goes away
+    app.extensions['jobs'].stop()
+    with app.app_context():
+        db.engine.dispose()
+    return results, stored, actual, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--creates', type=int, default=200, help='create attempts per thread')
+    parser.add_argument('--limit', type=float, default=1000)
+    parser.add_argument('--price', type=float, default=7)
+    args = parser.parse_args()
+
+    failed = False
+    for threads in args.threads:
+        with tempfile.TemporaryDirectory() as tmp:
+            results, stored, actual, elapsed = run(
+                os.path.join(tmp, 'stress.db'), threads, args.creates, args.limit, args.price
+            )
+        attempts = threads * args.creates
+        spend = monthly_amount(actual)
+        overshoot = max(spend - args.limit, 0)
+        ok = overshoot == 0 and stored == actual and results['other'] == 0
+        failed = failed or not ok
+        print(f"threads={threads:<3} attempts={attempts:<6} created={results[201]:<5} rejected={results[400]:<6} "
+              f"errors={results['other']:<3} spend={spend:9.2f}/{args.limit:<9.2f} "
+              f"overshoot={overshoot:7.2f} req/s={attempts / elapsed:8,.0f}  {'OK' if ok else 'FAIL'}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Throughput of POST /subscriptions/bulk against one POST /subscriptions per row.
+
+    python -m benchmarks.bulk_import --rows 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from app import create_app, db
+
+FREQUENCIES = ['Weekly', 'Monthly', 'Yearly']
+
+
+def make_rows(n, prefix):
+    return [
+        {
+            "name": f"{prefix} {i}",
+            "price": round(1 + (i % 50) * 0.5, 2),
+            "frequency": FREQUENCIES[i % 3],
+            "category": f"Category {i % 40}",
+        }
+        for i in range(n)
+    ]
+
+def fresh_app(path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+def per_row(app, rows):
+    client = app.test_client()
+    start = time.perf_counter()
+    for row in rows:
+        assert client.post('/subscriptions', json=row).status_code == 201
+    return time.perf_counter() - start
+
+def bulk(app, rows):
+    client = app.test_client()
+    start = time.perf_counter()
+    assert client.post('/subscriptions/bulk', json=rows).status_code == 201
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        results = {}
+        for label, fn in (('per-row', per_row), ('bulk', bulk)):
+            app = fresh_app(path)
+            elapsed = fn(app, make_rows(args.rows, label))
+            app.extensions['jobs'].stop()
+            results[label] = elapsed
+            print(f"{label:8} {args.rows} rows in {elapsed:.3f}s  ({args.rows / elapsed:,.0f} rows/s)")
+
+    print(f"speedup  {results['per-row'] / results['bulk']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
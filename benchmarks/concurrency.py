@@ -0,0 +1,92 @@
+"""Mixed read/write throughput against one SQLite file with N worker processes.
+
+Each worker is a separate process with its own app and connection pool, like
+gunicorn workers sharing a database.
+
+    python -m benchmarks.concurrency --workers 1 2 4 8 --seconds 5
+    python -m benchmarks.concurrency --journal-mode DELETE   # pre-WAL behaviour
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from app import create_app, db
+
+READ_PATHS = ['/subscriptions?limit=50', '/budget/status', '/analytics?group_by=category']
+
+
+def make_app(path, journal_mode):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'SQLITE_JOURNAL_MODE': journal_mode,
+    })
+
+def prepare(path, journal_mode):
+    app = make_app(path, journal_mode)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    client = app.test_client()
+    client.put('/budget', json={"limit": 10 ** 9})
+    client.post('/subscriptions/bulk', json=[
+        {"name": f"seed {i}", "price": 5, "frequency": "Monthly", "category": f"c{i % 20}"}
+        for i in range(2000)
+    ])
+    # Let the seed's background jobs finish before the workers start
+    app.extensions['jobs'].stop()
+
+def worker(args):
+    path, journal_mode, worker_id, seconds, write_ratio = args
+    app = make_app(path, journal_mode)
+    client = app.test_client()
+    reads = writes = errors = 0
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        i += 1
+        if (i % 100) < write_ratio * 100:
+            res = client.post('/subscriptions', json={
+                "name": f"w{worker_id}-{i}", "price": 1, "frequency": "Monthly", "category": "Bench"
+            })
+            writes += 1
+        else:
+            res = client.get(READ_PATHS[i % len(READ_PATHS)])
+            reads += 1
+        if res.status_code >= 500:
+            errors += 1
+    app.extensions['jobs'].stop()
+    return reads, writes, errors
+
+
+def run(path, journal_mode, workers, seconds, write_ratio):
+    prepare(path, journal_mode)
+    jobs = [(path, journal_mode, w, seconds, write_ratio) for w in range(workers)]
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.map(worker, jobs)
+    reads = sum(r for r, _, _ in results)
+    writes = sum(w for _, w, _ in results)
+    errors = sum(e for _, _, e in results)
+    return reads / seconds, writes / seconds, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--journal-mode', default='WAL')
+    args = parser.parse_args()
+
+    print(f"journal_mode={args.journal_mode} write_ratio={args.write_ratio}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        for n in args.workers:
+            reads, writes, errors = run(path, args.journal_mode, n, args.seconds, args.write_ratio)
+            print(f"workers={n:<3} reads/s={reads:8,.0f}  writes/s={writes:7,.0f}  "
+                  f"total/s={reads + writes:8,.0f}  5xx={errors}")
+
+
+if __name__ == '__main__':
+    main()
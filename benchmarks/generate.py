@@ -0,0 +1,103 @@
+"""Synthetic dataset generator: bulk-loads subscriptions with realistic distributions.
+
+    python -m benchmarks.generate --rows 1000000 --categories 5000 --db /tmp/subs.db
+
+Output is deterministic for a given --seed, so runs at the same size are
+comparable between commits.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from app import create_app, db
+from app.models import Category, Subscription, FrequencyType, StatusType
+from app.renewals import next_charge
+from app.spend import rebuild
+
+CHUNK = 10_000
+
+# Most subscriptions are monthly and active; weekly ones are rare
+FREQUENCY_WEIGHTS = {FrequencyType.MONTHLY: 0.70, FrequencyType.YEARLY: 0.22, FrequencyType.WEEKLY: 0.08}
+STATUS_WEIGHTS = {StatusType.ACTIVE: 0.72, StatusType.PAUSED: 0.10, StatusType.CANCELLED: 0.18}
+
+# Price per billing period relative to a monthly base price
+PERIOD_FACTOR = {FrequencyType.MONTHLY: 1, FrequencyType.YEARLY: 10, FrequencyType.WEEKLY: 0.25}
+
+
+def category_rows(count):
+    return [{"name": f"Category {i:05d}", "name_lower": f"category {i:05d}"} for i in range(count)]
+
+def subscription_rows(rng, start, count, categories, category_weights):
+    frequencies, freq_weights = zip(*FREQUENCY_WEIGHTS.items())
+    statuses, status_weights = zip(*STATUS_WEIGHTS.items())
+
+    freq = rng.choices(frequencies, freq_weights, k=count)
+    status = rng.choices(statuses, status_weights, k=count)
+    # Category popularity is long-tailed: a few categories hold most subscriptions
+    category_ids = rng.choices(range(1, categories + 1), cum_weights=category_weights, k=count)
+
+    today = date.today()
+    rows = []
+    for i in range(count):
+        base = rng.lognormvariate(2.3, 0.7)  # median ~10/month
+        # Started some time in the last three years
+        anchor = today - timedelta(days=rng.randrange(3 * 365))
+        rows.append({
+            "name": f"sub-{start + i:08d}",
+            "price_minor": round(base * PERIOD_FACTOR[freq[i]] * 100),
+            "frequency": freq[i],
+            "status": status[i],
+            "category_id": category_ids[i],
+            "billing_anchor": anchor,
+            "next_charge_at": next_charge(anchor, freq[i], today),
+        })
+    return rows
+
+def generate(rows, categories, seed=42):
+    """Fill the bound (empty) database. Must run inside an app context."""
+    rng = random.Random(seed)
+    db.session.execute(Category.__table__.insert(), category_rows(categories))
+
+    cumulative, total = [], 0.0
+    for rank in range(1, categories + 1):
+        total += 1 / rank
+        cumulative.append(total)
+
+    table = Subscription.__table__
+    for start in range(0, rows, CHUNK):
+        count = min(CHUNK, rows - start)
+        db.session.execute(table.insert(), subscription_rows(rng, start, count, categories, cumulative))
+    db.session.commit()
+
+    # Core inserts skip the flush hook, rebuild the aggregate once at the end
+    rebuild()
+
+def fresh_app(uri, **config):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri, **config})
+    with app.app_context():
+        db.drop_all()
+        from app.migrations import upgrade
+        upgrade()
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--categories', type=int, default=1_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', required=True, help='SQLite file to (re)create')
+    args = parser.parse_args()
+
+    app = fresh_app(f'sqlite:///{args.db}')
+    start = time.perf_counter()
+    with app.app_context():
+        generate(args.rows, args.categories, args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"{args.rows:,} subscriptions / {args.categories:,} categories in {elapsed:.1f}s "
+          f"({args.rows / elapsed:,.0f} rows/s) -> {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Concurrent-connection load test: latency percentiles and requests/s for one or more servers.
+
+Start the servers first, then point the harness at them:
+
+    python run.py                                        # sync, :5000
+    uvicorn asgi:app --port 8000                         # ASGI, :8000
+    python -m benchmarks.load_test --connections 1000 \\
+        http://127.0.0.1:5000 http://127.0.0.1:8000
+
+Each connection is a keep-alive HTTP/1.1 client that loops over the read
+paths until the duration runs out. Uses only the standard library.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+PATHS = ['/subscriptions?limit=50', '/budget/status', '/analytics?group_by=category', '/categories']
+REQUEST_TIMEOUT = 30
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    keep_alive = not head.startswith(b'HTTP/1.0')
+    for line in head.lower().split(b'\r\n'):
+        if line.startswith(b'content-length:'):
+            length = int(line.split(b':', 1)[1])
+        elif line.startswith(b'connection:'):
+            keep_alive = b'close' not in line
+    await reader.readexactly(length)
+    return status, keep_alive
+
+async def request(host, port, conn, path):
+    # Reconnects when the server closed the previous keep-alive connection
+    if conn is None:
+        conn = await asyncio.open_connection(host, port)
+    reader, writer = conn
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode())
+    await writer.drain()
+    status, keep_alive = await read_response(reader)
+    if not keep_alive:
+        writer.close()
+        conn = None
+    return status, conn
+
+async def client(host, port, deadline, latencies, failures):
+    conn = None
+    i = 0
+    while time.perf_counter() < deadline:
+        path = PATHS[i % len(PATHS)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            status, conn = await asyncio.wait_for(request(host, port, conn, path), REQUEST_TIMEOUT)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            failures.append(type(e).__name__)
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status >= 500:
+            failures.append(status)
+    if conn is not None:
+        conn[1].close()
+
+async def run(url, connections, seconds):
+    parts = urlsplit(url)
+    latencies, failures = [], []
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        client(parts.hostname, parts.port or 80, deadline, latencies, failures)
+        for _ in range(connections)
+    ])
+    elapsed = time.perf_counter() - started
+    return latencies, failures, elapsed
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    for url in args.urls:
+        latencies, failures, elapsed = asyncio.run(run(url, args.connections, args.seconds))
+        print(f"{url:28} conns={args.connections:<5} req/s={len(latencies) / elapsed:8,.0f}  "
+              f"p50={percentile(latencies, 50) * 1000:7.1f}ms  p99={percentile(latencies, 99) * 1000:7.1f}ms  "
+              f"errors={len(failures)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Serialization cost of a subscription list: ORM to_json + stdlib jsonify vs row serializer.
+
+    python -m benchmarks.serialization --rows 10000 100000
+"""
+import argparse
+import time
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import create_app, db
+from app.models import Subscription, subscription_columns, Category
+from app.serializers import orjson, subscription_serializer
+from benchmarks.generate import generate
+
+
+def timed(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        size = len(fn())
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if orjson else 'stdlib json'}")
+    for n in args.rows:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+        stdlib = DefaultJSONProvider(app)
+        with app.app_context():
+            db.create_all()
+            generate(n, categories=50)
+
+            def legacy():
+                subs = Subscription.query.all()
+                return stdlib.dumps([s.to_json() for s in subs]).encode()
+
+            def rows():
+                result = db.session.execute(
+                    db.select(*subscription_columns())
+                    .join(Category, Subscription.category_id == Category.id)
+                )
+                return subscription_serializer().dumps_many(result)
+
+            old, old_size = timed(legacy)
+            new, new_size = timed(rows)
+            print(f"{n:>8} rows  to_json+jsonify {old * 1000:8.1f} ms   "
+                  f"row serializer {new * 1000:8.1f} ms   {old / new:4.1f}x   "
+                  f"({old_size / 1e6:.1f} MB / {new_size / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
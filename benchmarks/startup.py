@@ -0,0 +1,88 @@
+"""Cold start: fresh interpreter to first response, split into phases.
+
+    python -m benchmarks.startup --runs 10
+    python -m benchmarks.startup --auto-upgrade   # as with DB_AUTO_UPGRADE=1
+
+Every run is a new Python process, so nothing is cached in sys.modules,
+against a SQLite file that is already at the latest schema. The phases are:
+interpreter start, framework imports (flask, sqlalchemy), importing the app
+package and its modules, create_app, and the first request.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import fresh_app
+
+PHASES = ('interpreter', 'framework', 'app_import', 'create_app', 'first_request')
+
+# Runs in the child process; prints one JSON line of phase timings (seconds)
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import flask, flask_sqlalchemy, sqlalchemy.orm
+t1 = time.perf_counter()
+from app import create_app
+import app.routes.subscription, app.routes.category, app.routes.analytics, app.routes.budget
+t2 = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1], 'DB_AUTO_UPGRADE': sys.argv[2] == '1'})
+t3 = time.perf_counter()
+assert app.test_client().get('/subscriptions?limit=10').status_code == 200
+t4 = time.perf_counter()
+print(json.dumps({'framework': t1 - t0, 'app_import': t2 - t1, 'create_app': t3 - t2, 'first_request': t4 - t3}))
+"""
+
+
+def run_once(uri, auto_upgrade):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE, uri, '1' if auto_upgrade else '0'],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    total = time.perf_counter() - start
+    phases = json.loads(out.strip().splitlines()[-1])
+    # Whatever the child did not measure itself: interpreter start and exit
+    phases['interpreter'] = total - sum(phases.values())
+    phases['total'] = total
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--auto-upgrade', action='store_true', help='run migrations inside create_app')
+    parser.add_argument('--out', help='write results JSON here')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = f'sqlite:///{os.path.join(tmp, "startup.db")}'
+        app = fresh_app(uri)
+        app.test_client().post('/subscriptions', json={
+            "name": "Netflix", "price": 10, "frequency": "Monthly", "category": "Video"})
+
+        run_once(uri, args.auto_upgrade)  # warm the OS file cache and .pyc files
+        runs = [run_once(uri, args.auto_upgrade) for _ in range(args.runs)]
+
+    results = {}
+    for phase in PHASES + ('total',):
+        values = sorted(r[phase] * 1000 for r in runs)
+        results[phase] = {
+            "median_ms": round(statistics.median(values), 1),
+            "p95_ms": round(values[int(0.95 * (len(values) - 1))], 1),
+        }
+        print(f"{phase:<14} median {results[phase]['median_ms']:8.1f} ms   p95 {results[phase]['p95_ms']:8.1f} ms")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({"runs": args.runs, "auto_upgrade": args.auto_upgrade, "phases": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
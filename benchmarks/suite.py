@@ -0,0 +1,149 @@
+"""Endpoint benchmark suite over generated datasets, with JSON results for comparing commits.
+
+    python -m benchmarks.suite --sizes 1000 10000 100000 --out bench-HEAD.json
+    python -m benchmarks.suite --sizes 1000 10000 --compare bench-main.json
+
+Every endpoint is timed through the test client against a freshly generated
+SQLite file with the response cache disabled, so each call does the real work.
+--compare exits with status 1 when any case is slower than --threshold times
+its baseline median.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+from app import db
+from benchmarks.generate import fresh_app, generate
+
+# (name, method, path, json body or None)
+CASES = [
+    ('list_page', 'GET', '/subscriptions?limit=100', None),
+    ('list_page_deep', 'GET', '/subscriptions?limit=100&after={mid}', None),
+    ('list_fields', 'GET', '/subscriptions?limit=1000&fields=name,price', None),
+    ('list_filtered', 'GET', '/subscriptions?status=Active&min_monthly_price=10&max_monthly_price=20&limit=100', None),
+    ('list_sorted_deep', 'GET', '/subscriptions?sort=-monthly_price&limit=100&after={mid}', None),
+    ('count_filtered', 'GET', '/subscriptions?status=Active&frequency=Monthly&count=true', None),
+    ('list_category', 'GET', '/subscriptions?category=Category 00001&limit=100', None),
+    ('get_one', 'GET', '/subscriptions/{mid}', None),
+    ('categories', 'GET', '/categories', None),
+    ('analytics_top', 'GET', '/analytics?top=10', None),
+    ('analytics_by_category', 'GET', '/analytics?group_by=category', None),
+    ('analytics_by_frequency', 'GET', '/analytics?group_by=frequency', None),
+    ('budget_status', 'GET', '/budget/status', None),
+    ('search_prefix', 'GET', '/subscriptions/search?q=sub', None),
+    ('search_fuzzy', 'GET', '/subscriptions/search?q=categroy&mode=fuzzy', None),
+    ('upcoming_30d', 'GET', '/subscriptions/upcoming?days=30', None),
+    ('cashflow_weekly', 'GET', '/analytics/cashflow?days=365&bucket=week', None),
+    ('history_monthly', 'GET', '/analytics/history?granularity=month', None),
+    ('create_with_budget', 'POST', '/subscriptions', 'create'),
+    ('update_price', 'PUT', '/subscriptions/{mid}', {"price": 12.5}),
+]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def time_case(client, method, path, body, repeat):
+    timings = []
+    for i in range(repeat):
+        payload = body
+        if body == 'create':
+            payload = {"name": f"bench-{time.perf_counter_ns()}-{i}", "price": 1,
+                       "frequency": "Monthly", "category": "Bench"}
+        start = time.perf_counter()
+        res = client.open(path, method=method, json=payload)
+        timings.append(time.perf_counter() - start)
+        if res.status_code >= 400:
+            raise RuntimeError(f"{method} {path} -> {res.status_code}: {res.data[:200]!r}")
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "p95_ms": round(timings[int(0.95 * (len(timings) - 1))] * 1000, 3),
+        "runs": repeat,
+    }
+
+def run_size(size, categories, repeat, seed):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = fresh_app(f'sqlite:///{os.path.join(tmp, "bench.db")}', HTTP_CACHE_MAX_ENTRIES=0)
+        start = time.perf_counter()
+        with app.app_context():
+            generate(size, categories, seed)
+        load_s = time.perf_counter() - start
+
+        client = app.test_client()
+        client.put('/budget', json={"limit": 10 ** 12})
+        mid = max(size // 2, 1)
+
+        results = {"load_s": round(load_s, 3), "cases": {}}
+        for name, method, path, body in CASES:
+            results["cases"][name] = time_case(client, method, path.format(mid=mid), body, repeat)
+
+        app.extensions['jobs'].stop()
+        with app.app_context():
+            db.engine.dispose()
+        return results
+
+def compare(current, baseline, threshold):
+    regressions = []
+    for size, result in current["sizes"].items():
+        base = baseline.get("sizes", {}).get(size)
+        if not base:
+            continue
+        for name, case in result["cases"].items():
+            old = base["cases"].get(name)
+            if not old:
+                continue
+            ratio = case["median_ms"] / old["median_ms"] if old["median_ms"] else float('inf')
+            flag = "  REGRESSION" if ratio > threshold else ""
+            print(f"{size:>9} {name:24} {old['median_ms']:9.3f} -> {case['median_ms']:9.3f} ms  x{ratio:5.2f}{flag}")
+            if flag:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--categories', type=int, default=1_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='write results JSON here')
+    parser.add_argument('--compare', help='baseline results JSON')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args()
+
+    current = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "sizes": {},
+    }
+    for size in args.sizes:
+        result = run_size(size, min(args.categories, size), args.repeat, args.seed)
+        current["sizes"][str(size)] = result
+        print(f"== {size:,} rows (loaded in {result['load_s']}s)")
+        for name, case in result["cases"].items():
+            print(f"   {name:24} median {case['median_ms']:9.3f} ms   p95 {case['p95_ms']:9.3f} ms")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,10 @@
 from app import create_app
+from app.migrations import upgrade
 
 app = create_app()
 
 if __name__ == '__main__':
+    # Schema is an explicit step; for the dev server, just do it on start
+    with app.app_context():
+        upgrade()
     app.run(debug=True, port=5000)
\ No newline at end of file
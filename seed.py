@@ -1,4 +1,5 @@
 from app import create_app, db
+from app.migrations import upgrade
 from app.models import Category, Subscription, FrequencyType, StatusType
 
 app = create_app()
@@ -7,7 +8,7 @@ def seed_database():
     with app.app_context():
         print("🗑️  Cleaning database...")
         db.drop_all()  
-        db.create_all() 
+        upgrade() 
 
         # --- 1. Create Categories ---
         print("📦 Creating categories...")
@@ -31,49 +32,49 @@ def seed_database():
         subscriptions = [
             Subscription(
                 name="Netflix",
-                price=15.99,
+                price_minor=1599,
                 frequency=FrequencyType.MONTHLY,
                 category_id=categories["Entertainment"].id,
                 status=StatusType.ACTIVE
             ),
             Subscription(
                 name="Spotify Premium",
-                price=9.99,
+                price_minor=999,
                 frequency=FrequencyType.MONTHLY,
                 category_id=categories["Entertainment"].id,
                 status=StatusType.ACTIVE
             ),
             Subscription(
                 name="Gym Membership",
-                price=45.00,
+                price_minor=4500,
                 frequency=FrequencyType.MONTHLY,
                 category_id=categories["Health"].id,
                 status=StatusType.ACTIVE
             ),
             Subscription(
                 name="Amazon Prime",
-                price=139.00,
+                price_minor=13900,
                 frequency=FrequencyType.YEARLY,
                 category_id=categories["Shopping"].id,
                 status=StatusType.ACTIVE
             ),
             Subscription(
                 name="ChatGPT Plus",
-                price=20.00,
+                price_minor=2000,
                 frequency=FrequencyType.MONTHLY,
                 category_id=categories["Productivity"].id,
                 status=StatusType.ACTIVE
             ),
             Subscription(
                 name="Internet Bill",
-                price=89.99,
+                price_minor=8999,
                 frequency=FrequencyType.MONTHLY,
                 category_id=categories["Utilities"].id,
                 status=StatusType.ACTIVE
             ),
             Subscription(
                 name="Duolingo",
-                price=6.99,
+                price_minor=699,
                 frequency=FrequencyType.MONTHLY,
                 category_id=categories["Education"].id,
                 status=StatusType.CANCELLED
@@ -7,16 +7,32 @@ class SubscriptionTrackerTestCase(unittest.TestCase):
     
     def setUp(self):
         """Set up test variables and initialize app."""
-        # Use a separate test config to avoid messing up your real DB
-        self.app = create_app()
-        self.app.config['TESTING'] = True
-        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:' # In-memory DB
+        # Config goes in before the engine binds, so the real DB is never touched
+        self.app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
         self.client = self.app.test_client()
         
         # Create tables within the application context
         with self.app.app_context():
             db.create_all()
 
+    def _use_file_db(self):
+        """Swap in a temp-file database: threads need their own connections,
+        an in-memory database is a single connection shared by everyone."""
+        import os, tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.app = create_app({'TESTING': True,
+                               'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp.name, "test.db")}'})
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+        self.addCleanup(self._dispose, self.app)
+
+    def _dispose(self, app):
+        app.extensions['jobs'].stop()
+        with app.app_context():
+            db.engine.dispose()
+
     def tearDown(self):
         """Tear down all initialized variables."""
         with self.app.app_context():
@@ -80,7 +96,7 @@ class SubscriptionTrackerTestCase(unittest.TestCase):
             c = Category(name="Gym")
             db.session.add(c)
             db.session.commit()
-            s = Subscription(name="Planet Fitness", price=10, frequency=FrequencyType.MONTHLY, category_id=c.id)
+            s = Subscription(name="Planet Fitness", price_minor=1000, frequency=FrequencyType.MONTHLY, category_id=c.id)
             db.session.add(s)
             db.session.commit()
 
@@ -98,8 +114,8 @@ class SubscriptionTrackerTestCase(unittest.TestCase):
             db.session.add_all([c1, c2])
             db.session.commit()
             
-            s1 = Subscription(name="Xbox", price=15, frequency=FrequencyType.MONTHLY, category_id=c1.id)
-            s2 = Subscription(name="Taco Bell", price=20, frequency=FrequencyType.WEEKLY, category_id=c2.id)
+            s1 = Subscription(name="Xbox", price_minor=1500, frequency=FrequencyType.MONTHLY, category_id=c1.id)
+            s2 = Subscription(name="Taco Bell", price_minor=2000, frequency=FrequencyType.WEEKLY, category_id=c2.id)
             db.session.add_all([s1, s2])
             db.session.commit()
 
@@ -121,7 +137,7 @@ class SubscriptionTrackerTestCase(unittest.TestCase):
             c = Category(name="Music")
             db.session.add(c)
             db.session.commit()
-            s = Subscription(name="Spotify", price=10, frequency=FrequencyType.MONTHLY, category_id=c.id)
+            s = Subscription(name="Spotify", price_minor=1000, frequency=FrequencyType.MONTHLY, category_id=c.id)
             db.session.add(s)
             db.session.commit()
 
@@ -140,7 +156,7 @@ class SubscriptionTrackerTestCase(unittest.TestCase):
             c = Category(name="News")
             db.session.add(c)
             db.session.commit()
-            s = Subscription(name="NYT", price=5, frequency=FrequencyType.WEEKLY, category_id=c.id)
+            s = Subscription(name="NYT", price_minor=500, frequency=FrequencyType.WEEKLY, category_id=c.id)
             db.session.add(s)
             db.session.commit()
 
@@ -202,5 +218,1191 @@ class SubscriptionTrackerTestCase(unittest.TestCase):
         res = self.client.delete('/subscriptions/999')
         self.assertEqual(res.status_code, 404)
 
+    # =================================================================
+    # 4. SPEND AGGREGATE
+    # =================================================================
+
+    def _post_sub(self, name, price, frequency="Monthly", status="Active"):
+        payload = {"name": name, "price": price, "frequency": frequency,
+                   "category": "Test", "status": status}
+        return self.client.post('/subscriptions', json=payload)
+
+    def test_spend_aggregate_tracks_mutations(self):
+        """Test the stored monthly total follows create, update and delete"""
+        self._post_sub("Netflix", 10)
+        self._post_sub("Gym", 120, frequency="Yearly")
+        self._post_sub("Coffee", 5, frequency="Weekly")
+        self._post_sub("Old", 50, status="Cancelled")
+
+        data = json.loads(self.client.get('/analytics').data)
+        self.assertEqual(data['total_price_per_month'], 40)
+        self.assertEqual(data['active_subscriptions'], 3)
+
+        # price + frequency change, then pause, then reactivate the cancelled one
+        self.client.put('/subscriptions/1', json={"price": 20, "frequency": "Weekly"})
+        self.client.put('/subscriptions/2', json={"status": "Paused"})
+        self.client.put('/subscriptions/4', json={"status": "Active"})
+        self.client.delete('/subscriptions/3')
+
+        data = json.loads(self.client.get('/analytics').data)
+        self.assertEqual(data['total_price_per_month'], 130)
+        self.assertEqual(data['active_subscriptions'], 2)
+
+        with self.app.app_context():
+            from app.spend import reconcile
+            self.assertTrue(reconcile(fix=False)['in_sync'])
+
+    def test_budget_check_uses_aggregate(self):
+        """Test the budget check and status read the stored total"""
+        self.client.put('/budget', json={"limit": 30})
+        self.assertEqual(self._post_sub("A", 20).status_code, 201)
+        res = self._post_sub("B", 15)
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("Budget limit exceeded", str(res.data))
+
+        data = json.loads(self.client.get('/budget/status').data)
+        self.assertEqual(data['current_spending'], 20)
+        self.assertEqual(data['remaining_budget'], 10)
+
+    def test_update_admitted_against_budget(self):
+        """Test PUT can't raise or reactivate spend past the budget, and can always lower it"""
+        self.client.put('/budget', json={"limit": 30})
+        self._post_sub("A", 20)
+        self._post_sub("B", 15, status="Paused")
+
+        res = self.client.put('/subscriptions/2', json={"status": "Active"})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("Budget limit exceeded", str(res.data))
+        self.assertEqual(self.client.put('/subscriptions/1', json={"price": 31}).status_code, 400)
+        self.assertEqual(self.client.put('/subscriptions/1', json={"price": 30, "category": "New"}).status_code, 200)
+        sub = json.loads(self.client.get('/subscriptions/2').data)
+        self.assertEqual(sub['status'], "Paused")
+
+        # Over budget after a lower limit: decreases and renames still pass
+        self.client.put('/budget', json={"limit": 10})
+        self.assertEqual(self.client.put('/subscriptions/1', json={"name": "A2"}).status_code, 200)
+        self.assertEqual(self.client.put('/subscriptions/1', json={"price": 25}).status_code, 200)
+        self.assertEqual(json.loads(self.client.get('/budget/status').data)['current_spending'], 25)
+        self.assertTrue(self._spend_in_sync())
+
+    def test_spend_reads_do_not_write(self):
+        """Test a tenant without a stored aggregate is scanned on read, not materialised"""
+        self._seed_many(3)
+        self.client.put('/budget', json={"limit": 100})
+        with self.app.app_context():
+            from app.models import SpendSummary
+            db.session.execute(db.delete(SpendSummary))
+            db.session.commit()
+        self.assertEqual(json.loads(self.client.get('/budget/status').data)['current_spending'], 3)
+        self.assertEqual(json.loads(self.client.get('/analytics').data)['active_subscriptions'], 3)
+        with self.app.app_context():
+            self.assertEqual(SpendSummary.query.count(), 0)
+        # The first write creates it from a scan
+        self._post_sub("Netflix", 10)
+        with self.app.app_context():
+            from app.spend import reconcile
+            self.assertTrue(reconcile(fix=False)['in_sync'])
+
+    def test_spend_writers_lock_budget_first(self):
+        """Test every path that moves spend locks the budget row before spend_summary"""
+        self.client.put('/budget', json={"limit": 1000})
+        writes = {
+            "create": lambda: self._post_sub("Netflix", 10),
+            "update": lambda: self.client.put('/subscriptions/1', json={"price": 20}),
+            "bulk create": lambda: self.client.post('/subscriptions/bulk', json=[
+                {"name": "Gym", "price": 30, "frequency": "Monthly", "category": "Test"}]),
+            "bulk status": lambda: self.client.patch('/subscriptions', json={"status": "Paused", "ids": [2]}),
+            "delete": lambda: self.client.delete('/subscriptions/1'),
+        }
+        for name, write in writes.items():
+            statements = self._statements(write)
+            first = lambda prefixes: next(i for i, s in enumerate(statements) if s.startswith(prefixes))
+            self.assertLess(first("UPDATE budget"), first(("UPDATE spend_summary", "INSERT INTO spend_summary")), name)
+
+    def test_reconcile_detects_drift(self):
+        """Test reconcile reports and repairs a drifted aggregate"""
+        self._post_sub("Netflix", 10)
+        with self.app.app_context():
+            from app.models import SpendSummary
+            from app.spend import reconcile
+            db.session.execute(db.update(SpendSummary).values(yearly_total=9900))
+            db.session.commit()
+
+            report = reconcile()
+            self.assertFalse(report['in_sync'])
+            self.assertEqual(report['drift'], {'USD': 9900 - 12000})
+            self.assertTrue(reconcile(fix=False)['in_sync'])
+
+    # =================================================================
+    # 5. LIST PAGINATION, STREAMING & FIELDS
+    # =================================================================
+
+    def _seed_many(self, n):
+        with self.app.app_context():
+            c = Category(name="Bulk")
+            db.session.add(c)
+            db.session.commit()
+            db.session.add_all([
+                Subscription(name=f"Sub {i}", price_minor=i * 100, frequency=FrequencyType.MONTHLY, category_id=c.id)
+                for i in range(n)
+            ])
+            db.session.commit()
+
+    def test_keyset_pagination(self):
+        """Test ?limit=&after= walks the table in id order"""
+        self._seed_many(5)
+        res = self.client.get('/subscriptions?limit=2')
+        self.assertEqual([s['id'] for s in json.loads(res.data)], [1, 2])
+        self.assertEqual(res.headers['X-Next-After'], '2')
+
+        res = self.client.get('/subscriptions?limit=2&after=4')
+        self.assertEqual([s['id'] for s in json.loads(res.data)], [5])
+        self.assertNotIn('X-Next-After', res.headers)
+
+        res = self.client.get('/subscriptions?limit=0')
+        self.assertEqual(res.status_code, 400)
+
+    def test_ndjson_stream_with_fields(self):
+        """Test NDJSON streaming and sparse field selection"""
+        self._seed_many(3)
+        res = self.client.get('/subscriptions?format=ndjson&fields=name,category')
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        lines = [json.loads(l) for l in res.data.decode().splitlines()]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0], {"id": 1, "name": "Sub 0", "category": "Bulk"})
+
+        res = self.client.get('/subscriptions?fields=nope')
+        self.assertEqual(res.status_code, 400)
+
+    # =================================================================
+    # 6. QUERY COUNTS
+    # =================================================================
+
+    def _statements(self, fn):
+        from sqlalchemy import event
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+            listener = lambda *args: statements.append(args[2])
+            event.listen(engine, 'before_cursor_execute', listener)
+            try:
+                fn()
+            finally:
+                event.remove(engine, 'before_cursor_execute', listener)
+        return statements
+
+    def _count_statements(self, fn):
+        return len(self._statements(fn))
+
+    def test_statement_count_constant_in_row_count(self):
+        """Test list, filter and to_json paths don't issue one SELECT per row"""
+        def list_paths():
+            self.client.get('/subscriptions')
+            self.client.get('/subscriptions?category=Bulk')
+            self.client.get('/analytics')
+
+        def orm_to_json():
+            with self.app.app_context():
+                [s.to_json() for s in Subscription.query.all()]
+
+        self._seed_many(1)
+        self._seed_many_more(3)
+        small = self._count_statements(list_paths), self._count_statements(orm_to_json)
+
+        self._seed_many_more(40, start=3)
+        large = self._count_statements(list_paths), self._count_statements(orm_to_json)
+        self.assertEqual(small, large)
+
+    def _seed_many_more(self, n, start=0):
+        # A category per row, so lazy loads can't be served from the identity map
+        with self.app.app_context():
+            for i in range(start, start + n):
+                c = Category(name=f"Cat {i}")
+                db.session.add(c)
+                db.session.flush()
+                db.session.add(Subscription(name=f"More {i}", price_minor=i * 100, frequency=FrequencyType.WEEKLY, category_id=c.id))
+            db.session.commit()
+
+    # =================================================================
+    # 7. CATEGORY CACHE
+    # =================================================================
+
+    def test_category_cache_hits_and_invalidation(self):
+        """Test cached category lookups and invalidation on POST /categories"""
+        from app.categories import category_cache, get_or_create_category
+        self._post_sub("Netflix", 10)
+        self.assertIsNotNone(category_cache.get(("default", "test")))
+
+        with self.app.app_context():
+            cached = category_cache.get(("default", "test"))
+            self.assertEqual(get_or_create_category("TEST").id, cached.id)
+            self.assertEqual(Category.query.count(), 1)
+
+        self.client.post('/categories', json={"name": "Gaming"})
+        self.assertIsNone(category_cache.get(("default", "gaming")))
+        res = self.client.post('/categories', json={"name": "gaming"})
+        self.assertEqual(res.status_code, 400)
+
+    def test_category_get_or_create_race(self):
+        """Test concurrent get-or-create of one name yields a single row"""
+        import threading
+        self._use_file_db()
+        from app.categories import get_or_create_category
+        ids = []
+        errors = []
+
+        def worker():
+            try:
+                with self.app.app_context():
+                    ids.append(get_or_create_category("Racing").id)
+                    db.session.commit()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(ids)), 1)
+        with self.app.app_context():
+            self.assertEqual(Category.query.filter_by(name_lower="racing").count(), 1)
+
+    # =================================================================
+    # 8. BULK IMPORT
+    # =================================================================
+
+    def test_bulk_import_json_with_errors(self):
+        """Test bulk import inserts valid rows and reports bad ones"""
+        self._post_sub("Existing", 1)
+        rows = [
+            {"name": "A", "price": 10, "frequency": "Monthly", "category": "Video"},
+            {"name": "B", "price": 52, "frequency": "Weekly", "category": "video"},
+            {"name": "C", "price": -1, "frequency": "Monthly", "category": "Video"},
+            {"name": "D", "price": 1, "frequency": "Daily", "category": "Video"},
+            {"name": "Existing", "price": 1, "frequency": "Monthly", "category": "Video"},
+            {"name": "E", "price": 120, "frequency": "Yearly", "category": "Music", "status": "Paused"},
+            {"name": "F", "price": 1, "frequency": ["Monthly"], "category": "Video"},
+        ]
+        res = self.client.post('/subscriptions/bulk', json=rows)
+        self.assertEqual(res.status_code, 201)
+        data = json.loads(res.data)
+        self.assertEqual(data['created'], 3)
+        self.assertEqual([e['row'] for e in data['errors']], [2, 3, 4, 6])
+        self.assertIn("Invalid frequency", data['errors'][3]['error'])
+
+        with self.app.app_context():
+            self.assertEqual(Category.query.filter_by(name_lower="video").count(), 1)
+        totals = json.loads(self.client.get('/analytics').data)
+        self.assertEqual(totals['total_price_per_month'], 1 + 10 + 208)
+        self.assertEqual(totals['active_subscriptions'], 3)
+
+        res = self.client.post('/subscriptions/bulk?atomic=1', json=rows[2:4])
+        self.assertEqual(res.status_code, 400)
+
+    def test_bulk_import_name_taken_concurrently(self):
+        """Test a name created between the existence check and the insert gives 409, not a 500"""
+        from unittest import mock
+        from app import bulk
+        self._post_sub("Netflix", 10)
+        rows = [{"name": n, "price": 1, "frequency": "Monthly", "category": "Test"} for n in ("Hulu", "Netflix")]
+        # The check misses the row, as it would if the other create committed right after it
+        with mock.patch.object(bulk, 'existing_names', side_effect=[set(), {"Netflix"}]):
+            res = self.client.post('/subscriptions/bulk', json=rows)
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(json.loads(res.data)['errors'], [{"row": 1, "error": "Subscription 'Netflix' already exists"}])
+        self.assertEqual(self._names("category=Test"), ["Netflix"])
+        self.assertTrue(self._spend_in_sync())
+
+    def test_bulk_import_csv_and_budget(self):
+        """Test CSV import and the single budget check for the batch"""
+        csv_body = "name,price,frequency,category\nX,10,Monthly,Tools\nY,15,Monthly,Tools\n"
+        self.client.put('/budget', json={"limit": 20})
+        res = self.client.post('/subscriptions/bulk', data=csv_body, content_type='text/csv')
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("Budget limit exceeded", str(res.data))
+
+        self.client.put('/budget', json={"limit": 30})
+        res = self.client.post('/subscriptions/bulk', data=csv_body, content_type='text/csv')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(json.loads(res.data)['created'], 2)
+
+    # =================================================================
+    # 9. ANALYTICS BREAKDOWNS
+    # =================================================================
+
+    def test_analytics_group_by_and_top(self):
+        """Test group_by breakdowns and top-K computed in SQL"""
+        rows = [
+            {"name": "A", "price": 10, "frequency": "Monthly", "category": "Video"},
+            {"name": "B", "price": 5, "frequency": "Weekly", "category": "Video"},
+            {"name": "C", "price": 120, "frequency": "Yearly", "category": "Music"},
+            {"name": "D", "price": 99, "frequency": "Monthly", "category": "Music", "status": "Paused"},
+        ]
+        self.client.post('/subscriptions/bulk', json=rows)
+
+        data = json.loads(self.client.get('/analytics?group_by=category').data)
+        self.assertEqual(data['breakdown'], [
+            {"category": "Video", "monthly_total": 30, "count": 2},
+            {"category": "Music", "monthly_total": 10, "count": 1},
+        ])
+
+        data = json.loads(self.client.get('/analytics?group_by=status').data)
+        by_status = {b['status']: b['monthly_total'] for b in data['breakdown']}
+        self.assertEqual(by_status, {"Paused": 99, "Active": 40})
+
+        data = json.loads(self.client.get('/analytics?top=2').data)
+        self.assertEqual([b['name'] for b in data['breakdown']], ["B", "A"])
+
+        self.assertEqual(self.client.get('/analytics?group_by=colour').status_code, 400)
+        self.assertEqual(self.client.get('/analytics?top=0').status_code, 400)
+
+    # =================================================================
+    # 10. ETAGS & RESPONSE CACHE
+    # =================================================================
+
+    def _revalidate(self, path, etag):
+        return self.client.get(path, headers={"If-None-Match": etag})
+
+    def test_etag_conditional_get(self):
+        """Test If-None-Match returns 304 until a write bumps the version"""
+        self._post_sub("Netflix", 10)
+        res = self.client.get('/subscriptions')
+        etag = res.headers['ETag']
+        self.assertEqual(self._revalidate('/subscriptions', etag).status_code, 304)
+
+        self._post_sub("Hulu", 8)
+        res = self._revalidate('/subscriptions', etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(json.loads(res.data)), 2)
+
+        etag = res.headers['ETag']
+        self.client.post('/subscriptions/bulk', json=[
+            {"name": "Max", "price": 1, "frequency": "Monthly", "category": "Test"}])
+        self.assertEqual(self._revalidate('/subscriptions', etag).status_code, 200)
+
+    def test_etag_shared_across_processes(self):
+        """Test a write through one app instance invalidates another's cache and ETags, per representation"""
+        self._use_file_db()
+        other = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': self.app.config['SQLALCHEMY_DATABASE_URI']})
+        self.addCleanup(self._dispose, other)
+        reader = other.test_client()
+        # A tenant that never wrote has no version yet, nothing is cached for it
+        self.assertNotIn('ETag', reader.get('/subscriptions').headers)
+
+        self._post_sub("Netflix", 10)
+        res = reader.get('/subscriptions')
+        self.assertEqual(len(json.loads(res.data)), 1)
+        self.assertEqual(res.headers['Vary'], 'Accept')
+        etag = res.headers['ETag']
+        ndjson = reader.get('/subscriptions', headers={"Accept": "application/x-ndjson", "If-None-Match": etag})
+        self.assertEqual(ndjson.status_code, 200)
+
+        self._post_sub("Hulu", 8)
+        self.assertEqual(len(json.loads(reader.get('/subscriptions').data)), 2)
+        self.assertEqual(reader.get('/subscriptions', headers={"If-None-Match": etag}).status_code, 200)
+
+    def test_etag_versions_are_per_tenant(self):
+        """Test a write moves only its tenant's version, and outbox/queue rows move none"""
+        from datetime import datetime
+        from app.models import BudgetEvent
+        self._post_sub("Netflix", 10)
+        self.client.post('/subscriptions', json={"name": "Netflix", "price": 10, "frequency": "Monthly",
+                                                  "category": "Test"}, headers={'X-Tenant-ID': 'acme'})
+        etag = self.client.get('/analytics').headers['ETag']
+        acme = self.client.get('/analytics', headers={'X-Tenant-ID': 'acme'}).headers['ETag']
+
+        self.client.put('/subscriptions/2', json={"price": 20}, headers={'X-Tenant-ID': 'acme'})
+        self.assertEqual(self._revalidate('/analytics', etag).status_code, 304)
+        with self.app.app_context():
+            db.session.add(BudgetEvent(tenant_id='default', threshold=50, direction='up', yearly_spent=1,
+                                       limit_minor=1, currency='USD', created_at=datetime(2026, 1, 1)))
+            db.session.commit()
+        self.assertEqual(self._revalidate('/analytics', etag).status_code, 304)
+
+        # Rates belong to no tenant: every tenant's analytics may change
+        self._load_rates({"EUR": "0.5"})
+        self.assertEqual(self._revalidate('/analytics', etag).status_code, 200)
+        self.assertEqual(self.client.get('/analytics', headers={'X-Tenant-ID': 'acme', 'If-None-Match': acme})
+                         .status_code, 200)
+
+    def test_response_cache_invalidated_by_writes(self):
+        """Test cached budget/analytics responses follow updates, deletes and budget changes"""
+        self._post_sub("Netflix", 10)
+        self.client.put('/budget', json={"limit": 100})
+        self.assertEqual(json.loads(self.client.get('/budget/status').data)['current_spending'], 10)
+
+        self.client.put('/subscriptions/1', json={"price": 20})
+        self.assertEqual(json.loads(self.client.get('/budget/status').data)['current_spending'], 20)
+
+        self.client.put('/budget', json={"limit": 200})
+        self.assertEqual(json.loads(self.client.get('/budget').data)['monthly_limit'], 200)
+
+        self.client.delete('/subscriptions/1')
+        self.assertEqual(json.loads(self.client.get('/analytics').data)['active_subscriptions'], 0)
+        self.client.post('/categories', json={"name": "Gaming"})
+        names = [c['name'] for c in json.loads(self.client.get('/categories').data)]
+        self.assertIn("Gaming", names)
+
+    # =================================================================
+    # 11. SERIALIZATION
+    # =================================================================
+
+    def test_row_serializer_matches_to_json(self):
+        """Test the list endpoint's row serializer emits the same objects as to_json"""
+        self._post_sub("Netflix", 10.5, frequency="Weekly", status="Paused")
+        listed = json.loads(self.client.get('/subscriptions').data)
+        with self.app.app_context():
+            self.assertEqual(listed, [s.to_json() for s in Subscription.query.all()])
+            from flask import jsonify
+            self.assertEqual(jsonify(FrequencyType.YEARLY).get_json(), "Yearly")
+
+    # =================================================================
+    # 12. INDEXES & MIGRATIONS
+    # =================================================================
+
+    def _query_plan(self, stmt):
+        from sqlalchemy import text
+        sql = str(stmt.compile(db.engine, compile_kwargs={"literal_binds": True}))
+        return " | ".join(r[3] for r in db.session.execute(text("EXPLAIN QUERY PLAN " + sql)))
+
+    def test_hot_queries_use_indexes(self):
+        """Test EXPLAIN QUERY PLAN for the spend aggregate and category filter"""
+        from sqlalchemy import func
+        from app.models import yearly_minor_expr, SUBSCRIPTION_FIELDS
+        from app.routes.subscription import category_filter, list_query
+        with self.app.app_context():
+            spend = db.select(func.sum(yearly_minor_expr()), func.count()).where(
+                Subscription.tenant_id == "default", Subscription.status == StatusType.ACTIVE)
+            self.assertIn("COVERING INDEX ix_subscription_tenant_status_frequency_price",
+                          self._query_plan(spend))
+
+            plan = self._query_plan(list_query(SUBSCRIPTION_FIELDS, [category_filter(["music"])]))
+            self.assertIn("INDEX ix_subscription_tenant_category_id", plan)
+            self.assertNotIn("SCAN category", plan)
+
+            plan = self._query_plan(list_query(
+                SUBSCRIPTION_FIELDS, [Subscription.yearly_minor >= 6000], after=1, sort=('monthly_price', True)))
+            self.assertIn("INDEX ix_subscription_tenant_yearly_minor", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_upgrade_legacy_database(self):
+        """Test migrations bring a pre-index database to the latest schema"""
+        import os, sqlite3, tempfile
+        from sqlalchemy import inspect
+        from app.migrations import LATEST, current_version, upgrade
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "legacy.db")
+            conn = sqlite3.connect(path)
+            conn.executescript("""
+                CREATE TABLE category (id INTEGER PRIMARY KEY, name VARCHAR(50) NOT NULL UNIQUE);
+                CREATE TABLE subscription (
+                    id INTEGER PRIMARY KEY, name VARCHAR(80) NOT NULL UNIQUE, price FLOAT NOT NULL,
+                    frequency VARCHAR(7) NOT NULL, status VARCHAR(9) NOT NULL,
+                    category_id INTEGER NOT NULL REFERENCES category (id));
+                CREATE TABLE budget (id INTEGER PRIMARY KEY, monthly_limit FLOAT NOT NULL);
+                INSERT INTO category VALUES (1, 'Music');
+                INSERT INTO subscription VALUES (1, 'Spotify', 10.99, 'MONTHLY', 'ACTIVE', 1);
+                INSERT INTO budget VALUES (1, 25.5);
+            """)
+            conn.close()
+
+            app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+            with app.app_context():
+                self.assertEqual([n for n, _ in upgrade()], list(range(1, LATEST + 1)))
+                self.assertEqual(upgrade(), [])
+                with db.engine.connect() as c:
+                    self.assertEqual(current_version(c), LATEST)
+                    names = {i['name'] for i in inspect(c).get_indexes('subscription')}
+                    columns = {col['name'] for col in inspect(c).get_columns('subscription')}
+                self.assertIn('ix_subscription_tenant_status_frequency_price', names)
+                self.assertNotIn('monthly_price', columns)
+                self.assertEqual(Category.query.first().name_lower, "music")
+                self.assertEqual(Subscription.query.first().tenant_id, "default")
+                # Float money became integer minor units
+                self.assertEqual((Subscription.query.first().price_minor, Subscription.query.first().yearly_minor),
+                                 (1099, 13188))
+                from app.models import Budget
+                self.assertEqual(Budget.query.first().limit_minor, 2550)
+                from app.models import SubscriptionEvent
+                self.assertEqual(SubscriptionEvent.query.one().yearly_delta, 13188)
+
+            res = app.test_client().get('/subscriptions?category=MUSIC')
+            self.assertEqual(json.loads(res.data)[0]['name'], "Spotify")
+            with app.app_context():
+                db.engine.dispose()
+
+    # =================================================================
+    # 13. METRICS & PROFILING
+    # =================================================================
+
+    def test_metrics_endpoint(self):
+        """Test per-endpoint histograms are exposed in Prometheus format"""
+        self._post_sub("Netflix", 10)
+        self.client.get('/subscriptions')
+        self.client.get('/subscriptions?fields=name')
+        with self.client.get('/subscriptions?format=ndjson') as streamed:
+            streamed.get_data()
+
+        res = self.client.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        body = res.data.decode()
+        labels = 'endpoint="subscriptions.get_subscriptions",method="GET"'
+        self.assertIn(f'http_requests_total{{{labels},status="200"}} 3', body)
+        self.assertIn(f'http_request_rows_returned_sum{{{labels}}} 3', body)
+        self.assertIn(f'http_request_sql_statements_count{{{labels}}} 3', body)
+        self.assertIn('# TYPE http_request_sql_duration_seconds histogram', body)
+
+    def test_profile_is_opt_in(self):
+        """Test ?profile=1 only returns a cProfile report when enabled"""
+        res = self.client.get('/categories?profile=1')
+        self.assertEqual(res.mimetype, 'application/json')
+
+        self.app.config['PROFILING_ENABLED'] = True
+        res = self.client.get('/categories', headers={"X-Profile": "1"})
+        self.assertEqual(res.mimetype, 'text/plain')
+        self.assertIn("function calls", res.data.decode())
+
+    # =================================================================
+    # 14. MULTI-TENANCY
+    # =================================================================
+
+    def test_tenants_are_isolated(self):
+        """Test X-Tenant-ID scopes data, uniqueness, budgets and aggregates"""
+        acme = {"X-Tenant-ID": "acme"}
+        self._post_sub("Netflix", 10)
+        res = self.client.post('/subscriptions', headers=acme, json={
+            "name": "Netflix", "price": 25, "frequency": "Monthly", "category": "test"})
+        self.assertEqual(res.status_code, 201)
+        acme_id = json.loads(res.data)['subscription']['id']
+
+        self.assertEqual(len(json.loads(self.client.get('/subscriptions').data)), 1)
+        listed = json.loads(self.client.get('/subscriptions', headers=acme).data)
+        self.assertEqual([s['price'] for s in listed], [25])
+        self.assertEqual(json.loads(self.client.get('/analytics', headers=acme).data)['total_price_per_month'], 25)
+        self.assertEqual(json.loads(self.client.get('/analytics').data)['total_price_per_month'], 10)
+
+        self.assertEqual(self.client.get(f'/subscriptions/{acme_id}').status_code, 404)
+        self.assertEqual(self.client.delete(f'/subscriptions/{acme_id}').status_code, 404)
+
+        self.client.put('/budget', headers=acme, json={"limit": 30})
+        self.assertEqual(self.client.get('/budget').status_code, 404)
+        res = self.client.post('/subscriptions', headers=acme, json={
+            "name": "Hulu", "price": 10, "frequency": "Monthly", "category": "test"})
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client.get('/subscriptions', headers={"X-Tenant-ID": "bad tenant!"})
+        self.assertEqual(res.status_code, 400)
+
+    # =================================================================
+    # 15. RENEWALS & CASH FLOW
+    # =================================================================
+
+    def test_next_charge_keeps_anchor_day(self):
+        """Test month-end anchors clamp per month without drifting"""
+        from datetime import date
+        from app.renewals import next_charge, charges_between
+        monthly = FrequencyType.MONTHLY
+        self.assertEqual(next_charge(date(2025, 1, 31), monthly, date(2025, 2, 10)), date(2025, 2, 28))
+        self.assertEqual(next_charge(date(2025, 1, 31), monthly, date(2025, 3, 1)), date(2025, 3, 31))
+        self.assertEqual(next_charge(date(2024, 2, 29), FrequencyType.YEARLY, date(2024, 3, 1)), date(2025, 2, 28))
+        self.assertEqual(next_charge(date(2025, 1, 1), FrequencyType.WEEKLY, date(2025, 1, 9)), date(2025, 1, 15))
+        self.assertEqual(list(charges_between(date(2025, 2, 28), monthly, 31, date(2025, 4, 30))),
+                         [date(2025, 2, 28), date(2025, 3, 31), date(2025, 4, 30)])
+
+    def test_upcoming_charges_and_cashflow(self):
+        """Test /subscriptions/upcoming expands in-window charges and cashflow sums them"""
+        from datetime import date, timedelta
+        today = date.today()
+        self.client.post('/subscriptions', json={"name": "Gym", "price": 5, "frequency": "Weekly",
+                                                  "category": "Health", "billing_anchor": today.isoformat()})
+        self.client.post('/subscriptions', json={"name": "Domain", "price": 12, "frequency": "Yearly",
+                                                  "category": "Web",
+                                                  "billing_anchor": (today + timedelta(days=200)).isoformat()})
+
+        data = json.loads(self.client.get('/subscriptions/upcoming?days=14').data)
+        self.assertEqual([c['name'] for c in data['charges']], ["Gym"] * 3)
+        self.assertEqual(data['total'], 15)
+
+        res = self.client.get('/analytics/cashflow?days=365&bucket=week')
+        flow = json.loads(res.data)
+        self.assertEqual(len(flow['points']), 53)
+        self.assertEqual(flow['total'], 53 * 5 + 12)
+        self.assertEqual(self.client.get('/analytics/cashflow?bucket=month').status_code, 400)
+        self.assertEqual(self.client.get('/subscriptions/upcoming?days=0').status_code, 400)
+
+    def test_roll_forward_moves_passed_dates(self):
+        """Test overdue next_charge_at values roll to the next charge, upcoming uses the index"""
+        from datetime import date, timedelta
+        from app.renewals import roll_forward, next_charge, _due_query
+        self._post_sub("Netflix", 10)
+        anchor = date.today() - timedelta(days=40)
+        with self.app.app_context():
+            # A charge date left behind while no request or cron ran
+            db.session.execute(db.text("UPDATE subscription SET billing_anchor = :d, next_charge_at = :d"),
+                               {"d": anchor})
+            db.session.commit()
+            self.assertEqual(roll_forward("default"), 1)
+            self.assertEqual(Subscription.query.first().next_charge_at,
+                             next_charge(anchor, FrequencyType.MONTHLY))
+            self.assertEqual(roll_forward("default"), 0)
+
+            plan = self._query_plan(_due_query("default", date.today(), Subscription.id))
+            self.assertIn("INDEX ix_subscription_tenant_status_next_charge", plan)
+
+    # =================================================================
+    # 16. SPEND HISTORY
+    # =================================================================
+
+    def test_history_events_and_rollups(self):
+        """Test create/update/delete append events and the rollups track spend"""
+        from datetime import date
+        from app.models import SubscriptionEvent, SpendRollup
+        res = self._post_sub("Netflix", 10)
+        sub_id = json.loads(res.data)['subscription']['id']
+        self._post_sub("Yearly Box", 120, frequency="Yearly")
+        self.client.put(f'/subscriptions/{sub_id}', json={"price": 15})
+        self.client.put(f'/subscriptions/{sub_id}', json={"category": "Video"})
+        self.client.put(f'/subscriptions/{sub_id}', json={"name": "Renamed"})
+        self.client.delete(f'/subscriptions/{sub_id}')
+
+        with self.app.app_context():
+            kinds = [e.kind for e in SubscriptionEvent.query.order_by(SubscriptionEvent.id)]
+            self.assertEqual(kinds, ['created', 'created', 'updated', 'moved_out', 'moved_in', 'deleted'])
+            self.assertEqual(SpendRollup.query.filter_by(granularity='month').count(), 2)
+
+        today = date.today().isoformat()
+        data = json.loads(self.client.get(f'/analytics/history?from={today}&by_category=1').data)
+        self.assertEqual(len(data['points']), 1)
+        point = data['points'][0]
+        self.assertEqual(point['monthly_total'], 10)
+        self.assertEqual(point['events'], 6)
+        self.assertEqual(point['by_category'], {"Test": 10})
+
+    def test_history_reads_rollups_not_the_log(self):
+        """Test opening balances carry forward and rebuild matches incremental rollups"""
+        from datetime import date, timedelta
+        from app.history import rebuild_rollups, spend_history
+        from app.models import SpendRollup
+        self._post_sub("Netflix", 10)
+        with self.app.app_context():
+            # Pretend the first events happened 40 days ago
+            db.session.execute(db.text("UPDATE spend_rollup SET period = :d WHERE granularity = 'day'"),
+                               {"d": date.today() - timedelta(days=40)})
+            db.session.commit()
+            points = spend_history(date.today() - timedelta(days=2), date.today())
+            self.assertEqual([p['monthly_total'] for p in points], [10, 10, 10])
+            self.assertEqual([p['events'] for p in points], [0, 0, 0])
+
+            incremental = {(r.granularity, r.yearly_closing) for r in SpendRollup.query}
+            with db.engine.begin() as conn:
+                rebuild_rollups(conn)
+            self.assertEqual({(r.granularity, r.yearly_closing) for r in SpendRollup.query}, incremental)
+
+        self.assertEqual(self.client.get('/analytics/history?granularity=year').status_code, 400)
+        self.assertEqual(self.client.get('/analytics/history?from=2000-01-01').status_code, 400)
+
+    # =================================================================
+    # 17. BUDGET ADMISSION UNDER CONCURRENCY
+    # =================================================================
+
+    def test_concurrent_creates_never_overshoot_budget(self):
+        """Test parallel creates racing for the last headroom stop exactly at the limit"""
+        import threading
+        self._use_file_db()
+        self.client.put('/budget', json={"limit": 100})
+        statuses = []
+
+        def create(worker):
+            client = self.app.test_client()
+            for i in range(5):
+                res = client.post('/subscriptions', json={
+                    "name": f"w{worker}-{i}", "price": 10, "frequency": "Monthly", "category": "Race"})
+                statuses.append(res.status_code)
+
+        threads = [threading.Thread(target=create, args=(w,)) for w in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(statuses.count(201), 10)
+        self.assertEqual(statuses.count(400), 30)
+        status = json.loads(self.client.get('/budget/status').data)
+        self.assertEqual(status['current_spending'], 100)
+        with self.app.app_context():
+            from app.spend import reconcile
+            self.assertTrue(reconcile(fix=False)['in_sync'])
+
+    # =================================================================
+    # 18. SEARCH
+    # =================================================================
+
+    def _search(self, query, **headers):
+        return json.loads(self.client.get(f'/subscriptions/search?{query}', headers=headers).data)
+
+    def test_search_prefix_fuzzy_and_ranking(self):
+        """Test prefix and fuzzy matching, name hits ranked above category hits"""
+        self.client.post('/subscriptions', json={"name": "Netflix Premium", "price": 20,
+                                                  "frequency": "Monthly", "category": "Video"})
+        self.client.post('/subscriptions', json={"name": "Crunchyroll", "price": 8,
+                                                  "frequency": "Monthly", "category": "Netflix Alternatives"})
+        self.client.post('/subscriptions', json={"name": "Spotify", "price": 10,
+                                                  "frequency": "Monthly", "category": "Music"})
+
+        data = self._search("q=netf")
+        self.assertEqual(data['mode'], "prefix")
+        self.assertEqual([r['name'] for r in data['results']], ["Netflix Premium", "Crunchyroll"])
+        self.assertEqual([r['name'] for r in self._search("q=net+prem")['results']], ["Netflix Premium"])
+
+        data = self._search("q=spotfy")
+        self.assertEqual(data['mode'], "fuzzy")
+        self.assertEqual(data['results'][0]['name'], "Spotify")
+
+        self.assertEqual(self.client.get('/subscriptions/search?q=%20').status_code, 400)
+
+        # Within a tier by relevance, not insertion order: the shorter name is the closer match
+        self.client.post('/subscriptions', json={"name": "Netflix", "price": 10,
+                                                  "frequency": "Monthly", "category": "Video"})
+        self.assertEqual([r['name'] for r in self._search("q=netflix")['results']],
+                         ["Netflix", "Netflix Premium", "Crunchyroll"])
+
+    def test_search_like_fallback_is_literal(self):
+        """Test the LIKE fallback treats % and _ in the query as plain characters"""
+        from app.search import _like_ids
+        a_b = json.loads(self._post_sub("a_b", 1).data)['subscription']['id']
+        self._post_sub("axb", 1)
+        self._post_sub("50% off", 1)
+        with self.app.app_context():
+            self.assertEqual(_like_ids("a_b", "default", 10, 0), [a_b])
+            self.assertEqual(len(_like_ids("%", "default", 10, 0)), 1)
+
+    def test_search_index_follows_writes_and_pages(self):
+        """Test the index tracks update/delete/bulk import, tenants and offset paging"""
+        res = self._post_sub("Old Name", 5)
+        sub_id = json.loads(res.data)['subscription']['id']
+        self.client.put(f'/subscriptions/{sub_id}', json={"name": "Renamed Plan"})
+        self.assertEqual(self._search("q=old")['results'], [])
+        self.assertEqual(len(self._search("q=renamed")['results']), 1)
+        self.client.delete(f'/subscriptions/{sub_id}')
+        self.assertEqual(self._search("q=renamed")['results'], [])
+
+        self.client.post('/subscriptions/bulk', json=[
+            {"name": f"Plan {i}", "price": 1, "frequency": "Monthly", "category": "Bulk"} for i in range(5)])
+        first = self._search("q=plan&limit=3")
+        self.assertEqual(len(first['results']), 3)
+        second = self._search(f"q=plan&limit=3&offset={first['next_offset']}")
+        self.assertEqual(len(second['results']), 2)
+        self.assertIsNone(second['next_offset'])
+        self.assertEqual(self._search("q=plan", **{"X-Tenant-ID": "other"})['results'], [])
+        self.client.post('/subscriptions', headers={"X-Tenant-ID": "acme-corp"}, json={
+            "name": "Spotify", "price": 10, "frequency": "Monthly", "category": "Music"})
+        data = self._search("q=spotfy", **{"X-Tenant-ID": "acme-corp"})
+        self.assertEqual([r['name'] for r in data['results']], ["Spotify"])
+
+    # =================================================================
+    # 19. FILTERS, SORTING & COUNT
+    # =================================================================
+
+    def _names(self, query):
+        return [r['name'] for r in json.loads(self.client.get(f'/subscriptions?{query}').data)]
+
+    def test_list_filters_sort_and_count(self):
+        """Test status/frequency/category/price filters, monthly-price sort with paging, count"""
+        self._post_sub("Netflix", 15)
+        self._post_sub("Gym", 120, frequency="Yearly")
+        self._post_sub("Coffee", 5, frequency="Weekly")
+        self._post_sub("Old Radio", 8, status="Cancelled")
+        self.client.post('/subscriptions', json={"name": "Spotify", "price": 10,
+                                                  "frequency": "Monthly", "category": "Music"})
+
+        self.assertEqual(self._names("status=Active&frequency=Weekly,Yearly"), ["Gym", "Coffee"])
+        self.assertEqual(self._names("category=music&category=Test&status=Cancelled"), ["Old Radio"])
+        self.assertEqual(self._names("min_price=10&max_price=15"), ["Netflix", "Spotify"])
+        # Monthly: Netflix 15, Gym 10, Coffee 20, Old Radio 8, Spotify 10; ties go by id, same direction
+        self.assertEqual(self._names("min_monthly_price=10&max_monthly_price=15&sort=-monthly_price"),
+                         ["Netflix", "Spotify", "Gym"])
+
+        res = self.client.get('/subscriptions?sort=-monthly_price&limit=2')
+        self.assertEqual([r['name'] for r in json.loads(res.data)], ["Coffee", "Netflix"])
+        after = res.headers['X-Next-After']
+        self.assertEqual(self._names(f"sort=-monthly_price&limit=2&after={after}"), ["Spotify", "Gym"])
+
+        res = self.client.get('/subscriptions?status=Active&count=true')
+        self.assertEqual(json.loads(res.data), {"count": 4})
+        self.assertEqual(self.client.get('/subscriptions?sort=color').status_code, 400)
+        self.assertEqual(self.client.get('/subscriptions?status=Sleeping').status_code, 400)
+        self.assertEqual(self.client.get('/subscriptions?min_price=cheap').status_code, 400)
+
+    # =================================================================
+    # 20. BULK STATUS CHANGE & DELETE
+    # =================================================================
+
+    def _spend_in_sync(self):
+        with self.app.app_context():
+            from app.spend import reconcile
+            return reconcile(fix=False)['in_sync']
+
+    def test_bulk_status_change(self):
+        """Test PATCH by filter and by ids keeps spend, budget and history consistent"""
+        ids = [json.loads(self._post_sub(f"Plan {i}", 10).data)['subscription']['id'] for i in range(3)]
+        self.client.post('/subscriptions', json={"name": "Spotify", "price": 10,
+                                                  "frequency": "Monthly", "category": "Music"})
+
+        res = self.client.patch('/subscriptions?category=Test', json={"status": "Paused"})
+        self.assertEqual(json.loads(res.data)['ids'], ids)
+        with self.app.app_context():
+            from app.spend import get_spend
+            self.assertEqual(get_spend(), {'USD': (12000, 1)})
+        self.assertTrue(self._spend_in_sync())
+        # Already paused rows are not touched again
+        res = self.client.patch('/subscriptions?category=Test', json={"status": "Paused"})
+        self.assertEqual(json.loads(res.data)['updated'], 0)
+
+        # Reactivating all three would exceed the budget: nothing changes
+        self.client.put('/budget', json={"limit": 30})
+        res = self.client.patch('/subscriptions', json={"status": "Active", "ids": ids})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self._names("status=Paused"), ["Plan 0", "Plan 1", "Plan 2"])
+        # A date left behind while paused is recomputed on reactivation, as PUT does
+        from datetime import date, timedelta
+        with self.app.app_context():
+            db.session.execute(db.update(Subscription).where(Subscription.id == ids[0])
+                               .values(next_charge_at=date.today() - timedelta(days=40)))
+            db.session.commit()
+        res = self.client.patch('/subscriptions', json={"status": "Active", "ids": ids[:2]})
+        self.assertEqual(json.loads(res.data)['updated'], 2)
+        self.assertTrue(self._spend_in_sync())
+        with self.app.app_context():
+            self.assertGreaterEqual(db.session.get(Subscription, ids[0]).next_charge_at, date.today())
+
+        with self.app.app_context():
+            from app.models import SubscriptionEvent
+            kinds = [e.kind for e in SubscriptionEvent.query.filter_by(subscription_id=ids[0])]
+            self.assertEqual(kinds, ["created", "updated", "updated"])
+
+        self.assertEqual(self.client.patch('/subscriptions', json={"status": "Paused"}).status_code, 400)
+        self.assertEqual(self.client.patch('/subscriptions', json={"status": "Gone", "ids": ids}).status_code, 400)
+        self.assertEqual(self.client.patch('/subscriptions', json=ids).status_code, 400)
+        self.assertEqual(self.client.delete('/subscriptions', json=ids).status_code, 400)
+
+    def test_bulk_delete(self):
+        """Test DELETE by ids and by filter, scoped to the tenant"""
+        ids = [json.loads(self._post_sub(f"Plan {i}", 10).data)['subscription']['id'] for i in range(3)]
+        self._post_sub("Weekly Plan", 5, frequency="Weekly")
+        other = self.client.post('/subscriptions', headers={"X-Tenant-ID": "other"}, json={
+            "name": "Theirs", "price": 1, "frequency": "Monthly", "category": "Test"})
+        other_id = json.loads(other.data)['subscription']['id']
+
+        res = self.client.delete('/subscriptions', json={"ids": [ids[0], other_id]})
+        self.assertEqual(json.loads(res.data), {"message": "Deleted", "deleted": 1, "ids": [ids[0]]})
+        res = self.client.delete('/subscriptions?frequency=Monthly&max_price=10')
+        self.assertEqual(json.loads(res.data)['ids'], ids[1:])
+
+        self.assertEqual(self._names("category=Test"), ["Weekly Plan"])
+        self.assertEqual(self._search("q=plan")['results'][0]['name'], "Weekly Plan")
+        self.assertTrue(self._spend_in_sync())
+        self.assertEqual(self.client.get(f'/subscriptions/{other_id}', headers={"X-Tenant-ID": "other"}).status_code, 200)
+        self.assertEqual(self.client.delete('/subscriptions').status_code, 400)
+
+    # =================================================================
+    # 21. MONEY IN MINOR UNITS
+    # =================================================================
+
+    def test_money_is_exact(self):
+        """Test integer minor units: exact budget boundary, exact /12, no silent rounding"""
+        self.client.put('/budget', json={"limit": 0.3})
+        self.assertEqual(self._post_sub("A", 0.1).status_code, 201)
+        # 0.1 + 0.2 > 0.3 in floats
+        self.assertEqual(self._post_sub("B", 0.2).status_code, 201)
+        self.assertEqual(self._post_sub("C", 0.01).status_code, 400)
+        status = json.loads(self.client.get('/budget/status').data)
+        self.assertEqual([status[k] for k in ('current_spending', 'remaining_budget', 'usage_percent')], [0.3, 0, 100])
+
+        # Twelve yearly plans of 1.00 are exactly 1.00 a month, not 12 x 0.08
+        self.client.put('/budget', json={"limit": 100})
+        for i in range(12):
+            self._post_sub(f"Yearly {i}", 1, frequency="Yearly")
+        data = json.loads(self.client.get('/analytics?group_by=frequency').data)
+        self.assertEqual((data['total_price_per_month'], data['total_price_per_year']), (1.3, 15.6))
+        self.assertIn({"frequency": "Yearly", "monthly_total": 1.0, "count": 12}, data['breakdown'])
+
+        self.assertEqual(self._post_sub("Too precise", 9.999).status_code, 400)
+        # Beyond what the 64-bit columns can hold: refused, not a 500
+        self.assertEqual(self._post_sub("Too large", "1e20").status_code, 400)
+        res = self.client.post('/subscriptions/bulk', json=[
+            {"name": "Huge", "price": 1e300, "frequency": "Monthly", "category": "Test"}])
+        self.assertEqual(res.status_code, 400)
+        sub = json.loads(self._post_sub("From string", "12.50").data)['subscription']
+        self.assertEqual((sub['price'], sub['currency']), (12.5, "USD"))
+        with self.app.app_context():
+            self.assertEqual(Subscription.query.filter_by(name="From string").one().price_minor, 1250)
+
+    def test_minor_unit_conversion(self):
+        """Test to_minor/from_minor follow each currency's minor unit"""
+        from app.money import from_minor, monthly_amount, to_minor
+        self.assertEqual(to_minor("1999", "JPY"), 1999)
+        self.assertEqual(to_minor(1.5, "KWD"), 1500)
+        self.assertEqual(from_minor(1999, "JPY"), 1999)
+        for bad in ("1.5", -1, "abc", True, float("nan"), "1e20", 1e300):
+            with self.assertRaises(ValueError):
+                to_minor(bad, "JPY")
+        # Yearly cents / 12, halves away from zero like SQL ROUND
+        self.assertEqual(monthly_amount(1001, "USD"), 0.83)
+        self.assertEqual(monthly_amount(-6, "USD"), -0.01)
+
+    # =================================================================
+    # 22. MULTI-CURRENCY & FX RATES
+    # =================================================================
+
+    def _load_rates(self, rates, base="USD"):
+        import os, tempfile
+        from app import fx
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "rates.json")
+        with open(path, "w") as f:
+            json.dump({"base": base, "date": "2026-10-01", "rates": rates}, f)
+        with self.app.app_context():
+            return fx.load_file(path)
+
+    def _post_priced(self, name, price, currency):
+        return self.client.post('/subscriptions', json={
+            "name": name, "price": price, "frequency": "Monthly", "category": "Test", "currency": currency})
+
+    def test_multi_currency_totals(self):
+        """Test per-currency sums converted once into ?currency, for analytics and budget"""
+        self.assertEqual(self._post_priced("Euro Plan", 10, "EUR").status_code, 400)
+        self.assertEqual(self._load_rates({"EUR": "0.5", "JPY": 150}), 3)
+
+        self._post_sub("Dollar Plan", 10)
+        self.assertEqual(self._post_priced("Euro Plan", 10, "eur").status_code, 201)    # 20 USD
+        self.assertEqual(self._post_priced("Yen Plan", 1500, "JPY").status_code, 201)   # 10 USD
+        self.assertEqual(self._post_priced("Pound Plan", 10, "GBP").status_code, 400)
+
+        data = json.loads(self.client.get('/analytics?top=1').data)
+        self.assertEqual((data['currency'], data['total_price_per_month'], data['active_subscriptions']), ("USD", 40, 3))
+        # Ranked by the converted amount, not by raw minor units (the yen plan has the most)
+        self.assertEqual(data['breakdown'], [{"name": "Euro Plan", "monthly_equivalent": 20}])
+        data = json.loads(self.client.get('/analytics?currency=JPY&group_by=frequency').data)
+        self.assertEqual(data['total_price_per_month'], 6000)
+        self.assertEqual(data['breakdown'], [{"frequency": "Monthly", "monthly_total": 6000, "count": 3}])
+        self.assertEqual(self.client.get('/analytics?currency=XYZ').status_code, 400)
+        self.assertEqual(self.client.get('/analytics?currency=euro').status_code, 400)
+
+        # The budget is checked in its own currency
+        self.client.put('/budget', json={"limit": 45})
+        self.assertEqual(self._post_priced("Too Much", 3, "EUR").status_code, 400)
+        self.assertEqual(self._post_priced("Just Fits", 2.5, "EUR").status_code, 201)
+        status = json.loads(self.client.get('/budget/status?currency=EUR').data)
+        self.assertEqual(status, {"currency": "EUR", "monthly_budget": 22.5, "current_spending": 22.5,
+                                  "remaining_budget": 0, "usage_percent": 100})
+
+        history = json.loads(self.client.get('/analytics/history?currency=EUR').data)
+        self.assertEqual(history['points'][-1]['monthly_total'], 22.5)
+        with self.app.app_context():
+            from app.spend import get_spend
+            self.assertEqual(sorted(get_spend()), ["EUR", "JPY", "USD"])
+        self.assertTrue(self._spend_in_sync())
+
+    def test_fx_rates_and_currency_change(self):
+        """Test rate memo, reloads and moving a subscription to another currency"""
+        from decimal import Decimal
+        from app import fx
+        self._load_rates({"EUR": "0.5", "JPY": "150"})
+        with self.app.app_context():
+            self.assertEqual(fx.rate("EUR", "JPY"), Decimal(300))
+            self.assertEqual(fx.convert(100, "USD", "JPY"), 150)
+            self.assertEqual(fx.convert(1, "JPY", "USD"), 1)
+            with self.assertRaises(fx.UnknownCurrency):
+                fx.rate("USD", "GBP")
+
+        sub = json.loads(self._post_sub("Netflix", 12.5).data)['subscription']
+        etag = self.client.get('/analytics?currency=EUR').headers['ETag']
+        self._load_rates({"EUR": "0.25", "JPY": "150"})
+        res = self.client.get('/analytics?currency=EUR', headers={"If-None-Match": etag})
+        self.assertEqual(json.loads(res.data)['total_price_per_month'], 3.13)
+
+        # A new currency alone keeps the amount; JPY has no decimals for 12.50
+        res = self.client.put(f"/subscriptions/{sub['id']}", json={"currency": "EUR"})
+        self.assertEqual(json.loads(res.data)['subscription']['price'], 12.5)
+        self.assertEqual(self.client.put(f"/subscriptions/{sub['id']}", json={"currency": "JPY"}).status_code, 400)
+        self.assertEqual(self.client.put(f"/subscriptions/{sub['id']}", json={"currency": "JPY", "price": 2000}).status_code, 200)
+        self.assertTrue(self._spend_in_sync())
+        history = json.loads(self.client.get('/analytics/history?currency=JPY').data)
+        self.assertEqual(history['points'][-1]['monthly_total'], 2000)
+        # Price bounds are read in the filtered currency's minor unit
+        self.assertEqual(self._names("currency=JPY&min_price=2000"), ["Netflix"])
+        self.assertEqual(self._names("currency=USD"), [])
+
+    # =================================================================
+    # 23. BACKGROUND JOBS
+    # =================================================================
+
+    def test_jobs_retry_then_fail(self):
+        """Test jobs commit with the write, retry with backoff, end failed, and show up in /metrics"""
+        from app import jobs
+        from app.models import Job
+        calls = []
+
+        @jobs.task('test_flaky')
+        def flaky(payloads, tenant):
+            calls.append((payloads, tenant))
+            if len(calls) < 2:
+                raise RuntimeError('boom')
+        self.addCleanup(jobs.TASKS.pop, 'test_flaky')
+
+        with self.app.app_context():
+            jobs.enqueue(db.session, 'test_flaky', {"n": 1}, 'acme')
+            db.session.rollback()
+            jobs.enqueue(db.session, 'test_flaky', {"n": 2}, 'acme')
+            db.session.commit()
+        # Ran inline when the context ended: failed once, waiting for its retry
+        self.assertEqual(calls, [([{"n": 2}], 'acme')])
+        with self.app.app_context():
+            job = Job.query.one()
+            self.assertEqual((job.status, job.attempts), ('pending', 1))
+            self.assertIn('boom', job.error)
+            self.assertIn('jobs_queued{kind="test_flaky",status="pending"} 1', self.client.get('/metrics').text)
+
+            db.session.execute(db.update(Job).values(run_after=jobs.utcnow()))
+            db.session.commit()
+            self.assertEqual(jobs.drain(), 1)
+            self.assertEqual(Job.query.count(), 0)
+
+            self.app.config['JOBS_MAX_ATTEMPTS'] = 1
+            jobs.enqueue(db.session, 'no_such_kind')
+            db.session.commit()
+        with self.app.app_context():
+            self.assertEqual(Job.query.one().status, 'failed')
+        metrics = self.client.get('/metrics').text
+        self.assertIn('jobs_processed_total{kind="test_flaky",result="done"} 1', metrics)
+        self.assertIn('jobs_processed_total{kind="no_such_kind",result="failed"} 1', metrics)
+
+    def test_worker_threads_fold_rollups(self):
+        """Test the thread pool drains follow-up jobs, and out-of-order folds give the same rollups"""
+        import time
+        from datetime import date, timedelta
+        from app.history import _bump_rollups
+        from app.models import Job, SpendRollup
+        self._use_file_db()
+        self.assertFalse(self.app.extensions['jobs'].inline)
+        self.client.put('/budget', json={"limit": 15})
+        self._post_sub("Netflix", 10)
+        self.assertEqual(self._post_sub("Too much", 10).status_code, 400)
+
+        with self.app.app_context():
+            deadline = time.monotonic() + 10
+            while Job.query.count() and time.monotonic() < deadline:
+                db.session.rollback()
+                time.sleep(0.05)
+            self.assertEqual(Job.query.count(), 0)
+            self.assertEqual([r.yearly_closing for r in SpendRollup.query], [12000, 12000])
+
+            # A fold for an earlier day arriving late still carries into later closings
+            today, earlier = date.today(), date.today() - timedelta(days=3)
+            series = ("default", "day")
+            _bump_rollups(db.session.connection(), {(*series, earlier, "USD", 1): (600, 1)})
+            db.session.commit()
+            closings = dict(db.session.execute(
+                db.select(SpendRollup.period, SpendRollup.yearly_closing).where(SpendRollup.granularity == "day")
+            ).all())
+            self.assertEqual(closings, {earlier: 600, today: 12600})
+
+    # =================================================================
+    # 24. BUDGET THRESHOLD ALERTS
+    # =================================================================
+
+    def _budget_events(self, query="wait=0", **kwargs):
+        return json.loads(self.client.get(f'/budget/events?{query}', **kwargs).data)
+
+    def test_budget_threshold_events(self):
+        """Test crossings are recorded once per threshold, both ways, and read from the feed"""
+        self.assertEqual(self.client.put('/budget', json={"limit": 100, "thresholds": [0]}).status_code, 400)
+        self.assertEqual(self.client.put('/budget', json={"limit": 100, "thresholds": "80"}).status_code, 400)
+        res = self.client.put('/budget', json={"limit": 100, "thresholds": [100, 50, 80, 80]})
+        self.assertEqual(json.loads(res.data)['thresholds'], [50, 80, 100])
+
+        self._post_sub("Netflix", 40)
+        self.assertEqual(self._budget_events()["events"], [])
+        self._post_sub("Spotify", 15)
+        gym_id = json.loads(self._post_sub("Gym", 30).data)['subscription']['id']
+        self.client.delete(f'/subscriptions/{gym_id}')
+
+        feed = self._budget_events()
+        self.assertEqual([(e["threshold"], e["direction"], e["usage_percent"]) for e in feed["events"]],
+                         [(50, "up", 55), (80, "up", 85), (80, "down", 55)])
+        self.assertEqual(feed["events"][0]["current_spending"], 55)
+        self.assertEqual(self._budget_events(f"after={feed['last_id']}&wait=0.1"),
+                         {"events": [], "last_id": feed["last_id"]})
+        self.assertEqual(self._budget_events(headers={'X-Tenant-ID': 'acme'})["events"], [])
+        for wait in ("nan", "inf", "-inf", "soon"):
+            self.assertEqual(self.client.get(f'/budget/events?wait={wait}').status_code, 400)
+
+        # A lower limit crosses too: 55 of 50 passes 80 and 100 at once, thresholds kept
+        self.client.put('/budget', json={"limit": 50})
+        res = self.client.get('/budget/events?wait=0', headers={'Accept': 'text/event-stream',
+                                                                'Last-Event-ID': str(feed['last_id'])})
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        body = res.get_data(as_text=True)
+        self.assertEqual(body.count('event: budget.threshold'), 2)
+        self.assertIn('"threshold":100,"direction":"up","usage_percent":110', body.replace(' ', ''))
+
+    def test_budget_events_long_poll_wakes_on_commit(self):
+        """Test a waiting GET /budget/events returns as soon as another request commits a crossing"""
+        import threading, time
+        self._use_file_db()
+        self.client.put('/budget', json={"limit": 10})
+        writer = threading.Timer(0.2, lambda: self.app.test_client().post('/subscriptions', json={
+            "name": "Netflix", "price": 10, "frequency": "Monthly", "category": "Test"}))
+        writer.start()
+        start = time.monotonic()
+        feed = self._budget_events("wait=10")
+        self.assertLess(time.monotonic() - start, 5)
+        writer.join()
+        self.assertEqual([e["threshold"] for e in feed["events"]], [50, 80, 100])
+
+    def test_budget_webhook_outbox(self):
+        """Test crossings are POSTed to the webhook in batches, retried until it accepts them"""
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from app import jobs
+        from app.models import BudgetEvent, Job
+        received = []
+
+        class Stub(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                received.append(body)
+                # The first delivery fails
+                self.send_response(500 if len(received) == 1 else 204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.app.config.update(BUDGET_WEBHOOK_URL=f'http://127.0.0.1:{server.server_port}/hook',
+                               BUDGET_WEBHOOK_BATCH=2)
+
+        self.client.put('/budget', json={"limit": 10})
+        self._post_sub("Netflix", 10)
+        self.assertEqual(len(received), 1)
+        with self.app.app_context():
+            self.assertEqual(Job.query.one().attempts, 1)
+            self.assertEqual(BudgetEvent.query.filter(BudgetEvent.delivered_at.is_(None)).count(), 3)
+
+            db.session.execute(db.update(Job).values(run_after=jobs.utcnow()))
+            db.session.commit()
+            self.assertEqual(jobs.drain(), 1)
+            self.assertEqual(Job.query.count(), 0)
+            self.assertEqual(BudgetEvent.query.filter(BudgetEvent.delivered_at.is_(None)).count(), 0)
+        self.assertEqual([[e["threshold"] for e in body["events"]] for body in received[1:]], [[50, 80], [100]])
+        self.assertEqual(received[1]["tenant"], "default")
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file